@@ -0,0 +1,312 @@
+"""
+Documents and photos forwarded to OpenCode
+
+Files sent to the bot are downloaded from Telegram's file API in chunks
+straight to a disk cache, never held whole in memory, and reach OpenCode as
+file parts whose base64 data URL is streamed from disk into the message
+request body. The cache is keyed by file_unique_id, so the same file sent
+again is not downloaded again; it is bounded in bytes and evicts the least
+recently used files, skipping those pinned by a request still sending them.
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+from telegram import Bot
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from disk per base64 chunk; a multiple of 3 encodes without padding
+ENCODE_CHUNK = 48 * 1024
+_UNSAFE = re.compile(r"[^A-Za-z0-9_-]")
+
+
+class FileTooLarge(Exception):
+    """A file exceeds the configured size cap"""
+
+
+def format_size(size: int) -> str:
+    """Short human size: 512 bytes, 300 KB, 20 MB"""
+    for unit, scale in (("MB", 2**20), ("KB", 2**10)):
+        if size >= scale:
+            return f"{size // scale} {unit}"
+    return f"{size} bytes"
+
+
+class Attachment:
+    """A document or photo in a Telegram message"""
+
+    __slots__ = ("file_id", "file_unique_id", "name", "mime", "size")
+
+    def __init__(
+        self,
+        file_id: str,
+        file_unique_id: str,
+        name: str,
+        mime: str,
+        size: Optional[int] = None,
+    ):
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.name = name
+        self.mime = mime
+        self.size = size
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Attachment":
+        return cls(**data)
+
+
+def message_attachment(message: dict) -> Optional[Attachment]:
+    """The document or largest photo size in a message, if it has one"""
+    document = message.get("document")
+    if document is not None:
+        return Attachment(
+            document["file_id"],
+            document["file_unique_id"],
+            document.get("file_name") or "document",
+            document.get("mime_type") or "application/octet-stream",
+            document.get("file_size"),
+        )
+    photo = message.get("photo")
+    if photo:
+        # Sizes are listed smallest first
+        largest = photo[-1]
+        return Attachment(
+            largest["file_id"],
+            largest["file_unique_id"],
+            f"photo_{largest['file_unique_id']}.jpg",
+            "image/jpeg",
+            largest.get("file_size"),
+        )
+    return None
+
+
+class FileCache:
+    """Disk LRU of downloaded Telegram files, keyed by file_unique_id
+
+    max_file_bytes caps each file and max_bytes the whole cache; at most
+    concurrency downloads run at once. Fetched files are pinned, and never
+    evicted, until released.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        directory: str,
+        max_file_bytes: int = 20 * 1024 * 1024,
+        max_bytes: int = 200 * 1024 * 1024,
+        concurrency: int = 4,
+    ):
+        self.bot = bot
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.max_bytes = max_bytes
+        self.size = 0
+        # file_unique_id -> size, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        # file_unique_id -> number of requests still using the file
+        self._pins: Dict[str, int] = {}
+        self._downloads: Dict[str, asyncio.Future] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(max_connections=concurrency),
+        )
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        """Index files left by a previous run, oldest first"""
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".part"):
+                os.unlink(entry.path)
+            elif entry.is_file():
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.size += size
+        self._evict()
+
+    def _too_large(self, attachment: Attachment) -> FileTooLarge:
+        metrics.FILE_DOWNLOADS.inc(result="too_large")
+        return FileTooLarge(
+            f"{attachment.name} is too large (max {format_size(self.max_file_bytes)})"
+        )
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    @staticmethod
+    def _key(attachment: Attachment) -> str:
+        return _UNSAFE.sub("_", attachment.file_unique_id)
+
+    async def fetch_all(
+        self, attachments: List[Attachment]
+    ) -> List[Tuple[Attachment, str]]:
+        """Each attachment with the path of its content on disk, pinned
+
+        The files stay in the cache until passed to release(). Raises
+        FileTooLarge if one is over max_file_bytes, pinning none of them.
+        """
+        paths = []
+        try:
+            for attachment in attachments:
+                paths.append((attachment, await self.fetch(attachment)))
+        except BaseException:
+            self.release(attachment for attachment, _ in paths)
+            raise
+        return paths
+
+    async def fetch(self, attachment: Attachment) -> str:
+        """Path of attachment's content on disk, pinned until released
+
+        Downloads the file if needed. Raises FileTooLarge if it is over
+        max_file_bytes.
+        """
+        key = self._key(attachment)
+        # Pinned before any await so a concurrent eviction cannot take it
+        self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            return await self._fetch(attachment, key)
+        except BaseException:
+            self._unpin(key)
+            raise
+
+    def release(self, attachments: Iterable[Attachment]) -> None:
+        """Unpin files returned by fetch once the request using them is sent"""
+        for attachment in attachments:
+            self._unpin(self._key(attachment))
+        # Files kept while pinned may have left the cache over its size
+        self._evict()
+
+    def _unpin(self, key: str) -> None:
+        count = self._pins.get(key, 0) - 1
+        if count > 0:
+            self._pins[key] = count
+        else:
+            self._pins.pop(key, None)
+
+    async def _fetch(self, attachment: Attachment, key: str) -> str:
+        if key in self._entries and os.path.exists(self._path(key)):
+            self._entries.move_to_end(key)
+            metrics.FILE_DOWNLOADS.inc(result="cached")
+            return self._path(key)
+        if attachment.size and attachment.size > self.max_file_bytes:
+            raise self._too_large(attachment)
+
+        # The same file sent twice at once is downloaded once
+        pending = self._downloads.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._downloads[key] = future
+        try:
+            async with self._semaphore:
+                path = await self._download(attachment, key)
+            future.set_result(path)
+            return path
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieved here so a future nobody else awaited does not warn
+            future.exception()
+            raise
+        finally:
+            del self._downloads[key]
+
+    async def _download(self, attachment: Attachment, key: str) -> str:
+        started = time.perf_counter()
+        file = await self.bot.get_file(attachment.file_id)
+        if file.file_size and file.file_size > self.max_file_bytes:
+            raise self._too_large(attachment)
+        partial = self._path(key) + ".part"
+        size = 0
+        try:
+            async with self._client.stream("GET", file.file_path) as response:
+                response.raise_for_status()
+                with open(partial, "wb") as f:
+                    async for chunk in response.aiter_bytes():
+                        size += len(chunk)
+                        if size > self.max_file_bytes:
+                            raise self._too_large(attachment)
+                        f.write(chunk)
+            os.replace(partial, self._path(key))
+        except BaseException:
+            if os.path.exists(partial):
+                os.unlink(partial)
+            raise
+        if key in self._entries:
+            self.size -= self._entries.pop(key)
+        self._entries[key] = size
+        self.size += size
+        self._evict()
+        metrics.FILE_DOWNLOADS.inc(result="downloaded")
+        metrics.FILE_DOWNLOAD_BYTES.inc(size)
+        logger.info(
+            "Downloaded %s (%s bytes) in %.2fs",
+            attachment.name,
+            size,
+            time.perf_counter() - started,
+        )
+        return self._path(key)
+
+    def _evict(self) -> None:
+        for key in list(self._entries):
+            if self.size <= self.max_bytes:
+                break
+            if key in self._pins:
+                continue
+            self.size -= self._entries.pop(key)
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+async def message_body(
+    fields: dict, text: str, files: List[Tuple[Attachment, str]]
+) -> AsyncIterator[bytes]:
+    """JSON body of an OpenCode message with text and file parts
+
+    fields are the other top-level members (model, agent). Each file is a
+    part with a base64 data URL, encoded from disk chunk by chunk as the
+    body is sent.
+    """
+    head = json.dumps(fields)[:-1]
+    yield (head + (", " if fields else "") + '"parts": [').encode()
+    separator = b""
+    if text:
+        yield json.dumps({"type": "text", "text": text}).encode()
+        separator = b", "
+    for attachment, path in files:
+        part = {"type": "file", "mime": attachment.mime, "filename": attachment.name}
+        yield separator + json.dumps(part)[:-1].encode()
+        # The URL string is left open for the base64 chunks
+        yield b', "url": ' + json.dumps(f"data:{attachment.mime};base64,")[:-1].encode()
+        with open(path, "rb") as f:
+            while chunk := f.read(ENCODE_CHUNK):
+                yield base64.b64encode(chunk)
+        yield b'"}'
+        separator = b", "
+    yield b"]}"
@@ -0,0 +1,186 @@
+"""
+OpenCode backends
+
+A bridge can spread users over several `opencode serve` instances. Each
+backend has its own HTTP client and pool of idle sessions; a user's session
+lives on one backend, so every request for it must go back to that backend.
+
+BackendPool places new sessions on the least-loaded healthy backend and
+probes every backend in the background with GET /session. A backend that
+fails a probe or refuses a connection is taken out of rotation until a
+probe succeeds again, and one whose circuit breaker is open gets no new
+sessions while it stays open.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+import metrics
+from resilience import CircuitBreaker
+from session_pool import SessionPool
+from streaming import SessionEventStream
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest sample in the latency moving average
+EWMA_ALPHA = 0.3
+# Separates session ID and backend URL in a pinned session value
+PIN_SEPARATOR = "@"
+
+
+def backend_urls(default: str) -> List[str]:
+    """OpenCode URLs from OPENCODE_URLS (comma-separated), else [default]"""
+    urls = [u.strip() for u in os.getenv("OPENCODE_URLS", "").split(",")]
+    return [u for u in urls if u] or [default]
+
+
+class BackendUnavailable(Exception):
+    """The backend could not be reached; the request never got to it"""
+
+    def __init__(self, backend: "Backend", error: Exception):
+        super().__init__(f"OpenCode backend {backend.url} is unavailable: {error}")
+        self.backend = backend
+
+
+class SessionNotFound(Exception):
+    """The backend no longer has the session, e.g. its data was wiped"""
+
+    def __init__(self, backend: "Backend", session_id: str):
+        super().__init__(f"Session {session_id} not found on {backend.url}")
+        self.backend = backend
+
+
+class Backend:
+    """One OpenCode server with its client, idle session pool and load stats"""
+
+    def __init__(self, url: str, client: httpx.AsyncClient):
+        self.url = url
+        self.client = client
+        self.session_pool: Optional[SessionPool] = None
+        self.breaker: Optional[CircuitBreaker] = None
+        # Shared event subscription for streamed replies, if streaming is on
+        self.events: Optional[SessionEventStream] = None
+        self.healthy = True
+        self.inflight = 0
+        # Moving average of short round trips (probes, session creation)
+        self.latency = 0.0
+
+    def observe(self, seconds: float) -> None:
+        if self.latency:
+            self.latency += EWMA_ALPHA * (seconds - self.latency)
+        else:
+            self.latency = seconds
+
+    @property
+    def load(self) -> float:
+        """Lower is better: queued work scaled by how slowly it responds"""
+        return (self.inflight + 1) * (self.latency or 0.001)
+
+    @property
+    def accepting(self) -> bool:
+        """Healthy and not failing fast, so a good place for new sessions"""
+        return self.healthy and (
+            self.breaker is None or self.breaker.state == CircuitBreaker.CLOSED
+        )
+
+    def mark_down(self, reason: object) -> None:
+        if self.healthy:
+            metrics.ERRORS.inc(kind="backend_down")
+            logger.warning("OpenCode backend %s is down: %s", self.url, reason)
+        self.healthy = False
+
+    def mark_up(self) -> None:
+        if not self.healthy:
+            logger.info("OpenCode backend %s is back up", self.url)
+        self.healthy = True
+
+    def __repr__(self) -> str:
+        return f"Backend({self.url})"
+
+
+class BackendPool:
+    """Health-checked set of backends with least-loaded placement"""
+
+    def __init__(self, backends: List[Backend], probe_timeout: float = 3.0):
+        self.backends = backends
+        self.probe_timeout = probe_timeout
+        self._by_url: Dict[str, Backend] = {b.url: b for b in backends}
+        metrics.BACKEND_UP.set_function(
+            lambda: {(b.url,): int(b.healthy) for b in self.backends}
+        )
+        metrics.BACKEND_INFLIGHT.set_function(
+            lambda: {(b.url,): b.inflight for b in self.backends}
+        )
+        states = {
+            CircuitBreaker.CLOSED: 0,
+            CircuitBreaker.HALF_OPEN: 1,
+            CircuitBreaker.OPEN: 2,
+        }
+        metrics.CIRCUIT_STATE.set_function(
+            lambda: {
+                (b.url,): states[b.breaker.state] for b in self.backends if b.breaker
+            }
+        )
+
+    def __iter__(self):
+        return iter(self.backends)
+
+    def __len__(self) -> int:
+        return len(self.backends)
+
+    @property
+    def any_healthy(self) -> bool:
+        return any(b.healthy for b in self.backends)
+
+    def pin(self, session_id: str, backend: Backend) -> str:
+        """Session store value recording which backend holds session_id
+
+        With a single backend the value is the bare session ID, so the store
+        stays valid if OPENCODE_URL is later spelled differently.
+        """
+        if len(self.backends) == 1:
+            return session_id
+        return f"{session_id}{PIN_SEPARATOR}{backend.url}"
+
+    def resolve(self, value: str) -> Tuple[Optional[Backend], str]:
+        """(backend, session_id) for a stored value; backend None if unknown"""
+        session_id, _, url = value.partition(PIN_SEPARATOR)
+        if len(self.backends) == 1:
+            return self.backends[0], session_id
+        return self._by_url.get(url), session_id
+
+    def pick(self) -> Backend:
+        """Least-loaded accepting backend, falling back to healthy, then all"""
+        candidates = (
+            [b for b in self.backends if b.accepting]
+            or [b for b in self.backends if b.healthy]
+            or self.backends
+        )
+        return min(candidates, key=lambda b: b.load)
+
+    async def probe(self, backend: Backend) -> None:
+        started = time.perf_counter()
+        try:
+            response = await backend.client.get("/session", timeout=self.probe_timeout)
+            if response.status_code >= 500:
+                raise httpx.HTTPStatusError(
+                    f"HTTP {response.status_code}",
+                    request=response.request,
+                    response=response,
+                )
+        except httpx.HTTPError as e:
+            backend.mark_down(str(e) or type(e).__name__)
+            return
+        backend.observe(time.perf_counter() - started)
+        backend.mark_up()
+
+    async def run_health_checks(self, interval: float = 10.0) -> None:
+        """Probe every backend each interval seconds"""
+        while True:
+            await asyncio.gather(*(self.probe(b) for b in self.backends))
+            await asyncio.sleep(interval)
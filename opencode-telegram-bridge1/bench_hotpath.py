@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks of the per-message code paths
+
+Times the functions every message goes through: model parsing, extracting
+the answer from OpenCode's response parts, update decoding, splitting and
+assembling answers, and session-store lookups at several store sizes.
+Results can be saved as a JSON baseline and later runs compared against it;
+compare exits with status 1 when a benchmark got slower than the threshold:
+
+    python3 bench_hotpath.py run --output bench_baseline.json
+    python3 bench_hotpath.py compare bench_baseline.json --threshold 0.15
+
+Baselines are only comparable on the same machine and Python version.
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import itertools
+import statistics
+from timeit import Timer
+from typing import Callable, Dict, List, Optional
+
+from delivery import split_message
+from engine import DEFAULT_MODEL, parse_model, response_text
+from mock_telegram import FakeTelegram
+from session_store import MemorySessionStore
+from streaming import StreamAccumulator
+from updates import decode_update
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def _update_body(update: dict) -> bytes:
+    return json.dumps(update).encode()
+
+
+def _opencode_response(tool_parts: int) -> dict:
+    """A message response shaped like OpenCode's, with tool calls before the text"""
+    parts = [{"id": "prt_0", "type": "step-start"}]
+    for i in range(tool_parts):
+        parts.append(
+            {
+                "id": f"prt_t{i}",
+                "type": "tool",
+                "tool": "read",
+                "state": {"status": "completed", "input": {"filePath": f"f{i}.py"}},
+            }
+        )
+    parts.append({"id": "prt_r", "type": "reasoning", "text": "Thinking " * 40})
+    parts.append({"id": "prt_x", "type": "text", "text": "The answer. " * 80})
+    parts.append({"id": "prt_f", "type": "step-finish", "tokens": {"input": 900}})
+    return {"info": {"id": "msg_1", "role": "assistant"}, "parts": parts}
+
+
+def _answer(chars: int, fenced: bool) -> str:
+    """An answer of about chars characters, optionally with code blocks"""
+    paragraph = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 6
+    block = "```python\n" + "def f(x):\n    return x * 2\n" * 12 + "```"
+    pieces = []
+    while sum(len(piece) + 2 for piece in pieces) < chars:
+        pieces.append(paragraph)
+        if fenced:
+            pieces.append(block)
+    return "\n\n".join(pieces)
+
+
+def _stream_events(deltas: int) -> List[dict]:
+    """The event sequence of one streamed answer"""
+    events = [
+        {
+            "type": "message.updated",
+            "properties": {"info": {"id": "msg_a", "role": "assistant"}},
+        }
+    ]
+    for _ in range(deltas):
+        events.append(
+            {
+                "type": "message.part.updated",
+                "properties": {
+                    "part": {"id": "prt_a", "messageID": "msg_a", "type": "text"},
+                    "delta": "token ",
+                },
+            }
+        )
+    return events
+
+
+def _stream(events: List[dict]) -> str:
+    accumulator = StreamAccumulator()
+    for event in events:
+        accumulator.feed(event)
+    return accumulator.text
+
+
+def _session_lookup(size: int, hit: bool) -> Callable[[], object]:
+    store = MemorySessionStore(max_entries=0)
+    for user_id in range(size):
+        store.set(user_id, f"ses_{user_id:024x}")
+    rng = random.Random(size)
+    offset = 0 if hit else size
+    users = itertools.cycle([rng.randrange(size) + offset for _ in range(4096)])
+    return lambda: store.get(next(users))
+
+
+def benchmarks(sizes: List[int]) -> Dict[str, Callable[[], Callable[[], object]]]:
+    """Benchmark name -> setup returning the callable to time
+
+    Setups are only run for the benchmarks selected, since the large
+    session stores take a while to fill.
+    """
+    telegram = FakeTelegram()
+    text_update = _update_body(telegram.build_update(1, 1, "How do I run the tests?"))
+    edited = telegram.build_update(1, 1, "typo")
+    edited["edited_message"] = edited.pop("message")
+    edited_update = _update_body(edited)
+    document = telegram.build_update(1, 1, "")
+    del document["message"]["text"]
+    document["message"]["document"] = {
+        "file_id": "BQACAgIAAxkBAAIB",
+        "file_unique_id": "AgADBQAC",
+        "file_name": "notes.txt",
+        "mime_type": "text/plain",
+        "file_size": 1024,
+    }
+    document_update = _update_body(document)
+
+    short_response = _opencode_response(0)
+    tool_response = _opencode_response(20)
+    short_answer = _answer(800, fenced=False)
+    long_answer = _answer(12000, fenced=False)
+    fenced_answer = _answer(12000, fenced=True)
+    events = _stream_events(200)
+
+    cases = {
+        "parse_model": lambda: lambda: parse_model(DEFAULT_MODEL),
+        "response_text": lambda: lambda: response_text(short_response),
+        "response_text_20_tools": lambda: lambda: response_text(tool_response),
+        "decode_update_text": lambda: lambda: decode_update(text_update),
+        "decode_update_ignored": lambda: lambda: decode_update(edited_update),
+        "decode_update_document": lambda: lambda: decode_update(document_update),
+        "split_message_short": lambda: lambda: split_message(short_answer),
+        "split_message_12k": lambda: lambda: split_message(long_answer),
+        "split_message_12k_fenced": lambda: lambda: split_message(fenced_answer),
+        "stream_accumulate_200": lambda: lambda: _stream(events),
+    }
+    for size in sizes:
+        cases[f"session_get_{size}"] = lambda size=size: _session_lookup(size, True)
+        cases[f"session_miss_{size}"] = lambda size=size: _session_lookup(size, False)
+    return cases
+
+
+def measure(func: Callable[[], object], repeat: int, min_time: float) -> dict:
+    """Best and median nanoseconds per call over repeat timed rounds"""
+    timer = Timer(func)
+    number = 1
+    # Calibrate so each round runs for at least min_time
+    while timer.timeit(number) < min_time:
+        number *= 2
+    rounds = [elapsed / number * 1e9 for elapsed in timer.repeat(repeat, number)]
+    return {
+        "ns_per_op": round(min(rounds), 1),
+        "median_ns": round(statistics.median(rounds), 1),
+        "ops": number,
+    }
+
+
+def run(args) -> dict:
+    results = {}
+    for name, setup in benchmarks(args.sizes).items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(setup(), args.repeat, args.min_time)
+        print(f"   {name:30} {results[name]['ns_per_op']:>12,.1f} ns/op", flush=True)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"💾 Saved {len(results)} results to {args.output}")
+    return report
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """Print each benchmark's change; return the names that regressed"""
+    if baseline.get("python") != current.get("python"):
+        print(
+            f"⚠️ Baseline is from Python {baseline.get('python')}, "
+            f"this is {current.get('python')}"
+        )
+    regressions = []
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"   {name:30} {result['ns_per_op']:>12,.1f} ns/op  (new)")
+            continue
+        change = result["ns_per_op"] / before["ns_per_op"] - 1
+        if change > threshold:
+            verdict = "❌ REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            verdict = "✅ faster"
+        else:
+            verdict = ""
+        print(
+            f"   {name:30} {before['ns_per_op']:>12,.1f} -> "
+            f"{result['ns_per_op']:>12,.1f} ns/op  {change:+7.1%}  {verdict}"
+        )
+    return regressions
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the per-message hot path")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def timing_options(command):
+        command.add_argument(
+            "--repeat", type=int, default=5, help="Timed rounds per benchmark"
+        )
+        command.add_argument(
+            "--min-time", type=float, default=0.2, help="Minimum seconds per round"
+        )
+        command.add_argument(
+            "--sizes",
+            type=lambda value: [int(size) for size in value.split(",")],
+            default=DEFAULT_SIZES,
+            help="Comma-separated session store sizes",
+        )
+        command.add_argument("--filter", help="Only run benchmarks containing this")
+
+    run_command = commands.add_parser("run", help="Run the benchmarks")
+    timing_options(run_command)
+    run_command.add_argument("--output", help="Save the results as a JSON baseline")
+
+    compare_command = commands.add_parser(
+        "compare", help="Compare a run, or a saved result, against a baseline"
+    )
+    compare_command.add_argument("baseline")
+    compare_command.add_argument(
+        "current", nargs="?", help="Saved result to compare (default: run now)"
+    )
+    compare_command.add_argument(
+        "--threshold",
+        type=float,
+        default=0.15,
+        help="Slowdown counted as a regression (0.15 = 15%%)",
+    )
+    timing_options(compare_command)
+    compare_command.add_argument("--output", help="Also save this run's results")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        print(f"🚀 Hot path benchmarks, Python {platform.python_version()}")
+        run(args)
+        return 0
+
+    baseline = load(args.baseline)
+    if args.current:
+        current = load(args.current)
+    else:
+        print(f"🚀 Hot path benchmarks, Python {platform.python_version()}")
+        current = run(args)
+    print(f"📊 Against {args.baseline} (threshold {args.threshold:.0%})")
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print(f"❌ {len(regressions)} regressions: {', '.join(regressions)}")
+        return 1
+    print("✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
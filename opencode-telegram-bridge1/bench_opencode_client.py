@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark the OpenCode HTTP client configurations
+
+Runs the same request mix against a mock OpenCode server, in its own process
+so it does not share the client's event loop, with the previous default client
+(one flat 300s timeout, default limits), the tuned TCP client the engine now
+builds, and the tuned client over a Unix socket:
+
+    python3 bench_opencode_client.py --requests 5000 --concurrency 64
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Callable, List
+
+import httpx
+
+from engine import build_opencode_client
+from load_test import BOT_DIR, free_port, percentile
+
+
+def baseline_client(base_url: str) -> httpx.AsyncClient:
+    """The client the bridge used before transport tuning"""
+    return httpx.AsyncClient(base_url=base_url, timeout=300.0)
+
+
+async def run_client(
+    make_client: Callable[[], httpx.AsyncClient], requests: int, concurrency: int
+) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async with make_client() as client:
+        response = await client.post("/session", json={"title": "bench"})
+        session_id = response.json()["id"]
+
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                try:
+                    response = await client.post(
+                        f"/session/{session_id}/message",
+                        json={"parts": [{"type": "text", "text": "ping"}]},
+                    )
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "errors": errors,
+    }
+
+
+def start_mock(args, *listen: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "mock_opencode.py", *listen]
+        + ["--latency", str(args.latency), "--tokens", "1"],
+        cwd=BOT_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(make_client: Callable[[], httpx.AsyncClient]) -> None:
+    deadline = time.monotonic() + 10
+    async with make_client() as client:
+        while True:
+            try:
+                await client.get("/session")
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+
+async def main(args) -> None:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uds = os.path.join(tmp, "opencode.sock")
+        mocks = [
+            start_mock(args, "--port", str(port)),
+            start_mock(args, "--uds", uds),
+        ]
+        clients = {
+            "baseline": lambda: baseline_client(base_url),
+            "tuned-tcp": lambda: build_opencode_client(base_url, uds=None),
+            "tuned-uds": lambda: build_opencode_client("http://opencode", uds=uds),
+        }
+        try:
+            for make_client in clients.values():
+                await wait_ready(make_client)
+            print(
+                f"🚀 {args.requests} requests, concurrency {args.concurrency}, "
+                f"mock latency {args.latency}s"
+            )
+            for name, make_client in clients.items():
+                # Warm up the interpreter and server before measuring
+                await run_client(make_client, args.concurrency, args.concurrency)
+                result = await run_client(make_client, args.requests, args.concurrency)
+                print(
+                    f"   {name:12} " + "  ".join(f"{k}={v}" for k, v in result.items())
+                )
+        finally:
+            for mock in mocks:
+                mock.terminate()
+                mock.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark OpenCode HTTP clients")
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=48)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Mock OpenCode seconds per run"
+    )
+    asyncio.run(main(parser.parse_args()))
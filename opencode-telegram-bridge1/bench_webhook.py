@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark the webhook receivers
+
+Runs bot_webhook.py with the builtin receiver and with python-telegram-bot's
+run_webhook against the mocks, and posts the same stream of updates to each
+from concurrent connections, measuring acknowledged requests per second and
+acknowledgement latency. The updates are text prompts, so each receiver
+does the work of a real delivery and the bridge answers them through the
+mock OpenCode server. --ignored sends updates without text instead, which
+the builtin receiver acknowledges without queueing them:
+
+    python3 bench_webhook.py --requests 20000 --concurrency 40
+"""
+
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import subprocess
+from typing import List
+
+from load_test import BOT_DIR, WEBHOOK_SECRET, LoadTest, percentile
+from mini_http import server_port
+from mock_opencode import start_mock_opencode
+from mock_telegram import start_fake_telegram
+
+
+async def post(reader, writer, body: bytes) -> int:
+    """POST body to /webhook on a keep-alive connection and return the status"""
+    writer.write(
+        b"POST /webhook HTTP/1.1\r\nHost: bench\r\n"
+        b"Content-Type: application/json\r\n"
+        b"X-Telegram-Bot-Api-Secret-Token: %s\r\n"
+        b"Content-Length: %d\r\n\r\n%s" % (WEBHOOK_SECRET.encode(), len(body), body)
+    )
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    headers = dict(line.lower().split(": ", 1) for line in head[1:] if ": " in line)
+    length = int(headers.get("content-length", 0))
+    if length:
+        await reader.readexactly(length)
+    return int(head[0].split()[1])
+
+
+async def run_client(
+    telegram, port: int, requests: int, concurrency: int, ignored: bool
+) -> dict:
+    """Deliver updates over concurrency connections, as Telegram does
+
+    Speaks HTTP directly on keep-alive sockets; a full client library costs
+    more per request than the receivers being measured.
+    """
+    latencies: List[float] = []
+    refused = 0
+    errors = 0
+    remaining = requests
+
+    async def connection(user_id: int):
+        nonlocal remaining, refused, errors
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while remaining > 0:
+                remaining -= 1
+                update = telegram.build_update(user_id, user_id, "ping")
+                if ignored:
+                    del update["message"]["text"]
+                started = time.perf_counter()
+                status = await post(reader, writer, json.dumps(update).encode())
+                if status in (429, 503):
+                    refused += 1
+                elif status != 200:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - started)
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connection(10000 + i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "refused": refused,
+        "errors": errors,
+    }
+
+
+async def bench(args, server: str) -> dict:
+    mock, opencode_server = await start_mock_opencode(latency=args.latency, tokens=1)
+    telegram, telegram_server = await start_fake_telegram()
+    load_test = LoadTest(argparse.Namespace(bot="bot_webhook.py"))
+    env = load_test.bot_env(server_port(opencode_server), server_port(telegram_server))
+    env.update(WEBHOOK_SERVER=server, LOG_LEVEL="WARNING")
+    if args.max_pending:
+        env.update(WEBHOOK_MAX_PENDING=str(args.max_pending))
+    process = subprocess.Popen(
+        [sys.executable, "bot_webhook.py"],
+        cwd=BOT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        await load_test.wait_ready(telegram, process)
+        port = load_test.webhook_port
+        # Warm up the interpreter and server before measuring
+        await run_client(
+            telegram, port, args.concurrency, args.concurrency, args.ignored
+        )
+        return await run_client(
+            telegram, port, args.requests, args.concurrency, args.ignored
+        )
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        opencode_server.close()
+        telegram_server.close()
+
+
+async def main(args) -> None:
+    print(
+        f"🚀 {args.requests} webhook deliveries, concurrency {args.concurrency}, "
+        + ("ignored updates" if args.ignored else "prompts")
+    )
+    for server in ("ptb", "builtin"):
+        result = await bench(args, server)
+        print(f"   {server:8} " + "  ".join(f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark webhook receivers")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=40)
+    parser.add_argument(
+        "--ignored",
+        action="store_true",
+        help="Send updates without text, which the bridge ignores",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Mock OpenCode seconds per run"
+    )
+    parser.add_argument(
+        "--max-pending", type=int, default=0, help="WEBHOOK_MAX_PENDING for the bot"
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -4,186 +4,140 @@ Production-ready Telegram Bot using Webhook instead of polling
 """
 
 import os
+import signal
 import asyncio
 import logging
-from typing import Dict, Optional
-
-import httpx
-from dotenv import load_dotenv
-from telegram import Update, Bot
-from telegram.ext import (
-    Application,
-    CommandHandler,
-    MessageHandler,
-    filters,
-    ContextTypes,
-)
-from telegram.request import HTTPXRequest
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+import mini_http
+from engine import DRAIN_TIMEOUT
+from log_setup import setup_logging
+from sharding import create_bridge
+from updates import ALLOWED_UPDATES, parse_update
+from webhook_ingress import WebhookIngress
 
 # Configure logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+setup_logging("webhook")
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-OPENCODE_URL = os.getenv("OPENCODE_URL", "http://localhost:4096")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
 PORT = int(os.getenv("PORT", 8443))
-
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN environment variable is required")
+# "builtin" for the lean receiver, "ptb" for python-telegram-bot's run_webhook
+WEBHOOK_SERVER = os.getenv("WEBHOOK_SERVER", "builtin")
+# Updates acknowledged but not yet handled before deliveries get 429
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", 1000))
+# Parallel connections Telegram may open to deliver updates
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+# Largest webhook request body accepted
+WEBHOOK_MAX_BODY = 1024 * 1024
+# Seconds the builtin receiver allows for a delivery's headers and body, and
+# keeps an idle connection open
+WEBHOOK_HEADER_TIMEOUT = float(os.getenv("WEBHOOK_HEADER_TIMEOUT", 10))
+WEBHOOK_BODY_TIMEOUT = float(os.getenv("WEBHOOK_BODY_TIMEOUT", 30))
+WEBHOOK_IDLE_TIMEOUT = float(os.getenv("WEBHOOK_IDLE_TIMEOUT", 60))
+# Open connections the builtin receiver accepts before refusing more
+WEBHOOK_CONNECTION_LIMIT = int(os.getenv("WEBHOOK_CONNECTION_LIMIT", 200))
 
 if not WEBHOOK_URL:
     raise ValueError("WEBHOOK_URL environment variable is required for webhook mode")
 
-# OpenCode HTTP client
-opencode_client = httpx.AsyncClient(base_url=OPENCODE_URL, timeout=300.0)
 
-# Store user sessions: {user_id: session_id}
-user_sessions: Dict[int, str] = {}
-
-
-async def create_opencode_session() -> str:
-    """Create a new OpenCode session"""
-    try:
-        response = await opencode_client.post(
-            "/session", json={"title": "Telegram Session"}
-        )
-        response.raise_for_status()
-        data = response.json()
-        return data["id"]
-    except Exception as e:
-        logger.error(f"Failed to create OpenCode session: {e}")
-        raise
+def build_application(bridge) -> Application:
+    """Webhook Application that hands every update to the bridge"""
 
+    async def dispatch(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        # Returns at once; the bridge orders and runs updates per chat
+        message = parse_update(update.to_dict())
+        if message is not None:
+            bridge.dispatch(message)
 
-async def get_or_create_session(user_id: int) -> str:
-    """Get or create session for user"""
-    if user_id not in user_sessions:
-        logger.info(f"Creating new session for user {user_id}")
-        session_id = await create_opencode_session()
-        user_sessions[user_id] = session_id
-    return user_sessions[user_id]
+    async def post_init(application: Application) -> None:
+        await bridge.start()
 
+    async def post_stop(application: Application) -> None:
+        # The webhook server is down; finish what was already accepted
+        await bridge.drain(DRAIN_TIMEOUT)
 
-async def send_to_opencode(session_id: str, message: str) -> str:
-    """Send message to OpenCode"""
-    try:
-        response = await opencode_client.post(
-            f"/session/{session_id}/message",
-            json={"agent": "sisyphus", "parts": [{"type": "text", "text": message}]},
-        )
-        response.raise_for_status()
-        data = response.json()
-
-        parts = data.get("parts", [])
-        if isinstance(parts, list):
-            for part in parts:
-                if isinstance(part, dict) and part.get("type") == "text":
-                    return part.get("text", "")
-
-        return "Message sent to OpenCode (processing...)"
-    except Exception as e:
-        logger.error(f"Failed to send to OpenCode: {e}")
-        return f"Error: {str(e)}"
-
-
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /start command"""
-    user = update.effective_user
-    await update.message.reply_text(
-        f"👋 Hello, {user.first_name}!\n\n"
-        "I'm your OpenCode assistant via Webhook.\n"
-        "Send me any message and I'll forward it to OpenCode.\n\n"
-        "Commands: /start, /help, /reset"
-    )
+    async def post_shutdown(application: Application) -> None:
+        await bridge.stop()
 
+    async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handle errors"""
+        logger.error("Update %s caused error %s", update, context.error)
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /help command"""
-    await update.message.reply_text(
-        "📖 **Help**\n\n"
-        "Just send me a message and I'll forward it to OpenCode.\n\n"
-        "Available commands:\n"
-        "/start - Start bot\n"
-        "/help - Show this help\n"
-        "/reset - Reset your session"
+    application = (
+        Application.builder()
+        .bot(bridge.bot)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
     )
+    application.add_handler(TypeHandler(Update, dispatch))
+    application.add_error_handler(error_handler)
+    return application
 
 
-async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /reset command"""
-    user_id = update.effective_user.id
-    if user_id in user_sessions:
-        del user_sessions[user_id]
-        logger.info(f"Reset session for user {user_id}")
-    await get_or_create_session(user_id)
-    await update.message.reply_text("✅ Session reset!")
-
-
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle text messages"""
-    if not update.message or not update.message.text:
-        return
-
-    user = update.effective_user
-    user_message = update.message.text
-    user_id = user.id
-
-    logger.info(f"Received from {user.username or user.first_name}: {user_message}")
+async def serve_webhook():
+    """Serve the webhook with WebhookIngress until SIGTERM, then drain"""
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
 
+    bridge = create_bridge(on_done=lambda update: ingress.done(update))
+    ingress = WebhookIngress(bridge, WEBHOOK_SECRET, WEBHOOK_MAX_PENDING)
     try:
-        await update.message.chat.send_action(action="typing")
-
-        session_id = await get_or_create_session(user_id)
-
-        response = await send_to_opencode(session_id, user_message)
-
-        if len(response) > 4000:
-            response = response[:4000] + "\n\n... (truncated)"
-
-        await update.message.reply_text(response)
-
-    except Exception as e:
-        logger.error(f"Error: {e}", exc_info=True)
-        await update.message.reply_text(f"❌ Error: {str(e)}")
-
+        await bridge.start()
+        ingress.start()
+        server = await mini_http.serve(
+            ingress.handle,
+            "0.0.0.0",
+            PORT,
+            max_body=WEBHOOK_MAX_BODY,
+            header_timeout=WEBHOOK_HEADER_TIMEOUT,
+            body_timeout=WEBHOOK_BODY_TIMEOUT,
+            idle_timeout=WEBHOOK_IDLE_TIMEOUT,
+            max_connections=WEBHOOK_CONNECTION_LIMIT,
+        )
+        await bridge.bot.set_webhook(
+            url=f"{WEBHOOK_URL}/webhook",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+        await stopping.wait()
 
-async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle errors"""
-    logger.error(f"Update {update} caused error {context.error}")
+        # Answer late deliveries with 503 so Telegram keeps them for later
+        await ingress.stop()
+        server.close()
+        logger.info("Stopped receiving, draining %s updates...", ingress.pending)
+        await bridge.drain(DRAIN_TIMEOUT)
+    finally:
+        await bridge.stop()
 
 
 def main():
     """Start bot with webhook"""
-    application = Application.builder().token(BOT_TOKEN).build()
-
-    # Add handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("reset", reset_command))
-    application.add_handler(
-        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
-    )
+    logger.info("Starting bot with webhook on port %s", PORT)
+    logger.info("Webhook URL: %s/webhook", WEBHOOK_URL)
 
-    # Add error handler
-    application.add_error_handler(error_handler)
-
-    logger.info(f"Starting bot with webhook on port {PORT}")
-    logger.info(f"Webhook URL: {WEBHOOK_URL}/webhook")
+    if WEBHOOK_SERVER == "builtin":
+        asyncio.run(serve_webhook())
+        return
 
-    # Run with webhook
+    application = build_application(create_bridge())
     application.run_webhook(
         listen="0.0.0.0",
         port=PORT,
         url_path="webhook",
         webhook_url=f"{WEBHOOK_URL}/webhook",
         secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=ALLOWED_UPDATES,
     )
 
 
@@ -192,5 +146,3 @@ if __name__ == "__main__":
         main()
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
-    finally:
-        asyncio.run(opencode_client.aclose())
@@ -0,0 +1,46 @@
+"""
+Per-key message coalescing
+
+Holds items arriving for the same key within a short window and hands them
+on together, so several quick messages from a chat become one prompt.
+"""
+
+import asyncio
+from typing import Any, Callable, Dict, Hashable, List
+
+
+class Coalescer:
+    """Batch items per key for window seconds after the first one arrives"""
+
+    def __init__(self, submit: Callable[[Hashable, List[Any]], None], window: float):
+        self._submit = submit
+        self.window = window
+        self._batches: Dict[Hashable, List[Any]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+
+    def add(self, key: Hashable, item: Any) -> None:
+        batch = self._batches.get(key)
+        if batch is None:
+            self._batches[key] = [item]
+            self._timers[key] = asyncio.get_running_loop().call_later(
+                self.window, self.flush, key
+            )
+        else:
+            batch.append(item)
+
+    def flush(self, key: Hashable) -> None:
+        """Submit key's batch now, if it has one"""
+        batch = self.discard(key)
+        if batch:
+            self._submit(key, batch)
+
+    def discard(self, key: Hashable) -> List[Any]:
+        """Remove key's batch without submitting it and return its items"""
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        return self._batches.pop(key, [])
+
+    def flush_all(self) -> None:
+        for key in list(self._batches):
+            self.flush(key)
@@ -0,0 +1,135 @@
+"""
+Response delivery to Telegram
+
+Long OpenCode answers are split on paragraph, line or code-fence boundaries
+into several messages sent in order. Answers above a size threshold are
+uploaded as a document straight from memory instead.
+"""
+
+import io
+import re
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple, Union
+
+from telegram import Bot, InputFile
+
+import metrics
+from outbound import OutboundScheduler
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects message text above 4096 characters
+MAX_MESSAGE_LENGTH = 4000
+
+FENCE_RE = re.compile(r"^\s*```")
+# Longest fence marker and language tag carried over when a code block is cut
+MAX_FENCE_MARKER = 10
+MAX_FENCE_LANGUAGE = 20
+
+
+def _split_point(text: str, limit: int) -> int:
+    """Best index <= limit to cut text at: paragraph, then line, then word"""
+    for separator in ("\n\n", "\n", " "):
+        index = text.rfind(separator, 0, limit)
+        if index > limit // 4:
+            return index + len(separator)
+    return limit
+
+
+def _open_fence(text: str) -> Optional[str]:
+    """Return the opening line of a code fence left open at the end of text"""
+    fence = None
+    for line in text.split("\n"):
+        if FENCE_RE.match(line):
+            fence = None if fence else line.strip()
+    return fence
+
+
+def _fence_parts(fence: str) -> Tuple[str, str]:
+    """(marker, language tag) of an opening fence line, both kept short"""
+    marker = fence[: len(fence) - len(fence.lstrip("`"))]
+    words = fence[len(marker) :].split()
+    language = words[0][:MAX_FENCE_LANGUAGE] if words else ""
+    return marker[:MAX_FENCE_MARKER], language
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split text into chunks of at most limit characters
+
+    A code block cut across chunks is closed at the end of one chunk and
+    reopened (with its language tag) at the start of the next.
+    """
+    chunks = []
+    reopen = ""
+    while text:
+        if len(reopen) + len(text) <= limit:
+            chunks.append(reopen + text)
+            break
+        # Leave room for the reopened fence header and a closing fence
+        budget = max(limit - len(reopen) - MAX_FENCE_MARKER - 1, limit // 2)
+        cut = _split_point(text, budget)
+        chunk = reopen + text[:cut]
+        text = text[cut:]
+        fence = _open_fence(chunk)
+        if fence:
+            marker, language = _fence_parts(fence)
+            chunk = chunk.rstrip("\n") + "\n" + marker
+            reopen = marker + language + "\n"
+        else:
+            reopen = ""
+        chunks.append(chunk)
+    return chunks
+
+
+async def send_document(
+    bot: Union[Bot, OutboundScheduler],
+    chat_id: int,
+    text: str,
+    filename: str = "response.md",
+) -> None:
+    """Upload text as a file, from memory"""
+    document = InputFile(io.BytesIO(text.encode("utf-8")), filename=filename)
+    await bot.send_document(
+        chat_id=chat_id,
+        document=document,
+        caption=f"📄 Response too long for a message ({len(text)} characters)",
+    )
+
+
+async def deliver_response(
+    bot: Union[Bot, OutboundScheduler],
+    chat_id: int,
+    text: str,
+    document_threshold: int = 12000,
+    chunk_delay: float = 0.3,
+    send_first: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> None:
+    """Send text to chat as one message, several paced messages, or a document
+
+    send_first, if given, places the first message instead of sending it
+    (e.g. by editing a streaming placeholder).
+    """
+    if not text:
+        text = "(empty response)"
+
+    async def send(chunk: str, first: bool) -> None:
+        if first and send_first:
+            await send_first(chunk)
+        else:
+            await bot.send_message(chat_id=chat_id, text=chunk)
+
+    if document_threshold and len(text) > document_threshold:
+        metrics.RESPONSES_DELIVERED.inc(mode="document")
+        if send_first:
+            await send_first("📄 Response sent as a file below.")
+        await send_document(bot, chat_id, text)
+        return
+
+    chunks = split_message(text)
+    metrics.RESPONSES_DELIVERED.inc(mode="single" if len(chunks) == 1 else "chunked")
+    for index, chunk in enumerate(chunks):
+        if index:
+            # Pace consecutive messages to stay under Telegram's per-chat limit
+            await asyncio.sleep(chunk_delay)
+        await send(chunk, first=index == 0)
@@ -0,0 +1,70 @@
+"""
+Per-key update dispatcher
+
+Runs updates for different users/chats concurrently while keeping updates
+for the same key strictly in order.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedDispatcher:
+    """Dispatch work items to one sequential worker per key"""
+
+    def __init__(self, handler: Callable[[Any], Awaitable[None]]):
+        self._handler = handler
+        self._queues: Dict[Hashable, asyncio.Queue] = {}
+        self._workers: Dict[Hashable, asyncio.Task] = {}
+
+    def submit(self, key: Hashable, item: Any) -> None:
+        """Queue item behind any pending items for the same key"""
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[key] = queue
+            self._workers[key] = asyncio.create_task(self._run(key, queue))
+        queue.put_nowait(item)
+
+    def pending(self, key: Hashable) -> int:
+        """Number of items waiting (not yet started) for key"""
+        queue = self._queues.get(key)
+        return queue.qsize() if queue else 0
+
+    def depths(self) -> Dict[Hashable, int]:
+        """Waiting items per key, for keys with a backlog"""
+        return {key: q.qsize() for key, q in self._queues.items() if q.qsize()}
+
+    @property
+    def active_keys(self) -> int:
+        return len(self._workers)
+
+    async def _run(self, key: Hashable, queue: asyncio.Queue) -> None:
+        try:
+            while not queue.empty():
+                item = queue.get_nowait()
+                try:
+                    await self._handler(item)
+                except Exception as e:
+                    logger.error(
+                        "Unhandled error for key %s: %s", key, e, exc_info=True
+                    )
+        finally:
+            # Worker exits once its queue is drained; the next submit starts a new one
+            self._queues.pop(key, None)
+            self._workers.pop(key, None)
+
+    async def join(self) -> None:
+        """Wait until every queued item has been handled"""
+        while self._workers:
+            await asyncio.wait(list(self._workers.values()))
+
+    async def cancel(self) -> None:
+        """Cancel all workers, dropping items not yet handled"""
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,1174 @@
+"""
+Bridge engine shared by the polling and webhook front-ends
+
+Owns the Telegram Bot and OpenCode HTTP clients, the session store and pool,
+the outbound scheduler and the per-chat dispatch pipeline. Front-ends only
+feed it updates and call start() and stop() on the loop that runs it.
+"""
+
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+import importlib.util
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from telegram import Bot
+from telegram.error import RetryAfter
+
+import metrics
+from attachments import Attachment, FileCache, FileTooLarge, message_body
+from backends import (
+    Backend,
+    BackendPool,
+    BackendUnavailable,
+    SessionNotFound,
+    backend_urls,
+)
+from coalescer import Coalescer
+from delivery import deliver_response
+from dispatcher import KeyedDispatcher
+from job_queue import CANCELLED, DONE, FAILED, Job, JobQueue, QueueFull
+from log_setup import Redacted, correlation_id
+from outbound import OutboundScheduler
+from quotas import Limits, Quotas, load_user_limits
+from response_cache import ResponseCache
+from resilience import AdaptiveLimiter, CircuitBreaker, CircuitOpen, Overloaded
+from session_pool import SessionPool, SingleFlight
+from session_reaper import SessionReaper
+from session_store import SqliteSessionStore, create_session_store, maintain_sessions
+from streaming import SessionEventStream, StreamAccumulator, ThrottledMessageEditor
+from updates import MessageUpdate, UpdatePoller, parse_update
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+OPENCODE_URL = os.getenv("OPENCODE_URL", "http://localhost:4096")
+# Several `opencode serve` instances, comma-separated (overrides OPENCODE_URL)
+OPENCODE_URLS = backend_urls(OPENCODE_URL)
+# Unix socket of a local `opencode serve`, used instead of TCP when set
+# (single backend only)
+OPENCODE_UDS = os.getenv("OPENCODE_UDS")
+# OpenCode HTTP version ("1.1" or "2"); HTTP/2 is negotiated on https URLs only
+OPENCODE_HTTP_VERSION = os.getenv("OPENCODE_HTTP_VERSION", "2")
+# OpenCode connection pool: total connections and idle ones kept open
+OPENCODE_MAX_CONNECTIONS = int(os.getenv("OPENCODE_MAX_CONNECTIONS", 100))
+OPENCODE_MAX_KEEPALIVE = int(os.getenv("OPENCODE_MAX_KEEPALIVE", 32))
+# Close idle connections before the server does (Bun's idle timeout is 10s)
+OPENCODE_KEEPALIVE_EXPIRY = float(os.getenv("OPENCODE_KEEPALIVE_EXPIRY", 8))
+# OpenCode timeouts in seconds; read covers a whole agent run
+OPENCODE_CONNECT_TIMEOUT = float(os.getenv("OPENCODE_CONNECT_TIMEOUT", 5))
+OPENCODE_WRITE_TIMEOUT = float(os.getenv("OPENCODE_WRITE_TIMEOUT", 30))
+OPENCODE_READ_TIMEOUT = float(os.getenv("OPENCODE_READ_TIMEOUT", 300))
+OPENCODE_POOL_TIMEOUT = float(os.getenv("OPENCODE_POOL_TIMEOUT", 10))
+# Seconds between GET /session health probes when there are several backends
+BACKEND_HEALTH_INTERVAL = float(os.getenv("BACKEND_HEALTH_INTERVAL", 10))
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+TELEGRAM_FILE_URL = os.getenv("TELEGRAM_FILE_URL", "https://api.telegram.org/file/bot")
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "opencode/glm-4.7-free")
+# Maximum number of OpenCode requests in flight across all users
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", 8))
+# The in-flight cap adapts between this floor and MAX_CONCURRENT_REQUESTS
+OPENCODE_MIN_CONCURRENCY = int(os.getenv("OPENCODE_MIN_CONCURRENCY", 1))
+# A request slower than this multiple of the average latency lowers the cap
+OPENCODE_LATENCY_TOLERANCE = float(os.getenv("OPENCODE_LATENCY_TOLERANCE", 2.0))
+# Requests waiting for a slot beyond this count, or this many seconds, are shed
+OPENCODE_MAX_QUEUE = int(os.getenv("OPENCODE_MAX_QUEUE", 100))
+OPENCODE_QUEUE_TIMEOUT = float(os.getenv("OPENCODE_QUEUE_TIMEOUT", 60))
+# Consecutive failures that open a backend's circuit, and seconds until a probe
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+# Shared Telegram connection pool size and HTTP version ("1.1" or "2")
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", 16))
+TELEGRAM_HTTP_VERSION = os.getenv("TELEGRAM_HTTP_VERSION", "2")
+POLL_TIMEOUT = 30
+# Stream partial responses into Telegram via message edits
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "false").lower() == "true"
+# Minimum seconds between edits of a streamed message
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.5))
+# Number of idle OpenCode sessions to keep pre-created (0 disables the pool)
+SESSION_POOL_SIZE = int(os.getenv("SESSION_POOL_SIZE", 0))
+# Delete the OpenCode sessions the bridge lets go of (/reset, idle, evicted)
+SESSION_REAPER = os.getenv("SESSION_REAPER", "true").lower() == "true"
+# Sessions deleted per batch, and seconds between batches
+SESSION_REAP_BATCH = int(os.getenv("SESSION_REAP_BATCH", 20))
+SESSION_REAP_INTERVAL = float(os.getenv("SESSION_REAP_INTERVAL", 5))
+# At startup, also delete bridge sessions no user is mapped to that have been
+# idle this many seconds (0 = skip)
+SESSION_ORPHAN_AGE = float(os.getenv("SESSION_ORPHAN_AGE", 24 * 3600))
+# Title of the sessions the bridge creates, which reconcile looks for
+SESSION_TITLE = "Telegram Session"
+# Port for the Prometheus /metrics listener (0 disables it)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# Responses longer than this many characters are sent as a file (0 = never)
+RESPONSE_DOCUMENT_THRESHOLD = int(os.getenv("RESPONSE_DOCUMENT_THRESHOLD", 12000))
+# Seconds between consecutive chunks of a long response
+RESPONSE_CHUNK_DELAY = float(os.getenv("RESPONSE_CHUNK_DELAY", 0.3))
+# Outbound Telegram rate limits in messages per second
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", 20 / 60))
+# Regex a whole normalized prompt must match for its answer to be cached
+# (empty disables the response cache)
+RESPONSE_CACHE_PATTERN = os.getenv("RESPONSE_CACHE_PATTERN", "")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+# "global" shares cached answers between users, "session" keeps them per session
+RESPONSE_CACHE_SCOPE = os.getenv("RESPONSE_CACHE_SCOPE", "global")
+# Seconds to gather consecutive texts from a chat into one prompt (0 = off)
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", 0))
+# A new message aborts the reply still being prepared for the same chat
+ABORT_ON_NEW_MESSAGE = os.getenv("ABORT_ON_NEW_MESSAGE", "false").lower() == "true"
+# Prompts per minute per user and per group chat (0 = unlimited), with a burst
+USER_PROMPTS_PER_MINUTE = float(os.getenv("USER_PROMPTS_PER_MINUTE", 0))
+CHAT_PROMPTS_PER_MINUTE = float(os.getenv("CHAT_PROMPTS_PER_MINUTE", 0))
+PROMPT_BURST = int(os.getenv("PROMPT_BURST", 5))
+# OpenCode runs one user may have in flight at once (0 = unlimited)
+USER_MAX_CONCURRENT = int(os.getenv("USER_MAX_CONCURRENT", 0))
+# JSON file of per-user overrides of the limits above and fair-queuing weight
+USER_LIMITS_FILE = os.getenv("USER_LIMITS_FILE")
+# Acknowledge prompts at once and answer them from a background job queue
+JOB_MODE = os.getenv("JOB_MODE", "false").lower() == "true"
+# Jobs run concurrently (each user's jobs still run one at a time)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+# Queued jobs beyond this are refused
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 1000))
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+# Documents and photos larger than this are refused
+MAX_FILE_BYTES = int(os.getenv("MAX_FILE_BYTES", 20 * 1024 * 1024))
+# Telegram file downloads run at once
+FILE_DOWNLOAD_CONCURRENCY = int(os.getenv("FILE_DOWNLOAD_CONCURRENCY", 4))
+# Downloaded files, reused when the same file is sent again, and their total cap
+FILE_CACHE_DIR = os.getenv("FILE_CACHE_DIR", "file_cache")
+FILE_CACHE_MAX_BYTES = int(os.getenv("FILE_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+# Seconds to let in-flight updates finish on shutdown
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", 30))
+
+
+def parse_model(model_str: str):
+    """Parse model string (e.g., 'opencode/glm-4.7-free') into model object"""
+    parts = model_str.split("/")
+    if len(parts) == 2:
+        return {"providerID": parts[0], "modelID": parts[1]}
+    return {"providerID": "opencode", "modelID": "glm-4.7-free"}
+
+
+def response_text(data: dict) -> Optional[str]:
+    """Text of the first text part of an OpenCode message response, if any"""
+    parts = data.get("parts", [])
+
+    # Handle both list and dict response formats
+    if isinstance(parts, list):
+        for part in parts:
+            if isinstance(part, dict) and part.get("type") == "text":
+                return part.get("text", "")
+    return None
+
+
+def build_opencode_client(
+    base_url: str = OPENCODE_URL, uds: Optional[str] = OPENCODE_UDS
+) -> httpx.AsyncClient:
+    """Build the OpenCode client with tuned pool limits and split timeouts"""
+    http2 = OPENCODE_HTTP_VERSION != "1.1"
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.info("h2 package not installed, using HTTP/1.1 for OpenCode")
+        http2 = False
+
+    transport = httpx.AsyncHTTPTransport(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=OPENCODE_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENCODE_MAX_KEEPALIVE,
+            keepalive_expiry=OPENCODE_KEEPALIVE_EXPIRY,
+        ),
+        uds=uds,
+        # TCP keep-alive so idle pooled connections are not silently dropped
+        socket_options=(None if uds else [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]),
+    )
+    return httpx.AsyncClient(
+        base_url=base_url,
+        transport=transport,
+        timeout=httpx.Timeout(
+            connect=OPENCODE_CONNECT_TIMEOUT,
+            write=OPENCODE_WRITE_TIMEOUT,
+            read=OPENCODE_READ_TIMEOUT,
+            pool=OPENCODE_POOL_TIMEOUT,
+        ),
+    )
+
+
+def build_telegram_request(
+    pool_size: int, **kwargs
+) -> metrics.InstrumentedHTTPXRequest:
+    """Pooled, keep-alive connection to the Bot API"""
+    http_version = TELEGRAM_HTTP_VERSION
+    if http_version != "1.1" and importlib.util.find_spec("h2") is None:
+        http_version = "1.1"
+    # TCP keep-alive so idle pooled connections are not silently dropped
+    socket_options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    return metrics.InstrumentedHTTPXRequest(
+        connection_pool_size=pool_size,
+        http_version=http_version,
+        socket_options=socket_options,
+        **kwargs,
+    )
+
+
+def build_telegram_bot() -> Bot:
+    """Build the process-wide Telegram Bot with a pooled, keep-alive connection"""
+    if TELEGRAM_HTTP_VERSION != "1.1" and importlib.util.find_spec("h2") is None:
+        logger.info("h2 package not installed, using HTTP/1.1 for Telegram")
+    request = build_telegram_request(TELEGRAM_POOL_SIZE, pool_timeout=10.0)
+    return Bot(
+        token=BOT_TOKEN,
+        base_url=TELEGRAM_API_URL,
+        base_file_url=TELEGRAM_FILE_URL,
+        request=request,
+    )
+
+
+def build_update_poller(bot: Bot) -> UpdatePoller:
+    """getUpdates long poll for bot, on its own connection and read timeout"""
+    request = build_telegram_request(1, read_timeout=POLL_TIMEOUT + 10)
+    return UpdatePoller(bot.base_url, request, timeout=POLL_TIMEOUT)
+
+
+def is_prompt(update: MessageUpdate) -> bool:
+    """Whether update is a text message or file meant for OpenCode"""
+    return update.file is not None or not update.text.startswith("/")
+
+
+def is_cancel(update: MessageUpdate) -> bool:
+    return update.file is None and update.text.split()[:1] == ["/cancel"]
+
+
+def update_key(update: MessageUpdate) -> Tuple[int, int]:
+    """Ordering key for an update: its sender in its chat
+
+    In a group each member has their own session, so their prompts are
+    coalesced, ordered and cancelled separately.
+    """
+    return update.chat_id, update.user_id
+
+
+class BridgeEngine:
+    """Telegram ↔ OpenCode bridge, independent of how updates arrive"""
+
+    def __init__(
+        self,
+        on_done: Optional[Callable[[MessageUpdate], None]] = None,
+        owns: Optional[Callable[[int], bool]] = None,
+        reconcile: bool = True,
+    ):
+        if not BOT_TOKEN:
+            raise ValueError("BOT_TOKEN environment variable is required")
+
+        # Called after each dispatched update has been handled
+        self.on_done = on_done
+
+        # Telegram Bot shared by the front-end, update handling and outbound sends
+        self.bot = build_telegram_bot()
+
+        # Every outbound Telegram call goes through this rate-limited scheduler
+        self.outbound = OutboundScheduler(
+            self.bot,
+            global_rate=TELEGRAM_GLOBAL_RATE,
+            chat_rate=TELEGRAM_CHAT_RATE,
+            group_rate=TELEGRAM_GROUP_RATE,
+        )
+
+        # OpenCode servers, each with its own HTTP client and idle sessions
+        uds = OPENCODE_UDS if len(OPENCODE_URLS) == 1 else None
+        backends = []
+        for url in OPENCODE_URLS:
+            backend = Backend(url, build_opencode_client(url, uds=uds))
+            # Fails fast instead of queueing on a backend that keeps failing
+            backend.breaker = CircuitBreaker(
+                url,
+                failure_threshold=BREAKER_FAILURES,
+                reset_timeout=BREAKER_RESET_TIMEOUT,
+            )
+            # Pre-created idle sessions handed to new users and /reset
+            backend.session_pool = SessionPool(
+                lambda backend=backend: self.create_opencode_session(backend),
+                SESSION_POOL_SIZE,
+            )
+            if STREAM_RESPONSES:
+                backend.events = SessionEventStream(backend.client)
+            backends.append(backend)
+        # New sessions go to the least-loaded backend and stay there
+        self.backends = BackendPool(backends)
+
+        # Deletes sessions the store lets go of, in paced batches
+        self.reaper = (
+            SessionReaper(
+                self.backends,
+                batch_size=SESSION_REAP_BATCH,
+                interval=SESSION_REAP_INTERVAL,
+            )
+            if SESSION_REAPER
+            else None
+        )
+
+        # Store user sessions: {user_id: session_id}
+        # owns limits a store shared between worker processes to our users
+        self.user_sessions = create_session_store(
+            owns=owns,
+            on_remove=(
+                (lambda user_id, value: self.reaper.release(value))
+                if self.reaper
+                else None
+            ),
+        )
+        # Orphaned sessions can only be told apart with a view of every
+        # user's session, which a sharded worker has only in a shared store
+        self._reconcile = reconcile and (
+            owns is None or isinstance(self.user_sessions, SqliteSessionStore)
+        )
+
+        # In-progress session creations, keyed by user_id
+        self.session_creations = SingleFlight()
+
+        # Prompt rate quotas and per-user limits for fair queuing
+        default_limits = Limits(
+            prompts_per_minute=USER_PROMPTS_PER_MINUTE,
+            max_concurrent=USER_MAX_CONCURRENT,
+        )
+        self.quotas = Quotas(
+            default_limits,
+            chat_prompts_per_minute=CHAT_PROMPTS_PER_MINUTE,
+            burst=PROMPT_BURST,
+            overrides=load_user_limits(USER_LIMITS_FILE, default_limits),
+        )
+
+        # Global cap on in-flight OpenCode requests, lowered as latency rises,
+        # shared fairly between users
+        self.limiter = AdaptiveLimiter(
+            MAX_CONCURRENT_REQUESTS,
+            min_limit=OPENCODE_MIN_CONCURRENCY,
+            tolerance=OPENCODE_LATENCY_TOLERANCE,
+            max_queue=OPENCODE_MAX_QUEUE,
+            queue_timeout=OPENCODE_QUEUE_TIMEOUT,
+        )
+
+        # Documents and photos downloaded for OpenCode
+        self.files = FileCache(
+            self.bot,
+            FILE_CACHE_DIR,
+            max_file_bytes=MAX_FILE_BYTES,
+            max_bytes=FILE_CACHE_MAX_BYTES,
+            concurrency=FILE_DOWNLOAD_CONCURRENCY,
+        )
+
+        # Answers to opted-in stock prompts
+        self.response_cache = (
+            ResponseCache(
+                RESPONSE_CACHE_PATTERN,
+                max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                ttl=RESPONSE_CACHE_TTL,
+                scope=RESPONSE_CACHE_SCOPE,
+            )
+            if RESPONSE_CACHE_PATTERN
+            else None
+        )
+
+        # Updates run concurrently across senders but in order for each sender
+        # in a chat; each dispatched item is a list of updates answered as one
+        # prompt
+        self.dispatcher = KeyedDispatcher(self._handle_dispatched)
+        self.coalescer = Coalescer(self.dispatcher.submit, COALESCE_WINDOW)
+
+        # Prompts waiting for, or being run by, the job workers in job mode
+        self.jobs = (
+            JobQueue(JOB_DB_PATH, max_size=JOB_QUEUE_SIZE, owns=owns)
+            if JOB_MODE
+            else None
+        )
+        self._job_workers: List[asyncio.Task] = []
+
+        # Reply being prepared per update_key, for /cancel
+        self._replies: Dict[Tuple[int, int], asyncio.Task] = {}
+        # Prompts with a lower update_id than this were cancelled, per update_key
+        self._cancelled_before: Dict[Tuple[int, int], int] = {}
+        # Session abort requests still in flight
+        self._aborts: Set[asyncio.Task] = set()
+
+        self._maintenance: Optional[asyncio.Task] = None
+        self._reconciler: Optional[asyncio.Task] = None
+        self._health_checks: Optional[asyncio.Task] = None
+        self._metrics_server = None
+
+    # Lifecycle
+
+    async def start(self) -> None:
+        """Open the Telegram connection pool and start background tasks"""
+        await self.bot.initialize()
+        self._maintenance = asyncio.create_task(maintain_sessions(self.user_sessions))
+        for backend in self.backends:
+            backend.session_pool.start()
+            if backend.events is not None:
+                backend.events.start()
+        if self.reaper is not None:
+            self.reaper.start()
+            metrics.REAPER_PENDING.set_function(lambda: self.reaper.pending)
+            if self._reconcile and SESSION_ORPHAN_AGE > 0:
+                referenced = [
+                    self.backends.resolve(value)[1]
+                    for value in self.user_sessions.values()
+                ]
+                self._reconciler = asyncio.create_task(
+                    self.reaper.reconcile(referenced, SESSION_TITLE, SESSION_ORPHAN_AGE)
+                )
+        if len(self.backends) > 1:
+            self._health_checks = asyncio.create_task(
+                self.backends.run_health_checks(BACKEND_HEALTH_INTERVAL)
+            )
+        self.outbound.start()
+        if self.jobs is not None:
+            self._job_workers = [
+                asyncio.create_task(self._run_jobs()) for _ in range(JOB_WORKERS)
+            ]
+            metrics.JOBS.set_function(
+                lambda: {("queued",): self.jobs.queued, ("running",): self.jobs.running}
+            )
+        metrics.OPENCODE_CONCURRENCY_LIMIT.set_function(lambda: int(self.limiter.limit))
+        metrics.FAIR_QUEUE_WAITING.set_function(lambda: self.limiter.queued)
+        metrics.QUEUE_DEPTH.set_function(
+            lambda: {
+                (str(key),): depth for key, depth in self.dispatcher.depths().items()
+            }
+        )
+        if METRICS_PORT:
+            metrics.ACTIVE_SESSIONS.set_function(lambda: len(self.user_sessions))
+            metrics.OUTBOUND_QUEUE_DEPTH.set_function(lambda: self.outbound.queue_depth)
+            if self.response_cache is not None:
+                metrics.RESPONSE_CACHE_BYTES.set_function(
+                    lambda: self.response_cache.size
+                )
+            metrics.FILE_CACHE_BYTES.set_function(lambda: self.files.size)
+            self._metrics_server = await metrics.start_metrics_server(METRICS_PORT)
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT) -> None:
+        """Wait for dispatched updates to finish, abandoning them after timeout
+
+        Running jobs get the same time to finish; queued ones stay on disk.
+        """
+        self.coalescer.flush_all()
+        if self.jobs is not None:
+            self.jobs.stop()
+        try:
+            await asyncio.wait_for(self._join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            running = f" and {self.jobs.running} jobs" if self.jobs else ""
+            logger.warning(
+                "Drain timed out after %ss, abandoning updates in %s chats%s",
+                timeout,
+                self.dispatcher.active_keys,
+                running,
+            )
+            await self.dispatcher.cancel()
+            # Interrupted jobs are still marked running and rerun after restart
+            for worker in self._job_workers:
+                worker.cancel()
+            await asyncio.gather(*self._job_workers, return_exceptions=True)
+
+    async def _join(self) -> None:
+        await self.dispatcher.join()
+        await asyncio.gather(*self._job_workers)
+        await asyncio.gather(*self._aborts, return_exceptions=True)
+
+    async def stop(self) -> None:
+        """Stop background tasks and close every client on the running loop"""
+        if self._maintenance:
+            self._maintenance.cancel()
+        if self._health_checks:
+            self._health_checks.cancel()
+        if self._reconciler:
+            self._reconciler.cancel()
+        if self.reaper is not None:
+            await self.reaper.stop()
+        for backend in self.backends:
+            await backend.session_pool.stop()
+            if backend.events is not None:
+                await backend.events.stop()
+        await self.outbound.stop()
+        for backend in self.backends:
+            await backend.client.aclose()
+        await self.files.close()
+        await self.bot.shutdown()
+        if self._metrics_server:
+            self._metrics_server.close()
+        # Persist sessions
+        self.user_sessions.close()
+        if self.jobs is not None:
+            self.jobs.close()
+
+    # Dispatch
+
+    def dispatch(self, update: MessageUpdate) -> None:
+        """Queue an update behind earlier ones from its sender in its chat
+
+        /cancel, and with ABORT_ON_NEW_MESSAGE any new prompt, takes effect
+        here rather than in the queue, so it need not wait for the reply it
+        cancels. Either only affects the sender's own prompts.
+        """
+        key = update_key(update)
+        if is_cancel(update):
+            self._cancel(key, update.update_id, "cancel")
+            for dropped in self.coalescer.discard(key):
+                self._done(dropped)
+            if self.jobs is not None:
+                for job in self.jobs.cancel_queued(update.chat_id, update.user_id):
+                    metrics.JOBS_FINISHED.inc(status=CANCELLED)
+        elif ABORT_ON_NEW_MESSAGE and is_prompt(update):
+            self._cancel(key, update.update_id, "new_message")
+
+        if COALESCE_WINDOW > 0 and is_prompt(update):
+            self.coalescer.add(key, update)
+            return
+        # Anything else goes after the prompts gathered so far
+        self.coalescer.flush(key)
+        self.dispatcher.submit(key, [update])
+
+    def _cancel(self, key: Tuple[int, int], before: int, reason: str) -> None:
+        """Drop key's prompts older than update_id before, aborting the running one"""
+        self._cancelled_before[key] = before
+        task = self._replies.pop(key, None)
+        if task is None:
+            return
+        _, user_id = key
+        task.cancel()
+        metrics.CANCELLED_REPLIES.inc(reason=reason)
+        abort = asyncio.create_task(self.abort_session(user_id))
+        self._aborts.add(abort)
+        abort.add_done_callback(self._aborts.discard)
+
+    def _done(self, update: MessageUpdate) -> None:
+        if self.on_done:
+            self.on_done(update)
+
+    async def _handle_dispatched(self, updates: List[MessageUpdate]) -> None:
+        key = update_key(updates[-1])
+        # Logged by everything this update leads to, down to the Telegram send
+        token = correlation_id.set(f"u{updates[-1].update_id}")
+        try:
+            if len(updates) == 1:
+                await self.handle_update(updates[0])
+            else:
+                metrics.COALESCED_MESSAGES.inc(len(updates) - 1)
+                text = "\n\n".join(update.text for update in updates if update.text)
+                files = [update.file for update in updates if update.file]
+                await self.handle_update(updates[-1], text=text, files=files)
+        finally:
+            correlation_id.reset(token)
+            if not self.dispatcher.pending(key):
+                self._cancelled_before.pop(key, None)
+            for update in updates:
+                self._done(update)
+
+    # OpenCode
+
+    async def create_opencode_session(self, backend: Backend) -> str:
+        """Create a new OpenCode session and return session_id"""
+        try:
+            started = time.perf_counter()
+            with metrics.SESSION_CREATE_LATENCY.time():
+                try:
+                    response = await backend.client.post(
+                        "/session", json={"title": SESSION_TITLE}
+                    )
+                except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                    backend.mark_down(e)
+                    raise BackendUnavailable(backend, e) from e
+            backend.observe(time.perf_counter() - started)
+            backend.mark_up()
+            response.raise_for_status()
+            data = response.json()
+            return data["id"]
+        except Exception as e:
+            metrics.ERRORS.inc(kind="session_create")
+            logger.error("Failed to create OpenCode session: %s", e)
+            raise
+
+    async def get_or_create_session(self, user_id: int) -> Tuple[Backend, str]:
+        """Get the user's backend and session, creating a session if needed"""
+        value = self.user_sessions.get(user_id)
+        if value is not None:
+            backend, session_id = self.backends.resolve(value)
+            if backend is not None and (
+                backend.healthy or not self.backends.any_healthy
+            ):
+                return backend, session_id
+            # Its backend is down or gone: start over on a healthy one
+            metrics.RETRIES.inc(kind="backend_failover")
+            logger.warning(
+                "Moving user %s off unavailable backend %s", user_id, backend
+            )
+            self.user_sessions.delete(user_id)
+        # Concurrent callers for the same user share one creation
+        return await self.session_creations.do(
+            user_id, lambda: self._assign_session(user_id)
+        )
+
+    async def _assign_session(self, user_id: int) -> Tuple[Backend, str]:
+        """Take a session on the least-loaded backend and store it for user"""
+        backend = self.backends.pick()
+        logger.info("Creating new session for user %s on %s", user_id, backend.url)
+        session_id = await backend.session_pool.acquire()
+        self.user_sessions.set(user_id, self.backends.pin(session_id, backend))
+        return backend, session_id
+
+    async def run_in_session(
+        self, user_id: int, call: Callable[[Backend, str], Awaitable[str]]
+    ) -> str:
+        """Run call(backend, session_id) in user's session
+
+        If the backend cannot be reached and another healthy one can take
+        over, the user is moved to a new session there; if the backend no
+        longer has the session the user gets a new one. Either way call is
+        retried once. With nowhere to fail over to, such as a single backend
+        that is restarting, the error is raised and the session kept.
+        """
+        for attempt in range(2):
+            try:
+                backend, session_id = await self.get_or_create_session(user_id)
+                logger.info(
+                    "Using session %s on %s for user %s",
+                    session_id,
+                    backend.url,
+                    user_id,
+                )
+                return await call(backend, session_id)
+            except BackendUnavailable as e:
+                other = self.backends.pick()
+                if attempt or other is e.backend or not other.healthy:
+                    raise
+                metrics.RETRIES.inc(kind="backend_failover")
+                logger.warning("%s; moving user %s to another backend", e, user_id)
+                self.user_sessions.delete(user_id)
+            except SessionNotFound as e:
+                if attempt:
+                    raise
+                metrics.RETRIES.inc(kind="session_not_found")
+                logger.warning("%s; creating a new one for user %s", e, user_id)
+                self.user_sessions.delete(user_id)
+
+    async def send_to_opencode(
+        self,
+        backend: Backend,
+        session_id: str,
+        message: str,
+        user_id: Optional[int] = None,
+        files: Optional[List[Attachment]] = None,
+    ) -> str:
+        """Send message and files to OpenCode and return response
+
+        Raises CircuitOpen or Overloaded without calling OpenCode when the
+        backend keeps failing or too many requests are already waiting.
+        Waiting requests are queued fairly between users by user_id. Raises
+        SessionNotFound if OpenCode no longer has session_id.
+        """
+        cache_key = None
+        if files:
+            # Downloaded before taking an OpenCode slot, which they do not need
+            try:
+                paths = await self.files.fetch_all(files)
+            except FileTooLarge as e:
+                return f"📎 {e}."
+            except Exception as e:
+                metrics.ERRORS.inc(kind="file_download")
+                logger.error("Failed to download a file from Telegram: %s", e)
+                return f"📎 Could not download your file: {e}"
+        elif self.response_cache is not None:
+            cache_key = self.response_cache.key(message, DEFAULT_MODEL, session_id)
+            cached = cache_key and self.response_cache.get(cache_key)
+            if cached:
+                logger.info(
+                    "Answered from the response cache in session %s", session_id
+                )
+                return cached
+        try:
+            model_obj = parse_model(DEFAULT_MODEL)
+            backend.breaker.check()
+            limits = self.quotas.limits(user_id)
+            await self.limiter.acquire(
+                user_id, weight=limits.weight, max_inflight=limits.max_concurrent
+            )
+            metrics.OPENCODE_INFLIGHT.inc()
+            backend.inflight += 1
+            started = time.perf_counter()
+            # None if cancelled, which says nothing about OpenCode's health
+            failed = None
+            try:
+                with metrics.OPENCODE_LATENCY.time():
+                    if files:
+                        # Streamed, so file contents are never all in memory
+                        response = await backend.client.post(
+                            f"/session/{session_id}/message",
+                            content=message_body(
+                                {"model": model_obj, "agent": "sisyphus"},
+                                message,
+                                paths,
+                            ),
+                            headers={"Content-Type": "application/json"},
+                        )
+                    else:
+                        response = await backend.client.post(
+                            f"/session/{session_id}/message",
+                            json={
+                                "model": model_obj,
+                                "agent": "sisyphus",
+                                "parts": [{"type": "text", "text": message}],
+                            },
+                        )
+                failed = response.status_code >= 500
+            except httpx.HTTPError as e:
+                # Waiting for one of our own pooled connections is local
+                # congestion, not a sign OpenCode is unhealthy
+                failed = None if isinstance(e, httpx.PoolTimeout) else True
+                if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+                    # Never reached the backend, so it is safe to retry elsewhere
+                    backend.mark_down(e)
+                    raise BackendUnavailable(backend, e) from e
+                raise
+            finally:
+                metrics.OPENCODE_INFLIGHT.dec()
+                backend.inflight -= 1
+                self._record_outcome(
+                    backend, user_id, failed, time.perf_counter() - started
+                )
+            if response.status_code == 404:
+                raise SessionNotFound(backend, session_id)
+            response.raise_for_status()
+            data = response.json()
+
+            # Check for errors first
+            if "error" in data and data["error"]:
+                error_data = data.get("error", {})
+                error_msg = error_data.get("data", {}).get("message", str(error_data))
+                metrics.ERRORS.inc(kind="opencode_api")
+                logger.error("OpenCode API error: %s", error_msg)
+                return f"❌ OpenCode Error: {error_msg[:500]}"
+
+            # Extract the assistant's response from parts
+            text = response_text(data)
+            if text is not None:
+                if cache_key and text:
+                    self.response_cache.put(
+                        cache_key, text, time.perf_counter() - started
+                    )
+                return text
+
+            return "Message sent to OpenCode (waiting for response...)"
+
+        except (BackendUnavailable, CircuitOpen, Overloaded, SessionNotFound):
+            raise
+        except Exception as e:
+            metrics.ERRORS.inc(kind="opencode")
+            logger.error("Failed to send message to OpenCode: %s", e)
+            return f"Error communicating with OpenCode: {str(e)}"
+        finally:
+            if files:
+                # The request body has been read from them by now
+                self.files.release(files)
+
+    async def abort_session(self, user_id: int) -> None:
+        """Ask OpenCode to stop the agent run in user's session"""
+        value = self.user_sessions.get(user_id)
+        if value is None:
+            return
+        backend, session_id = self.backends.resolve(value)
+        if backend is None:
+            return
+        try:
+            response = await backend.client.post(
+                f"/session/{session_id}/abort", timeout=10
+            )
+            response.raise_for_status()
+            logger.info("Aborted OpenCode run in session %s", session_id)
+        except httpx.HTTPError as e:
+            metrics.ERRORS.inc(kind="abort")
+            logger.warning("Failed to abort session %s: %s", session_id, e)
+
+    async def run_reply(
+        self,
+        chat_id: int,
+        user_id: int,
+        call: Callable[[Backend, str], Awaitable[str]],
+    ) -> Optional[str]:
+        """run_in_session as user's current reply in chat, which /cancel can drop
+
+        Returns None if the reply was cancelled.
+        """
+        # Unique among job workers too, since a user's jobs run one at a time
+        key = (chat_id, user_id)
+        task = asyncio.create_task(self.run_in_session(user_id, call))
+        self._replies[key] = task
+        try:
+            await asyncio.wait({task})
+        finally:
+            if self._replies.get(key) is task:
+                del self._replies[key]
+            task.cancel()
+        if task.cancelled():
+            logger.info("Dropped cancelled reply for user %s", user_id)
+            return None
+        try:
+            return task.result()
+        except (CircuitOpen, Overloaded) as e:
+            return self._shed_reply(user_id, e)
+
+    def _record_outcome(
+        self,
+        backend: Backend,
+        user_id: Optional[int],
+        failed: Optional[bool],
+        latency: float,
+    ) -> None:
+        """Feed a finished OpenCode request to the limiter and circuit breaker"""
+        if failed is None:
+            self.limiter.release(flow=user_id)
+        elif failed:
+            self.limiter.release(failed=True, flow=user_id)
+            backend.breaker.record_failure()
+        else:
+            self.limiter.release(latency, flow=user_id)
+            backend.breaker.record_success()
+            # Health probes only run with several backends; an answer also counts
+            backend.mark_up()
+
+    def _shed_reply(self, user_id: int, error: Exception) -> str:
+        """Short reply for a message turned away before reaching OpenCode"""
+        reason = "circuit_open" if isinstance(error, CircuitOpen) else "overloaded"
+        metrics.SHED.inc(reason=reason)
+        logger.warning("Turned away message from user %s: %s", user_id, error)
+        if isinstance(error, CircuitOpen):
+            return (
+                "⚠️ OpenCode is not responding right now. Please try again in a minute."
+            )
+        return "🚦 OpenCode is busy right now. Please try again in a minute."
+
+    async def stream_to_telegram(
+        self,
+        chat_id: int,
+        user_id: int,
+        message: str,
+        files: Optional[List[Attachment]] = None,
+    ) -> None:
+        """Send message to OpenCode, mirroring partial output into one Telegram message"""
+        editor = ThrottledMessageEditor(
+            self.outbound, chat_id, min_interval=STREAM_EDIT_INTERVAL
+        )
+        await editor.start()
+
+        response = await self.run_reply(
+            chat_id,
+            user_id,
+            lambda backend, session_id: self._stream_reply(
+                editor, backend, session_id, message, user_id, files
+            ),
+        )
+        if response is None:
+            await editor.finish("🛑 Cancelled.")
+            return
+
+        await deliver_response(
+            self.outbound,
+            chat_id,
+            response,
+            document_threshold=RESPONSE_DOCUMENT_THRESHOLD,
+            chunk_delay=RESPONSE_CHUNK_DELAY,
+            send_first=editor.finish,
+        )
+
+    async def _stream_reply(
+        self,
+        editor: ThrottledMessageEditor,
+        backend: Backend,
+        session_id: str,
+        message: str,
+        user_id: int,
+        files: Optional[List[Attachment]] = None,
+    ) -> str:
+        """Get the answer to message, mirroring partial output through editor"""
+        if not backend.events.connected:
+            # No partial output until the stream is back; the answer still comes
+            metrics.RETRIES.inc(kind="stream_fallback")
+        with backend.events.subscribe(session_id) as events:
+            accumulator = StreamAccumulator()
+
+            async def mirror():
+                async for event in events:
+                    if accumulator.feed(event):
+                        await editor.update(accumulator.text)
+
+            mirror_task = asyncio.create_task(mirror())
+            try:
+                # The message POST still returns the authoritative final answer
+                return await self.send_to_opencode(
+                    backend, session_id, message, user_id, files
+                )
+            finally:
+                mirror_task.cancel()
+
+    # Jobs
+
+    async def submit_job(
+        self,
+        chat_id: int,
+        user_id: int,
+        prompt: str,
+        files: Optional[List[Attachment]] = None,
+    ) -> None:
+        """Queue prompt as a job and tell the user it was accepted"""
+        encoded = json.dumps([file.to_dict() for file in files]) if files else None
+        try:
+            job = self.jobs.submit(chat_id, user_id, prompt, files=encoded)
+        except QueueFull as e:
+            metrics.SHED.inc(reason="job_queue_full")
+            logger.warning("Refused job from user %s: %s", user_id, e)
+            await self.outbound.send_message(
+                chat_id=chat_id,
+                text="🚦 The job queue is full. Please try again in a few minutes.",
+            )
+            return
+        logger.info("Queued job #%s for user %s", job.id, user_id)
+        await self.outbound.send_message(
+            chat_id=chat_id,
+            text=f"📥 Queued as job #{job.id}. I'll send the answer when it's "
+            "ready; /status shows its progress.",
+        )
+
+    async def _run_jobs(self) -> None:
+        """Job worker: run queued jobs until the queue is stopped"""
+        while True:
+            job = await self.jobs.next()
+            if job is None:
+                return
+            # Each worker task has its own context, so this only tags this job
+            correlation_id.set(f"job{job.id}")
+            await self._run_job(job)
+
+    async def _run_job(self, job: Job) -> None:
+        metrics.JOB_QUEUE_WAIT.observe(job.started - job.created)
+        logger.info("Running job #%s for user %s", job.id, job.user_id)
+        files = [Attachment.from_dict(file) for file in json.loads(job.files or "[]")]
+        try:
+            await self.outbound.send_chat_action(job.chat_id, "typing")
+            response = await self.run_reply(
+                job.chat_id,
+                job.user_id,
+                lambda backend, session_id: self.send_to_opencode(
+                    backend, session_id, job.prompt, job.user_id, files
+                ),
+            )
+            if response is None:
+                self.jobs.finish(job, CANCELLED)
+                metrics.JOBS_FINISHED.inc(status=CANCELLED)
+                return
+            await deliver_response(
+                self.outbound,
+                job.chat_id,
+                f"✅ Job #{job.id} done:\n\n{response}",
+                document_threshold=RESPONSE_DOCUMENT_THRESHOLD,
+                chunk_delay=RESPONSE_CHUNK_DELAY,
+            )
+            self.jobs.finish(job, DONE)
+            metrics.JOBS_FINISHED.inc(status=DONE)
+        except Exception as e:
+            metrics.ERRORS.inc(kind="job")
+            logger.error("Job #%s failed: %s", job.id, e, exc_info=True)
+            self.jobs.finish(job, FAILED, error=str(e)[:200])
+            metrics.JOBS_FINISHED.inc(status=FAILED)
+            if not isinstance(e, RetryAfter):
+                try:
+                    await self.outbound.send_message(
+                        chat_id=job.chat_id, text=f"❌ Job #{job.id} failed: {e}"
+                    )
+                except Exception as send_error:
+                    logger.error("Failed to report job #%s: %s", job.id, send_error)
+
+    def jobs_text(self, user_id: int) -> str:
+        """Reply to /jobs"""
+        if self.jobs is None:
+            return "Job mode is off; messages are answered directly."
+        jobs = self.jobs.recent(user_id)
+        if not jobs:
+            return "You have no jobs yet."
+        lines = [
+            f"#{job.id} {self.jobs.describe(job)} · {job.prompt[:40] or '📎'}"
+            for job in jobs
+        ]
+        return "📋 Your recent jobs:\n\n" + "\n".join(lines)
+
+    def status_text(self, user_id: int, command: str) -> str:
+        """Reply to /status [job id]: one job, the latest by default"""
+        if self.jobs is None:
+            return "Job mode is off; messages are answered directly."
+        args = command.split()[1:]
+        if args:
+            job_id = args[0].lstrip("#")
+            job = self.jobs.get(int(job_id), user_id) if job_id.isdecimal() else None
+            if job is None:
+                return f"No job {args[0]} found. /jobs lists your jobs."
+        else:
+            jobs = self.jobs.recent(user_id, limit=1)
+            if not jobs:
+                return "You have no jobs yet."
+            job = jobs[0]
+        return (
+            f"Job #{job.id}: {self.jobs.describe(job)}\n"
+            f"Prompt: {job.prompt[:200] or '📎'}\n\n"
+            f"Queue: {self.jobs.queued} waiting, {self.jobs.running} running"
+        )
+
+    # Telegram
+
+    async def handle_update(
+        self,
+        update,
+        text: Optional[str] = None,
+        files: Optional[List[Attachment]] = None,
+    ):
+        """Handle Telegram update; text and files replace its own if given"""
+        # Parse a raw update dict if needed
+        if isinstance(update, dict):
+            update = parse_update(update)
+            if update is None:
+                return
+
+        user_message = update.text if text is None else text
+        if files is None:
+            files = [update.file] if update.file else []
+        user_id = update.user_id
+        chat_id = update.chat_id
+
+        logger.info(
+            "Received message from %s (ID=%s): %s%s",
+            update.username or update.first_name,
+            user_id,
+            Redacted(user_message),
+            f" with {len(files)} files" if files else "",
+        )
+
+        bot = self.outbound
+
+        # Handle commands
+        if not files and user_message.startswith("/"):
+            if user_message == "/start":
+                await bot.send_message(
+                    chat_id=chat_id,
+                    text=f"👋 Hello, {update.first_name}!\n\n"
+                    "I'm your OpenCode assistant.\n"
+                    "Send me any message and I'll forward it to OpenCode for processing.\n\n"
+                    "Commands:\n"
+                    "/start - Show this welcome message\n"
+                    "/help - Show help information\n"
+                    "/reset - Create a new session\n"
+                    "/cancel - Stop the reply in progress\n"
+                    "/jobs - List your recent jobs (job mode)\n"
+                    "/status - Show your latest job (job mode)",
+                )
+            elif user_message == "/help":
+                await bot.send_message(
+                    chat_id=chat_id,
+                    text="📖 **Help**\n\n"
+                    "Just send me a message and I'll forward it to OpenCode.\n\n"
+                    "Available commands:\n"
+                    "/start - Start the bot\n"
+                    "/help - Show this help\n"
+                    "/reset - Reset your session and start fresh\n"
+                    "/cancel - Stop the reply in progress\n"
+                    "/jobs - List your recent jobs (job mode)\n"
+                    "/status [job] - Show a job, your latest by default",
+                )
+            elif user_message == "/reset":
+                old_session_id = self.user_sessions.delete(user_id)
+                if old_session_id:
+                    logger.info(
+                        "Reset session for user %s (was %s)", user_id, old_session_id
+                    )
+
+                await self.get_or_create_session(user_id)
+                await bot.send_message(
+                    chat_id=chat_id, text="✅ Session reset! Starting fresh."
+                )
+            elif user_message == "/jobs":
+                await bot.send_message(chat_id=chat_id, text=self.jobs_text(user_id))
+            elif user_message.split()[0] == "/status":
+                await bot.send_message(
+                    chat_id=chat_id, text=self.status_text(user_id, user_message)
+                )
+            elif is_cancel(update):
+                # The reply itself was already dropped when /cancel arrived
+                await bot.send_message(chat_id=chat_id, text="🛑 Cancelled.")
+            return
+
+        if update.update_id < self._cancelled_before.get(update_key(update), 0):
+            logger.info("Skipping cancelled message %s", update.update_id)
+            return
+
+        scope, retry_in = self.quotas.admit(user_id, chat_id)
+        if scope is not None:
+            logger.warning("Refused prompt from user %s: %s quota", user_id, scope)
+            await bot.send_message(
+                chat_id=chat_id,
+                text="🚦 Too many messages"
+                + (" in this chat" if scope == "chat" else "")
+                + f". Please wait {int(retry_in) + 1}s and try again.",
+            )
+            return
+
+        # Handle regular messages
+        try:
+            if self.jobs is not None:
+                await self.submit_job(chat_id, user_id, user_message, files)
+                return
+
+            if STREAM_RESPONSES:
+                await self.stream_to_telegram(chat_id, user_id, user_message, files)
+                logger.info("Sent response to user %s", user_id)
+                return
+
+            # Send "typing" action
+            await bot.send_chat_action(chat_id, "typing")
+
+            # Send message to OpenCode in this user's session
+            response = await self.run_reply(
+                chat_id,
+                user_id,
+                lambda backend, session_id: self.send_to_opencode(
+                    backend, session_id, user_message, user_id, files
+                ),
+            )
+            if response is None:
+                return
+
+            # Send response back to Telegram, split or as a file if it is long
+            await deliver_response(
+                bot,
+                chat_id,
+                response,
+                document_threshold=RESPONSE_DOCUMENT_THRESHOLD,
+                chunk_delay=RESPONSE_CHUNK_DELAY,
+            )
+            logger.info("Sent response to user %s", user_id)
+
+        except Exception as e:
+            metrics.ERRORS.inc(kind="handler")
+            logger.error("Error processing message: %s", e, exc_info=True)
+            if isinstance(e, RetryAfter):
+                # Still rate limited after retries; another message would not help
+                return
+            await bot.send_message(
+                chat_id=chat_id,
+                text=f"❌ Sorry, an error occurred while processing your message.\n\n"
+                f"Error: {str(e)}",
+            )
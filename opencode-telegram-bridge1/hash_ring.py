@@ -0,0 +1,36 @@
+"""
+Consistent hashing
+
+Maps keys (user IDs) to nodes (worker processes, OpenCode backends) so that
+adding or removing a node only moves the keys of that node's neighbours.
+"""
+
+import bisect
+import hashlib
+from typing import Hashable, Iterable, List
+
+
+def _hash(value: object) -> int:
+    digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes: Iterable[Hashable], replicas: int = 64):
+        self.nodes = list(nodes)
+        if not self.nodes:
+            raise ValueError("HashRing needs at least one node")
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self._points: List[int] = [point for point, _ in points]
+        self._owners: List[Hashable] = [node for _, node in points]
+
+    def node_for(self, key: Hashable) -> Hashable:
+        """Node owning key: the first ring point at or after its hash"""
+        if len(self.nodes) == 1:
+            return self.nodes[0]
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
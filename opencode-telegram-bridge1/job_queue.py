@@ -0,0 +1,267 @@
+"""
+Durable job queue for job mode
+
+In job mode a prompt is acknowledged at once and stored as a job; a pool of
+workers runs jobs against OpenCode and delivers each answer when it is done.
+Jobs live in a SQLite table so queued and interrupted jobs survive a restart.
+A user's jobs run one at a time, in order, since they share a session.
+"""
+
+import time
+import asyncio
+import sqlite3
+import logging
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# Largest integer SQLite stores, so no job ID can be above it
+MAX_JOB_ID = 2**63 - 1
+
+
+def format_age(seconds: float) -> str:
+    """Short human duration: 45s, 12m, 3h, 2d"""
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size:
+            return f"{int(seconds // size)}{unit}"
+    return f"{int(seconds)}s"
+
+
+class QueueFull(Exception):
+    """The job queue is at its size limit"""
+
+
+class Job:
+    """A prompt waiting for, or being given, an answer"""
+
+    def __init__(
+        self,
+        job_id: int,
+        chat_id: int,
+        user_id: int,
+        prompt: str,
+        status: str = QUEUED,
+        created: float = 0.0,
+        started: Optional[float] = None,
+        finished: Optional[float] = None,
+        error: Optional[str] = None,
+        files: Optional[str] = None,
+    ):
+        self.id = job_id
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.prompt = prompt
+        self.status = status
+        self.created = created
+        self.started = started
+        self.finished = finished
+        self.error = error
+        # JSON list of the attachments sent with the prompt, if any
+        self.files = files
+
+
+class JobQueue:
+    """Bounded FIFO of jobs persisted to SQLite
+
+    max_size bounds the number of queued jobs. Finished jobs are kept for
+    retention seconds so /jobs can list them. As with the session store,
+    several processes can share the database when each is given an owns
+    predicate selecting a disjoint set of users.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int = 1000,
+        retention: float = 7 * 24 * 3600,
+        owns: Optional[Callable[[int], bool]] = None,
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.owns = owns
+        # Queued and running jobs; finished ones are only in the database
+        self._active: Dict[int, Job] = {}
+        self._queued: Deque[int] = deque()
+        self._busy_users: Set[int] = set()
+        self._changed = asyncio.Event()
+        self._closed = False
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, "
+            "user_id INTEGER NOT NULL, prompt TEXT NOT NULL, status TEXT NOT NULL, "
+            "created REAL NOT NULL, started REAL, finished REAL, error TEXT, "
+            "files TEXT)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+        if "files" not in columns:
+            # Databases created before attachments were supported
+            self._db.execute("ALTER TABLE jobs ADD COLUMN files TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, id)")
+        self._load(retention)
+
+    def _load(self, retention: float) -> None:
+        with self._db:
+            self._db.execute(
+                "DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?",
+                (time.time() - retention,),
+            )
+        rows = self._db.execute(
+            "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY id", (QUEUED, RUNNING)
+        ).fetchall()
+        interrupted = []
+        for row in rows:
+            job = Job(*row)
+            if self.owns is not None and not self.owns(job.user_id):
+                continue
+            if job.status == RUNNING:
+                # Stopped mid-run by a restart; run it again from the start
+                job.status = QUEUED
+                job.started = None
+                interrupted.append(job.id)
+            self._active[job.id] = job
+            self._queued.append(job.id)
+        if interrupted:
+            with self._db:
+                self._db.executemany(
+                    "UPDATE jobs SET status = ?, started = NULL WHERE id = ?",
+                    [(QUEUED, job_id) for job_id in interrupted],
+                )
+        if self._queued:
+            logger.info(
+                "Loaded %s queued jobs from %s (%s interrupted)",
+                len(self._queued),
+                self.path,
+                len(interrupted),
+            )
+
+    @property
+    def queued(self) -> int:
+        return len(self._queued)
+
+    @property
+    def running(self) -> int:
+        return len(self._busy_users)
+
+    def submit(
+        self, chat_id: int, user_id: int, prompt: str, files: Optional[str] = None
+    ) -> Job:
+        """Queue a prompt; raise QueueFull if max_size jobs are waiting"""
+        if len(self._queued) >= self.max_size:
+            raise QueueFull(f"{len(self._queued)} jobs already queued")
+        now = time.time()
+        with self._db:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (chat_id, user_id, prompt, status, created, files) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (chat_id, user_id, prompt, QUEUED, now, files),
+            )
+        job = Job(cursor.lastrowid, chat_id, user_id, prompt, created=now, files=files)
+        self._active[job.id] = job
+        self._queued.append(job.id)
+        self._changed.set()
+        return job
+
+    async def next(self) -> Optional[Job]:
+        """Start the oldest job whose user has none running; None once closed"""
+        while not self._closed:
+            for job_id in self._queued:
+                job = self._active[job_id]
+                if job.user_id not in self._busy_users:
+                    self._queued.remove(job_id)
+                    self._busy_users.add(job.user_id)
+                    self._update(job, RUNNING, started=time.time())
+                    return job
+            self._changed.clear()
+            await self._changed.wait()
+        return None
+
+    def finish(self, job: Job, status: str, error: Optional[str] = None) -> None:
+        """Record a running job's outcome and free its user for the next one"""
+        self._busy_users.discard(job.user_id)
+        self._active.pop(job.id, None)
+        self._update(job, status, finished=time.time(), error=error)
+        self._changed.set()
+
+    def cancel_queued(self, chat_id: int, user_id: int) -> List[Job]:
+        """Cancel user's jobs in chat that have not started yet"""
+        cancelled = [
+            self._active[job_id]
+            for job_id in self._queued
+            if self._active[job_id].chat_id == chat_id
+            and self._active[job_id].user_id == user_id
+        ]
+        for job in cancelled:
+            self._queued.remove(job.id)
+            del self._active[job.id]
+            self._update(job, CANCELLED, finished=time.time())
+        return cancelled
+
+    def position(self, job: Job) -> int:
+        """1-based place of a queued job in the queue, 0 if it is not queued"""
+        try:
+            return self._queued.index(job.id) + 1
+        except ValueError:
+            return 0
+
+    def describe(self, job: Job) -> str:
+        """One-line state of a job for /jobs and /status"""
+        now = time.time()
+        if job.status == QUEUED:
+            return f"🕒 queued, {self.position(job)} in line"
+        if job.status == RUNNING:
+            return f"⚙️ running for {format_age(now - job.started)}"
+        if job.status == DONE:
+            return f"✅ done {format_age(now - job.finished)} ago"
+        if job.status == FAILED:
+            return f"❌ failed: {job.error}"
+        return "🛑 cancelled"
+
+    def get(self, job_id: int, user_id: int) -> Optional[Job]:
+        """One of user's jobs by ID, whether active or finished"""
+        if not 0 < job_id <= MAX_JOB_ID:
+            return None
+        job = self._active.get(job_id)
+        if job is not None:
+            return job if job.user_id == user_id else None
+        row = self._db.execute(
+            "SELECT * FROM jobs WHERE id = ? AND user_id = ?", (job_id, user_id)
+        ).fetchone()
+        return Job(*row) if row else None
+
+    def recent(self, user_id: int, limit: int = 10) -> List[Job]:
+        """User's latest jobs, newest first"""
+        rows = self._db.execute(
+            "SELECT * FROM jobs WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, limit),
+        ).fetchall()
+        # Active jobs carry the live state; rows may lag a running update
+        return [self._active.get(row[0]) or Job(*row) for row in rows]
+
+    def stop(self) -> None:
+        """Stop handing out jobs; waiting next() calls return None"""
+        self._closed = True
+        self._changed.set()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def _update(self, job: Job, status: str, **fields) -> None:
+        job.status = status
+        for name, value in fields.items():
+            setattr(job, name, value)
+        with self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, started = ?, finished = ?, error = ? "
+                "WHERE id = ?",
+                (job.status, job.started, job.finished, job.error, job.id),
+            )
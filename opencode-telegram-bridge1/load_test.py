@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test for bot.py / bot_webhook.py
+
+Starts a mock OpenCode server and a fake Telegram Bot API in-process, runs the
+bot as a subprocess against them and simulates N concurrent users, each
+sending a series of messages and waiting for the answer. Reports throughput,
+p50/p95/p99 end-to-end latency and the bot's memory use.
+
+    python3 load_test.py --users 50 --messages 5 --latency 1.0
+    python3 load_test.py --bot bot_webhook.py --users 50
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List
+
+import httpx
+
+from mini_http import server_port
+from mock_opencode import DONE_MARKER, start_mock_opencode
+from mock_telegram import start_fake_telegram
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_TOKEN = "123456:LOADTEST"
+WEBHOOK_SECRET = "loadtest-secret"
+# Replies that mean the message failed or was turned away
+FAILURE_PREFIXES = ("❌", "⚠️", "🚦", "📎", "Error communicating with OpenCode")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def read_rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.webhook = "webhook" in os.path.basename(args.bot)
+        self.webhook_port = free_port()
+        # Keep the bot's state files out of the working tree
+        self.state_dir = tempfile.TemporaryDirectory()
+        # chat_id -> future resolved with (timestamp, ok) when the answer lands
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.timeouts = 0
+        self.rss_samples: List[int] = []
+
+    def on_outbound(self, method: str, params: dict, timestamp: float) -> None:
+        future = self._waiting.get(params.get("chat_id"))
+        if future is None or future.done():
+            return
+        text = params.get("text") or ""
+        if method == "sendDocument" or DONE_MARKER in text:
+            future.set_result((timestamp, True))
+        elif method == "sendMessage" and text.startswith(FAILURE_PREFIXES):
+            future.set_result((timestamp, False))
+
+    def bot_env(self, opencode_port: int, telegram_port: int) -> dict:
+        env = dict(os.environ)
+        env.update(
+            BOT_TOKEN=TEST_TOKEN,
+            OPENCODE_URL=f"http://127.0.0.1:{opencode_port}",
+            TELEGRAM_API_URL=f"http://127.0.0.1:{telegram_port}/bot",
+            TELEGRAM_FILE_URL=f"http://127.0.0.1:{telegram_port}/file/bot",
+            FILE_CACHE_DIR=os.path.join(self.state_dir.name, "file_cache"),
+            SESSION_STORE="memory",
+            OFFSET_FILE=os.path.join(self.state_dir.name, "offset.json"),
+            JOB_DB_PATH=os.path.join(self.state_dir.name, "jobs.db"),
+        )
+        if self.webhook:
+            env.update(
+                WEBHOOK_URL=f"http://127.0.0.1:{self.webhook_port}",
+                WEBHOOK_SECRET=WEBHOOK_SECRET,
+                PORT=str(self.webhook_port),
+            )
+        return env
+
+    async def wait_ready(self, telegram, process: subprocess.Popen) -> None:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(
+                    f"{self.args.bot} exited with code {process.returncode}"
+                )
+            if self.webhook:
+                try:
+                    _, writer = await asyncio.open_connection(
+                        "127.0.0.1", self.webhook_port
+                    )
+                    writer.close()
+                    return
+                except OSError:
+                    pass
+            elif telegram.calls.get("getUpdates"):
+                return
+            await asyncio.sleep(0.1)
+        raise RuntimeError("Bot did not become ready within 30s")
+
+    async def send(
+        self, telegram, client: httpx.AsyncClient, user_id: int, text: str
+    ) -> None:
+        if not self.webhook:
+            telegram.inject_message(user_id, user_id, text)
+            return
+        update = telegram.build_update(user_id, user_id, text)
+        response = await client.post(
+            f"http://127.0.0.1:{self.webhook_port}/webhook",
+            json=update,
+            headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET},
+        )
+        response.raise_for_status()
+
+    async def simulate_user(
+        self, telegram, client: httpx.AsyncClient, user_id: int
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        for i in range(self.args.messages):
+            future = loop.create_future()
+            self._waiting[user_id] = future
+            started = time.monotonic()
+            try:
+                await self.send(
+                    telegram, client, user_id, f"message {i} from user {user_id}"
+                )
+                finished, ok = await asyncio.wait_for(future, self.args.timeout)
+                self.latencies.append(finished - started)
+                if not ok:
+                    self.errors += 1
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+            except httpx.HTTPError:
+                self.errors += 1
+            finally:
+                self._waiting.pop(user_id, None)
+            if self.args.think_time:
+                await asyncio.sleep(self.args.think_time)
+
+    async def sample_memory(self, pid: int) -> None:
+        while True:
+            rss = read_rss_kb(pid)
+            if rss:
+                self.rss_samples.append(rss)
+            await asyncio.sleep(0.5)
+
+    async def run(self) -> dict:
+        args = self.args
+        mock, opencode_server = await start_mock_opencode(
+            latency=args.latency,
+            jitter=args.jitter,
+            tokens=args.tokens,
+            response_chars=args.response_chars,
+            error_rate=args.error_rate,
+        )
+        telegram, telegram_server = await start_fake_telegram()
+        telegram.on_outbound = self.on_outbound
+
+        process = subprocess.Popen(
+            [sys.executable, args.bot],
+            cwd=BOT_DIR,
+            env=self.bot_env(
+                server_port(opencode_server), server_port(telegram_server)
+            ),
+            stdout=None if args.verbose else subprocess.DEVNULL,
+            stderr=None if args.verbose else subprocess.DEVNULL,
+        )
+        sampler = asyncio.create_task(self.sample_memory(process.pid))
+        try:
+            await self.wait_ready(telegram, process)
+            rss_idle = read_rss_kb(process.pid)
+            async with httpx.AsyncClient(timeout=30) as client:
+                started = time.monotonic()
+                await asyncio.gather(
+                    *(
+                        self.simulate_user(telegram, client, 10000 + i)
+                        for i in range(args.users)
+                    )
+                )
+                elapsed = time.monotonic() - started
+        finally:
+            sampler.cancel()
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            opencode_server.close()
+            telegram_server.close()
+
+        completed = len(self.latencies)
+        return {
+            "bot": args.bot,
+            "users": args.users,
+            "messages": args.users * args.messages,
+            "completed": completed,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_msg_s": round(completed / elapsed, 2) if elapsed else 0.0,
+            "latency_p50_s": round(percentile(self.latencies, 50), 3),
+            "latency_p95_s": round(percentile(self.latencies, 95), 3),
+            "latency_p99_s": round(percentile(self.latencies, 99), 3),
+            "rss_idle_mb": round(rss_idle / 1024, 1),
+            "rss_peak_mb": round(max(self.rss_samples, default=0) / 1024, 1),
+            "opencode_max_inflight": mock.stats["max_inflight"],
+            "opencode_sessions_created": mock.stats["sessions_created"],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Telegram bridge")
+    parser.add_argument("--bot", default="bot.py", help="bot.py or bot_webhook.py")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent users")
+    parser.add_argument("--messages", type=int, default=3, help="Messages per user")
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=0.0,
+        help="Seconds between a user's messages",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=120.0, help="Seconds to wait for each answer"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=1.0, help="Mock OpenCode seconds per run"
+    )
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--response-chars", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--json", metavar="PATH", help="Also write results as JSON")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show bot output")
+    args = parser.parse_args()
+
+    print(f"🚀 Load testing {args.bot}: {args.users} users × {args.messages} messages")
+    results = asyncio.run(LoadTest(args).run())
+
+    print("=" * 50)
+    for key, value in results.items():
+        print(f"   {key:28} {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return (
+        0
+        if results["completed"] == results["messages"] and not results["errors"]
+        else 1
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
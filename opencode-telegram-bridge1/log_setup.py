@@ -0,0 +1,117 @@
+"""
+Logging setup shared by the bridge processes
+
+Records are put on a queue and formatted and written to stderr by a
+listener thread, so a slow terminal or log pipe never blocks the event
+loop. Output is the usual text lines or, with LOG_FORMAT=json, one JSON
+object per line. Every record carries the correlation ID of the update or
+job being handled, which follows it through the session lookup, the
+OpenCode call and the Telegram send.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+# Minimum level logged: DEBUG, INFO, WARNING or ERROR
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" for readable lines, "json" for one JSON object per line
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Characters of a user message kept in logs (0 logs only its length)
+LOG_MESSAGE_CHARS = int(os.getenv("LOG_MESSAGE_CHARS", 80))
+
+# ID of the update or job being handled, "-" outside of one
+correlation_id: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "correlation_id", default="-"
+)
+
+
+class Redacted:
+    """User text that is truncated or hidden only when the record is formatted"""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __str__(self) -> str:
+        if LOG_MESSAGE_CHARS <= 0:
+            return f"<{len(self.text)} chars>"
+        if len(self.text) <= LOG_MESSAGE_CHARS:
+            return repr(self.text)
+        return f"{self.text[:LOG_MESSAGE_CHARS]!r}… <{len(self.text)} chars>"
+
+
+class _ContextFilter(logging.Filter):
+    """Stamp records with the correlation ID while still in the caller's task"""
+
+    def __init__(self, process: str):
+        super().__init__()
+        self.process = process
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        record.process_name = self.process
+        return True
+
+
+class _LazyQueueHandler(QueueHandler):
+    """Queue records unformatted; the listener thread formats them"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "process": record.process_name,
+            "logger": record.name,
+            "correlation_id": record.correlation_id,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(process: str = "bridge") -> QueueListener:
+    """Route all logging through a queue to a stderr listener thread
+
+    process names this process in every record, e.g. "worker-2". The
+    listener is stopped, flushing what is queued, when the process exits.
+    """
+    if LOG_FORMAT == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            "%(asctime)s - %(process_name)s - %(name)s - %(levelname)s - "
+            "[%(correlation_id)s] %(message)s"
+        )
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(formatter)
+
+    records: "queue.SimpleQueue[Optional[logging.LogRecord]]" = queue.SimpleQueue()
+    handler = _LazyQueueHandler(records)
+    handler.addFilter(_ContextFilter(process))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    listener = QueueListener(records, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
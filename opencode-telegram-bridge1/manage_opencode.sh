@@ -43,6 +43,12 @@ check_opencode() {
         return 0
     else
         return 1
+    fi
+}
+
+# 检查 OpenCode API 是否响应（与 bridge 的健康检查相同：GET /session）
+check_opencode_api() {
+    curl -sf --max-time 3 http://localhost:4096/session > /dev/null 2>&1
 }
 
 # 启动 OpenCode
@@ -63,11 +69,14 @@ start_opencode() {
     # 保存 PID
     echo $OPENCODE_PID > "$OPENCODE_PID_FILE"
     
-    # 等待启动
-    sleep 5
+    # 等待 API 可用（最多 30 秒）
+    for _ in $(seq 1 30); do
+        check_opencode_api && break
+        sleep 1
+    done
     
     # 验证
-    if check_opencode; then
+    if check_opencode_api; then
         print_success "OpenCode 启动成功"
         print_info "  PID: $OPENCODE_PID"
         print_info "  地址: http://localhost:4096"
@@ -125,7 +134,7 @@ status_opencode() {
         print_info "  地址: http://localhost:4096"
         
         # 测试连接
-        if curl -s http://localhost:4096/session > /dev/null 2>&1; then
+        if check_opencode_api; then
             print_success "  API 连接正常"
         else
             print_warning "  API 无响应"
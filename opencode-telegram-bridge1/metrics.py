@@ -0,0 +1,363 @@
+"""
+Prometheus-style metrics for the bridge
+
+A small dependency-free implementation of counters, gauges and histograms
+rendered in the Prometheus text exposition format, plus the bridge's metric
+definitions and an opt-in HTTP listener serving /metrics.
+"""
+
+import time
+import bisect
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from telegram.request import HTTPXRequest
+
+from mini_http import Request, Response, serve
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)  # fmt: skip
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(
+    names: Sequence[str], values: Tuple[str, ...], extra: str = ""
+) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = (
+            f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        )
+        return header + "".join(line + "\n" for line in self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], object]] = None
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], object]) -> None:
+        """Compute the value at scrape time
+
+        function returns a number, or for labelled gauges a dict mapping
+        label-value tuples to numbers.
+        """
+        self._function = function
+
+    def samples(self) -> List[str]:
+        values = self._values
+        if self._function is not None:
+            try:
+                result = self._function()
+            except Exception as e:
+                logger.warning("Gauge %s callback failed: %s", self.name, e)
+                result = {}
+            values = result if isinstance(result, dict) else {(): result}
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+            for key, value in values.items()
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[index] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {state[-2]}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self._metrics.values())
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(
+    name: str, documentation: str, labelnames: Sequence[str] = ()
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames))
+
+
+# Bridge metrics
+
+OPENCODE_LATENCY = histogram(
+    "bridge_opencode_request_seconds", "send_to_opencode round-trip time"
+)
+SESSION_CREATE_LATENCY = histogram(
+    "bridge_session_create_seconds", "OpenCode session creation time"
+)
+TELEGRAM_SEND_LATENCY = histogram(
+    "bridge_telegram_request_seconds", "Telegram Bot API call time", ["method"]
+)
+GET_UPDATES_LATENCY = histogram(
+    "bridge_get_updates_seconds", "getUpdates long-poll round-trip time"
+)
+OPENCODE_INFLIGHT = gauge(
+    "bridge_opencode_inflight_requests", "OpenCode requests currently in flight"
+)
+QUEUE_DEPTH = gauge(
+    "bridge_queue_depth",
+    "Updates waiting per chat (chats with a backlog only)",
+    ["chat"],
+)
+ACTIVE_SESSIONS = gauge("bridge_active_sessions", "Sessions held in the session store")
+SESSIONS_REAPED = counter(
+    "bridge_sessions_reaped_total", "Released OpenCode sessions deleted on the server"
+)
+REAPER_PENDING = gauge(
+    "bridge_reaper_pending", "Released OpenCode sessions waiting to be deleted"
+)
+ERRORS = counter("bridge_errors_total", "Errors by where they occurred", ["kind"])
+TRUNCATIONS = counter("bridge_truncations_total", "Responses cut to fit Telegram")
+DUPLICATE_UPDATES = counter(
+    "bridge_duplicate_updates_total", "Replayed updates skipped by deduplication"
+)
+OUTBOUND_MERGED = counter(
+    "bridge_outbound_merged_total",
+    "Outbound typing actions and progress edits merged into another call",
+)
+OUTBOUND_QUEUE_DEPTH = gauge(
+    "bridge_outbound_queue_depth", "Telegram calls waiting for a rate-limit slot"
+)
+RESPONSES_DELIVERED = counter(
+    "bridge_responses_delivered_total",
+    "Responses delivered, by mode (single, chunked, document)",
+    ["mode"],
+)
+RETRIES = counter("bridge_retries_total", "Retried operations", ["kind"])
+BACKEND_UP = gauge(
+    "bridge_backend_up", "1 if the OpenCode backend passes health checks", ["backend"]
+)
+BACKEND_INFLIGHT = gauge(
+    "bridge_backend_inflight_requests",
+    "OpenCode requests in flight per backend",
+    ["backend"],
+)
+OPENCODE_CONCURRENCY_LIMIT = gauge(
+    "bridge_opencode_concurrency_limit",
+    "Current adaptive cap on in-flight OpenCode requests",
+)
+CIRCUIT_STATE = gauge(
+    "bridge_circuit_state",
+    "OpenCode circuit breaker state per backend (0 closed, 1 half-open, 2 open)",
+    ["backend"],
+)
+SHED = counter(
+    "bridge_shed_total",
+    "Messages answered with a busy reply instead of reaching OpenCode",
+    ["reason"],
+)
+COALESCED_MESSAGES = counter(
+    "bridge_coalesced_messages_total",
+    "Messages merged into the prompt of a message sent just before",
+)
+CANCELLED_REPLIES = counter(
+    "bridge_cancelled_replies_total",
+    "Replies dropped before delivery, by cause (cancel, new_message)",
+    ["reason"],
+)
+RESPONSE_CACHE_REQUESTS = counter(
+    "bridge_response_cache_requests_total",
+    "Response cache lookups for cacheable prompts, by result (hit, miss)",
+    ["result"],
+)
+RESPONSE_CACHE_SAVED_SECONDS = counter(
+    "bridge_response_cache_saved_seconds_total",
+    "OpenCode time the cached answers originally took, summed over hits",
+)
+RESPONSE_CACHE_BYTES = gauge(
+    "bridge_response_cache_bytes", "Size of the answers held in the response cache"
+)
+JOBS = gauge("bridge_jobs", "Jobs in job mode by state (queued, running)", ["status"])
+JOBS_FINISHED = counter(
+    "bridge_jobs_finished_total",
+    "Jobs finished, by outcome (done, failed, cancelled)",
+    ["status"],
+)
+JOB_QUEUE_WAIT = histogram(
+    "bridge_job_queue_wait_seconds", "Time jobs spent queued before running"
+)
+QUOTA_REJECTIONS = counter(
+    "bridge_quota_rejections_total",
+    "Prompts refused by a rate quota, by scope (user, chat)",
+    ["scope"],
+)
+FAIR_QUEUE_WAITING = gauge(
+    "bridge_fair_queue_waiting", "Requests waiting for an OpenCode slot"
+)
+WORKER_PENDING = gauge(
+    "bridge_worker_pending_updates",
+    "Updates forwarded to a worker process and not yet handled",
+    ["worker"],
+)
+FILE_DOWNLOADS = counter(
+    "bridge_file_downloads_total",
+    "Files sent to the bot, by result (downloaded, cached, too_large)",
+    ["result"],
+)
+FILE_DOWNLOAD_BYTES = counter(
+    "bridge_file_download_bytes_total", "Bytes downloaded from Telegram's file API"
+)
+FILE_CACHE_BYTES = gauge(
+    "bridge_file_cache_bytes", "Size of the downloaded files kept on disk"
+)
+IGNORED_UPDATES = counter(
+    "bridge_ignored_updates_total",
+    "Updates dropped because they are not messages the bridge answers",
+)
+WEBHOOK_REQUESTS = counter(
+    "bridge_webhook_requests_total",
+    "Webhook deliveries by outcome (accepted, full, stopping, bad_secret, ...)",
+    ["result"],
+)
+WEBHOOK_PENDING = gauge(
+    "bridge_webhook_pending_updates",
+    "Webhook updates acknowledged and not yet handled",
+)
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest that records Telegram Bot API call latency per method"""
+
+    __slots__ = ()
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1].split("?", 1)[0]
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            if api_method == "getUpdates":
+                GET_UPDATES_LATENCY.observe(elapsed)
+            else:
+                TELEGRAM_SEND_LATENCY.observe(elapsed, method=api_method)
+
+
+async def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """Serve REGISTRY at http://host:port/metrics"""
+
+    async def handle(request: Request) -> Response:
+        if request.path != "/metrics":
+            return Response("Not Found", status=404)
+        return Response(
+            REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+    server = await serve(handle, host, port)
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,309 @@
+"""
+Minimal asyncio HTTP/1.1 server
+
+Just enough HTTP for the local mock servers and small listeners in this repo:
+keep-alive, Content-Length request bodies, and either fixed or streamed
+(chunked) responses. No third-party dependencies.
+
+Since it also faces the internet as the webhook receiver, reading a request's
+headers, reading its body and waiting idle on a keep-alive connection each
+have a timeout, and the number of open connections can be capped, so slow or
+idle clients cannot pile up.
+"""
+
+import json
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Union
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_BYTES = 64 * 1024
+# Default seconds allowed to read request headers, read a request body, and
+# wait for the next request on a keep-alive connection
+HEADER_TIMEOUT = 10.0
+BODY_TIMEOUT = 30.0
+IDLE_TIMEOUT = 60.0
+
+REASONS = {
+    200: "OK",
+    204: "No Content",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class Request:
+    """Parsed HTTP request"""
+
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method: str, target: str, headers: Dict[str, str], body: bytes):
+        url = urlsplit(target)
+        self.method = method
+        self.path = url.path
+        self.query = dict(parse_qsl(url.query))
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b"null")
+
+
+class Response:
+    """HTTP response with a fixed body, or a streamed one when body is an async iterator"""
+
+    def __init__(
+        self,
+        body: Union[bytes, str, AsyncIterator[bytes]] = b"",
+        status: int = 200,
+        content_type: str = "text/plain; charset=utf-8",
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        if isinstance(body, str):
+            body = body.encode()
+        self.body = body
+        self.status = status
+        self.headers = {"Content-Type": content_type, **(headers or {})}
+
+
+def json_response(data, status: int = 200) -> Response:
+    return Response(json.dumps(data), status=status, content_type="application/json")
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class RequestTimeout(Exception):
+    """A client took too long to send a request it had started"""
+
+
+async def _read_request(
+    reader: asyncio.StreamReader,
+    max_body: int,
+    idle_timeout: float,
+    header_timeout: float,
+    body_timeout: float,
+) -> Optional[Request]:
+    """Read one request; None if the client closed or stayed idle"""
+    try:
+        first = await asyncio.wait_for(reader.readexactly(1), idle_timeout)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    try:
+        head = first + await asyncio.wait_for(
+            reader.readuntil(b"\r\n\r\n"), header_timeout
+        )
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    except asyncio.TimeoutError:
+        raise RequestTimeout("Request headers not received in time")
+    except asyncio.LimitOverrunError:
+        raise ValueError("Request header too large")
+
+    lines = head.decode("latin-1").split("\r\n")
+    method, target, _ = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        read_body = _read_chunked(reader, max_body)
+    else:
+        length = int(headers.get("content-length", 0))
+        if length > max_body:
+            raise ValueError("Request body too large")
+        read_body = reader.readexactly(length)
+    try:
+        body = await asyncio.wait_for(read_body, body_timeout)
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.TimeoutError:
+        raise RequestTimeout("Request body not received in time")
+    return Request(method, target, headers, body)
+
+
+async def _read_chunked(reader: asyncio.StreamReader, max_body: int) -> bytes:
+    chunks = []
+    total = 0
+    while True:
+        size = int((await reader.readline()).split(b";")[0], 16)
+        if size == 0:
+            await reader.readline()
+            return b"".join(chunks)
+        total += size
+        if total > max_body:
+            raise ValueError("Request body too large")
+        chunks.append(await reader.readexactly(size))
+        await reader.readline()
+
+
+async def _write_response(writer: asyncio.StreamWriter, response: Response) -> None:
+    status_line = (
+        f"HTTP/1.1 {response.status} {REASONS.get(response.status, 'Unknown')}\r\n"
+    )
+    headers = dict(response.headers)
+    streamed = not isinstance(response.body, bytes)
+    if streamed:
+        headers["Transfer-Encoding"] = "chunked"
+    else:
+        headers["Content-Length"] = str(len(response.body))
+    head = status_line + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+    writer.write(head.encode("latin-1"))
+
+    if not streamed:
+        writer.write(response.body)
+        await writer.drain()
+        return
+
+    try:
+        async for chunk in response.body:
+            if chunk:
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+    finally:
+        # Let generators clean up promptly when the client goes away
+        aclose = getattr(response.body, "aclose", None)
+        if aclose:
+            await aclose()
+
+
+def _connection_handler(
+    handler: Handler,
+    max_body: int,
+    header_timeout: float,
+    body_timeout: float,
+    idle_timeout: float,
+    max_connections: int,
+):
+    """Stream callback serving keep-alive requests on one connection
+
+    Connections beyond max_connections (0 = no cap) get a 503 and are closed.
+    """
+    open_connections = 0
+
+    async def on_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        nonlocal open_connections
+        if max_connections and open_connections >= max_connections:
+            logger.warning("Refusing connection: %s already open", open_connections)
+            try:
+                await _write_response(
+                    writer,
+                    Response(
+                        "Too many connections",
+                        status=503,
+                        headers={"Connection": "close"},
+                    ),
+                )
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+            return
+        open_connections += 1
+        # The first request may only take the header timeout to start
+        wait = header_timeout
+        try:
+            while True:
+                try:
+                    request = await _read_request(
+                        reader, max_body, wait, header_timeout, body_timeout
+                    )
+                except ValueError as e:
+                    await _write_response(writer, Response(str(e), status=413))
+                    break
+                except RequestTimeout as e:
+                    await _write_response(writer, Response(str(e), status=408))
+                    break
+                if request is None:
+                    break
+                try:
+                    response = await handler(request)
+                except Exception as e:
+                    logger.error(
+                        "Handler error for %s: %s", request.path, e, exc_info=True
+                    )
+                    response = Response("Internal Server Error", status=500)
+                await _write_response(writer, response)
+                if request.headers.get("connection", "").lower() == "close":
+                    break
+                wait = idle_timeout
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            open_connections -= 1
+            writer.close()
+
+    return on_connection
+
+
+async def serve(
+    handler: Handler,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    max_body: int = 10 * 1024 * 1024,
+    header_timeout: float = HEADER_TIMEOUT,
+    body_timeout: float = BODY_TIMEOUT,
+    idle_timeout: float = IDLE_TIMEOUT,
+    max_connections: int = 0,
+    **kwargs,
+) -> asyncio.AbstractServer:
+    """Start serving handler on host:port and return the asyncio server"""
+    return await asyncio.start_server(
+        _connection_handler(
+            handler,
+            max_body,
+            header_timeout,
+            body_timeout,
+            idle_timeout,
+            max_connections,
+        ),
+        host,
+        port,
+        limit=MAX_HEADER_BYTES,
+        **kwargs,
+    )
+
+
+async def serve_unix(
+    handler: Handler,
+    path: str,
+    max_body: int = 10 * 1024 * 1024,
+    header_timeout: float = HEADER_TIMEOUT,
+    body_timeout: float = BODY_TIMEOUT,
+    idle_timeout: float = IDLE_TIMEOUT,
+    max_connections: int = 0,
+    **kwargs,
+) -> asyncio.AbstractServer:
+    """Start serving handler on a Unix domain socket at path"""
+    return await asyncio.start_unix_server(
+        _connection_handler(
+            handler,
+            max_body,
+            header_timeout,
+            body_timeout,
+            idle_timeout,
+            max_connections,
+        ),
+        path,
+        limit=MAX_HEADER_BYTES,
+        **kwargs,
+    )
+
+
+def server_port(server: asyncio.AbstractServer) -> int:
+    """Port a server started with port=0 actually bound to"""
+    return server.sockets[0].getsockname()[1]
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for `opencode serve`
+
+Implements the parts of the OpenCode HTTP API the bridge uses, with
+configurable latency, token streaming over /event and error injection:
+
+    python3 mock_opencode.py --port 4096 --latency 2 --tokens 40 --error-rate 0.05
+"""
+
+import json
+import base64
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import logging
+from typing import Dict, List, Optional
+
+from mini_http import Request, Response, json_response, serve, serve_unix, server_port
+
+logger = logging.getLogger(__name__)
+
+DONE_MARKER = "[done]"
+
+
+class MockOpenCode:
+    """In-memory OpenCode server with tunable behaviour"""
+
+    def __init__(
+        self,
+        latency: float = 1.0,
+        jitter: float = 0.0,
+        tokens: int = 20,
+        response_chars: int = 0,
+        error_rate: float = 0.0,
+        api_error_rate: float = 0.0,
+        create_latency: float = 0.0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens = max(1, tokens)
+        self.response_chars = response_chars
+        self.error_rate = error_rate
+        self.api_error_rate = api_error_rate
+        self.create_latency = create_latency
+
+        self.sessions: Dict[str, dict] = {}
+        self._subscribers: List[asyncio.Queue] = []
+        self._aborts: Dict[str, asyncio.Event] = {}
+        self.stats = {
+            "messages": 0,
+            "sessions_created": 0,
+            "inflight": 0,
+            "max_inflight": 0,
+            "files": 0,
+        }
+
+    # Event stream
+
+    def publish(self, event_type: str, properties: dict) -> None:
+        event = {"type": event_type, "properties": properties}
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    async def _event_stream(self):
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        try:
+            yield b'data: {"type":"server.connected","properties":{}}\n\n'
+            while True:
+                event = await queue.get()
+                yield b"data: " + json.dumps(event).encode() + b"\n\n"
+        finally:
+            self._subscribers.remove(queue)
+
+    # Request handling
+
+    async def handle(self, request: Request) -> Response:
+        parts = request.path.strip("/").split("/")
+
+        if parts == ["event"] and request.method == "GET":
+            return Response(self._event_stream(), content_type="text/event-stream")
+
+        if parts == ["session"]:
+            if request.method == "GET":
+                return json_response(list(self.sessions.values()))
+            if request.method == "POST":
+                return await self._create_session(request)
+
+        if len(parts) >= 2 and parts[0] == "session":
+            session = self.sessions.get(parts[1])
+            if session is None:
+                return json_response({"name": "NotFoundError"}, status=404)
+            if len(parts) == 2 and request.method == "GET":
+                return json_response(session)
+            if len(parts) == 2 and request.method == "DELETE":
+                del self.sessions[parts[1]]
+                return json_response(True)
+            if parts[2:] == ["message"] and request.method == "POST":
+                return await self._message(session, request.json() or {})
+            if parts[2:] == ["abort"] and request.method == "POST":
+                abort = self._aborts.get(session["id"])
+                if abort:
+                    abort.set()
+                return json_response(abort is not None)
+
+        return json_response({"name": "NotFoundError"}, status=404)
+
+    async def _create_session(self, request: Request) -> Response:
+        if self.create_latency:
+            await asyncio.sleep(self.create_latency)
+        body = request.json() or {}
+        now = int(time.time() * 1000)
+        session = {
+            "id": "ses_" + uuid.uuid4().hex[:24],
+            "title": body.get("title", "New session"),
+            "time": {"created": now, "updated": now},
+        }
+        self.sessions[session["id"]] = session
+        self.stats["sessions_created"] += 1
+        return json_response(session)
+
+    def _response_text(self, prompt: str) -> List[str]:
+        words = [f"Echo: {prompt[:60]}"] + [f"token{i}" for i in range(self.tokens)]
+        if self.response_chars:
+            filler = "lorem ipsum dolor sit amet " * (self.response_chars // 27 + 1)
+            words.append(filler[: self.response_chars])
+        words.append(DONE_MARKER)
+        return words
+
+    async def _message(self, session: dict, body: dict) -> Response:
+        session_id = session["id"]
+        session["time"]["updated"] = int(time.time() * 1000)
+        self.stats["messages"] += 1
+        if random.random() < self.error_rate:
+            return json_response({"name": "InjectedError"}, status=500)
+
+        words = []
+        for part in body.get("parts", []):
+            if part.get("type") == "text":
+                words.append(part.get("text", ""))
+            elif part.get("type") == "file":
+                # Echo what arrived so tests can check the whole file came through
+                data = base64.b64decode(part["url"].split(",", 1)[1])
+                words.append(f"[file {part.get('filename')} {len(data)} bytes]")
+                self.stats["files"] += 1
+        prompt = " ".join(words)
+        user_id = "msg_" + uuid.uuid4().hex[:24]
+        self.publish(
+            "message.updated",
+            {"info": {"id": user_id, "sessionID": session_id, "role": "user"}},
+        )
+        self.publish(
+            "message.part.updated",
+            {
+                "part": {
+                    "id": "prt_" + uuid.uuid4().hex[:24],
+                    "sessionID": session_id,
+                    "messageID": user_id,
+                    "type": "text",
+                    "text": prompt,
+                }
+            },
+        )
+
+        message_id = "msg_" + uuid.uuid4().hex[:24]
+        part_id = "prt_" + uuid.uuid4().hex[:24]
+        info = {"id": message_id, "sessionID": session_id, "role": "assistant"}
+        self.publish("message.updated", {"info": info})
+
+        abort = asyncio.Event()
+        self._aborts[session_id] = abort
+        self.stats["inflight"] += 1
+        self.stats["max_inflight"] = max(
+            self.stats["max_inflight"], self.stats["inflight"]
+        )
+        try:
+            words = self._response_text(prompt)
+            duration = max(
+                0.0, self.latency + random.uniform(-self.jitter, self.jitter)
+            )
+            step = duration / len(words)
+            text = ""
+            for word in words:
+                try:
+                    await asyncio.wait_for(abort.wait(), timeout=step)
+                    info["error"] = {
+                        "name": "MessageAbortedError",
+                        "data": {"message": "Aborted"},
+                    }
+                    break
+                except asyncio.TimeoutError:
+                    pass
+                delta = (" " if text else "") + word
+                text += delta
+                self.publish(
+                    "message.part.updated",
+                    {
+                        "part": {
+                            "id": part_id,
+                            "sessionID": session_id,
+                            "messageID": message_id,
+                            "type": "text",
+                            "text": text,
+                        },
+                        "delta": delta,
+                    },
+                )
+        finally:
+            self.stats["inflight"] -= 1
+            self._aborts.pop(session_id, None)
+            self.publish("session.idle", {"sessionID": session_id})
+
+        if "error" not in info and random.random() < self.api_error_rate:
+            return json_response(
+                {
+                    "info": info,
+                    "parts": [],
+                    "error": {
+                        "name": "APIError",
+                        "data": {"message": "Injected API error"},
+                    },
+                }
+            )
+        return json_response(
+            {
+                "info": info,
+                "parts": [
+                    {
+                        "id": part_id,
+                        "sessionID": session_id,
+                        "messageID": message_id,
+                        "type": "text",
+                        "text": text,
+                    }
+                ],
+            }
+        )
+
+
+async def start_mock_opencode(
+    host: str = "127.0.0.1", port: int = 0, uds: Optional[str] = None, **options
+):
+    """Start a MockOpenCode server, on a Unix socket if uds is given
+
+    Returns (mock, asyncio server).
+    """
+    mock = MockOpenCode(**options)
+    if uds:
+        server = await serve_unix(mock.handle, uds)
+    else:
+        server = await serve(mock.handle, host, port)
+    return mock, server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenCode server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4096)
+    parser.add_argument("--uds", help="Listen on this Unix socket path instead")
+    parser.add_argument(
+        "--latency", type=float, default=1.0, help="Seconds per agent run"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="± seconds of random latency"
+    )
+    parser.add_argument(
+        "--tokens", type=int, default=20, help="Streamed text parts per answer"
+    )
+    parser.add_argument(
+        "--response-chars",
+        type=int,
+        default=0,
+        help="Extra filler characters per answer",
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Fraction of HTTP 500 responses"
+    )
+    parser.add_argument(
+        "--api-error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of in-body API errors",
+    )
+    parser.add_argument(
+        "--create-latency", type=float, default=0.0, help="Seconds per POST /session"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+
+    async def run():
+        _, server = await start_mock_opencode(
+            args.host,
+            args.port,
+            uds=args.uds,
+            latency=args.latency,
+            jitter=args.jitter,
+            tokens=args.tokens,
+            response_chars=args.response_chars,
+            error_rate=args.error_rate,
+            api_error_rate=args.api_error_rate,
+            create_latency=args.create_latency,
+        )
+        where = args.uds or f"http://{args.host}:{server_port(server)}"
+        print(f"🧪 Mock OpenCode listening on {where}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Fake Telegram Bot API for local load tests
+
+Serves the Bot API methods the bridge calls (getUpdates, sendMessage,
+editMessageText, sendChatAction, sendDocument, getFile, ...) under
+/bot<token>/<method>, and file downloads under /file/bot<token>/<path>.
+Tests inject synthetic user messages with inject_message() or
+inject_document() and observe the bot's outbound calls through on_outbound.
+"""
+
+import json
+import time
+import hashlib
+import asyncio
+import logging
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+from mini_http import Request, Response, json_response, serve
+
+logger = logging.getLogger(__name__)
+
+# Parameters that are always plain strings, never JSON-encoded
+STRING_PARAMS = {"text", "caption", "action", "url", "secret_token", "parse_mode"}
+
+
+def _decode_params(request: Request) -> dict:
+    """Decode PTB's form-encoded, JSON-valued or multipart request parameters"""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + request.body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                params[name] = {
+                    "filename": part.get_filename(),
+                    "size": len(part.get_payload(decode=True) or b""),
+                }
+            else:
+                params[name] = part.get_content()
+        raw = params
+    elif content_type.startswith("application/json"):
+        return request.json() or {}
+    else:
+        # GET parameters come in the query string
+        raw = {**request.query, **dict(parse_qsl(request.body.decode()))}
+
+    params = {}
+    for key, value in raw.items():
+        if isinstance(value, str) and key not in STRING_PARAMS:
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        params[key] = value
+    return params
+
+
+def _unique_id(content: bytes) -> str:
+    return hashlib.sha1(content).hexdigest()[:16]
+
+
+class FakeTelegram:
+    """In-memory Bot API: a queue of pending updates and a log of bot calls"""
+
+    def __init__(self, bot_id: int = 1000):
+        self.bot_id = bot_id
+        self._updates: List[dict] = []
+        self._new_updates = asyncio.Event()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self.calls: Dict[str, int] = {}
+        # Called as on_outbound(method, params, timestamp) for every bot call
+        self.on_outbound: Optional[Callable[[str, dict, float], None]] = None
+        self.webhook_url: Optional[str] = None
+        # Contents of files users sent, by file_id
+        self.files: Dict[str, bytes] = {}
+        self.downloads = 0
+
+    def build_update(self, chat_id: int, user_id: int, text: str) -> dict:
+        update = {
+            "update_id": self._next_update_id,
+            "message": {
+                "message_id": self._next_message_id,
+                "date": int(time.time()),
+                "chat": {
+                    "id": chat_id,
+                    "type": "private",
+                    "first_name": f"User{user_id}",
+                },
+                "from": {
+                    "id": user_id,
+                    "is_bot": False,
+                    "first_name": f"User{user_id}",
+                    "username": f"user{user_id}",
+                },
+                "text": text,
+            },
+        }
+        self._next_update_id += 1
+        self._next_message_id += 1
+        return update
+
+    def inject_message(self, chat_id: int, user_id: int, text: str) -> dict:
+        """Queue a user message for the next getUpdates call"""
+        update = self.build_update(chat_id, user_id, text)
+        self._updates.append(update)
+        self._new_updates.set()
+        return update
+
+    def inject_document(
+        self,
+        chat_id: int,
+        user_id: int,
+        content: bytes,
+        file_name: str = "notes.txt",
+        mime_type: str = "text/plain",
+        caption: Optional[str] = None,
+    ) -> dict:
+        """Queue a user message carrying content as a document
+
+        Like Telegram, the same content always gets the same file_unique_id
+        but a new file_id each time it is sent.
+        """
+        update = self.build_update(chat_id, user_id, "")
+        message = update["message"]
+        del message["text"]
+        file_id = f"file{update['update_id']}"
+        self.files[file_id] = content
+        message["document"] = {
+            "file_id": file_id,
+            "file_unique_id": _unique_id(content),
+            "file_name": file_name,
+            "mime_type": mime_type,
+            "file_size": len(content),
+        }
+        if caption is not None:
+            message["caption"] = caption
+        self._updates.append(update)
+        self._new_updates.set()
+        return update
+
+    def _message(self, chat_id, text: Optional[str] = None) -> dict:
+        message = {
+            "message_id": self._next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": self.bot_id, "is_bot": True, "first_name": "MockBot"},
+        }
+        if text is not None:
+            message["text"] = text
+        self._next_message_id += 1
+        return message
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = params.get("offset") or 0
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        # Telegram forgets updates below the acknowledged offset
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    def _download(self, parts: List[str]) -> Response:
+        content = self.files.get(parts[-1]) if parts[-2:-1] == ["documents"] else None
+        if content is None:
+            return Response(b"Not Found", status=404)
+        self.downloads += 1
+        return Response(content, content_type="application/octet-stream")
+
+    async def handle(self, request: Request) -> Response:
+        parts = request.path.strip("/").split("/")
+        if parts[0] == "file":
+            return self._download(parts)
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            return json_response(
+                {"ok": False, "error_code": 404, "description": "Not Found"}, 404
+            )
+        method = parts[1]
+        params = _decode_params(request)
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "getUpdates":
+            return json_response(
+                {"ok": True, "result": await self._get_updates(params)}
+            )
+
+        if self.on_outbound:
+            self.on_outbound(method, params, time.monotonic())
+
+        if method == "getMe":
+            result = {
+                "id": self.bot_id,
+                "is_bot": True,
+                "first_name": "MockBot",
+                "username": "mock_bot",
+                "can_join_groups": True,
+                "can_read_all_group_messages": False,
+                "supports_inline_queries": False,
+            }
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(params.get("chat_id"), params.get("text", ""))
+            if method == "editMessageText":
+                result["message_id"] = params.get("message_id")
+        elif method == "sendDocument":
+            result = self._message(params.get("chat_id"))
+            document = params.get("document") or {}
+            result["document"] = {
+                "file_id": "doc",
+                "file_unique_id": "doc",
+                "file_name": document.get("filename"),
+            }
+        elif method == "getFile":
+            file_id = params.get("file_id")
+            if file_id not in self.files:
+                return json_response(
+                    {"ok": False, "error_code": 400, "description": "Bad Request"},
+                    400,
+                )
+            result = {
+                "file_id": file_id,
+                "file_unique_id": _unique_id(self.files[file_id]),
+                "file_size": len(self.files[file_id]),
+                "file_path": f"documents/{file_id}",
+            }
+        elif method == "setWebhook":
+            self.webhook_url = params.get("url")
+            result = True
+        else:
+            # sendChatAction, deleteWebhook, setMyCommands, ...
+            result = True
+        return json_response({"ok": True, "result": result})
+
+
+async def start_fake_telegram(host: str = "127.0.0.1", port: int = 0):
+    """Start a FakeTelegram server; returns (fake, asyncio server)"""
+    fake = FakeTelegram()
+    server = await serve(fake.handle, host, port)
+    return fake, server
@@ -0,0 +1,297 @@
+"""
+Outbound Telegram scheduler
+
+Every Bot API call that sends something goes through one scheduler that
+enforces Telegram's global and per-chat rate limits with token buckets,
+waits out 429 retry_after responses, merges duplicate typing actions and
+progress edits, and serves final answers before progress updates.
+"""
+
+import heapq
+import time
+import asyncio
+import itertools
+import contextvars
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from telegram import Bot
+from telegram.error import RetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priorities, lowest value served first
+FINAL = 0
+NORMAL = 1
+PROGRESS = 2
+
+# A typing indicator lasts about 5 seconds on the client
+CHAT_ACTION_TTL = 4.5
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate tokens per second"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = (
+        "priority",
+        "seq",
+        "chat_id",
+        "call",
+        "future",
+        "attempts",
+        "key",
+        "context",
+    )
+
+    def __init__(self, priority, seq, chat_id, call, future, key):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.attempts = 0
+        self.key = key
+        # The submitter's context, so the call logs under its correlation ID
+        self.context = contextvars.copy_context()
+
+    def __lt__(self, other: "_Job") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler:
+    """Rate-limited, prioritized front for the Bot's sending methods"""
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        group_rate: float = 20 / 60,
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._blocked_until: Dict[int, float] = {}
+        self._pending: List[_Job] = []
+        self._coalesced: Dict[Hashable, _Job] = {}
+        self._recent_actions: Dict[Tuple[int, str], float] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for job in self._pending:
+            job.future.cancel()
+        self._pending.clear()
+        self._coalesced.clear()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    # Bot-like API
+
+    async def send_message(
+        self, chat_id: int, text: str, priority: int = FINAL, **kwargs
+    ):
+        return await self.submit(
+            chat_id,
+            lambda: self.bot.send_message(chat_id=chat_id, text=text, **kwargs),
+            priority,
+        )
+
+    async def send_document(self, chat_id: int, priority: int = FINAL, **kwargs):
+        return await self.submit(
+            chat_id, lambda: self.bot.send_document(chat_id=chat_id, **kwargs), priority
+        )
+
+    async def edit_message_text(
+        self,
+        chat_id: int,
+        message_id: int,
+        text: str,
+        priority: int = PROGRESS,
+        **kwargs,
+    ):
+        # A newer progress edit of the same message replaces a queued one
+        key = ("edit", chat_id, message_id) if priority == PROGRESS else None
+        return await self.submit(
+            chat_id,
+            lambda: self.bot.edit_message_text(
+                chat_id=chat_id, message_id=message_id, text=text, **kwargs
+            ),
+            priority,
+            key=key,
+        )
+
+    async def send_chat_action(self, chat_id: int, action: str = "typing"):
+        """Send a chat action unless the same one is queued or still showing"""
+        sent_at = self._recent_actions.get((chat_id, action))
+        if sent_at is not None and time.monotonic() - sent_at < CHAT_ACTION_TTL:
+            metrics.OUTBOUND_MERGED.inc()
+            return True
+        result = await self.submit(
+            chat_id,
+            lambda: self.bot.send_chat_action(chat_id=chat_id, action=action),
+            PROGRESS,
+            key=("action", chat_id, action),
+        )
+        self._recent_actions[(chat_id, action)] = time.monotonic()
+        return result
+
+    # Scheduling
+
+    async def submit(
+        self,
+        chat_id: int,
+        call: Callable[[], Awaitable[Any]],
+        priority: int = NORMAL,
+        key: Optional[Hashable] = None,
+    ):
+        """Queue call for chat_id and wait for its result"""
+        if key is not None and key in self._coalesced:
+            job = self._coalesced[key]
+            job.call = call
+            metrics.OUTBOUND_MERGED.inc()
+            return await asyncio.shield(job.future)
+
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(priority, next(self._seq), chat_id, call, future, key)
+        if key is not None:
+            self._coalesced[key] = job
+        heapq.heappush(self._pending, job)
+        self._wakeup.set()
+        return await asyncio.shield(job.future)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Negative chat IDs are groups and channels, which have a lower limit
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, max(1.0, self.chat_burst))
+        return bucket
+
+    def _pick(self, now: float) -> Tuple[Optional[_Job], Optional[float]]:
+        """Highest-priority job allowed to run now, or how long to wait"""
+        wait = None
+        global_delay = self._global.delay(now)
+        for job in sorted(self._pending):
+            blocked = self._blocked_until.get(job.chat_id, 0.0) - now
+            delay = max(blocked, self._chat_bucket(job.chat_id).delay(now))
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            if global_delay > 0:
+                return None, global_delay
+            return job, None
+        return None, wait
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            job, wait = self._pick(now)
+            if job is not None:
+                self._pending.remove(job)
+                heapq.heapify(self._pending)
+                if job.key is not None:
+                    self._coalesced.pop(job.key, None)
+                self._global.take(now)
+                self._chat_bucket(job.chat_id).take(now)
+                job.context.run(asyncio.create_task, self._execute(job))
+                continue
+
+            self._prune(now)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job: _Job) -> None:
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            retry_after = float(e.retry_after)
+            self._blocked_until[job.chat_id] = time.monotonic() + retry_after
+            job.attempts += 1
+            metrics.RETRIES.inc(kind="telegram_retry_after")
+            if job.attempts > MAX_RETRIES or job.future.done():
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                logger.warning(
+                    "Rate limited in chat %s, retrying in %ss", job.chat_id, retry_after
+                )
+                heapq.heappush(self._pending, job)
+            self._wakeup.set()
+            return
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def _prune(self, now: float) -> None:
+        """Forget idle per-chat state so it does not grow without bound"""
+        if len(self._chats) > 10000:
+            busy = {job.chat_id for job in self._pending}
+            for chat_id in [
+                c for c, b in self._chats.items() if c not in busy and b.full(now)
+            ]:
+                del self._chats[chat_id]
+        if len(self._recent_actions) > 10000:
+            self._recent_actions = {
+                k: t
+                for k, t in self._recent_actions.items()
+                if now - t < CHAT_ACTION_TTL
+            }
+        for chat_id in [c for c, t in self._blocked_until.items() if t <= now]:
+            del self._blocked_until[chat_id]
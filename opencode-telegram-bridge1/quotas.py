@@ -0,0 +1,121 @@
+"""
+Per-user and per-chat prompt quotas
+
+Each user, and each group chat, gets a token bucket of prompts per minute;
+a prompt that finds its bucket empty is refused with the time to wait. The
+limits, the number of OpenCode runs a user may have in flight and the
+user's weight in fair queuing can be overridden per user ID from a JSON
+file:
+
+    {"123456789": {"prompts_per_minute": 60, "max_concurrent": 4, "weight": 2}}
+"""
+
+import json
+import time
+import logging
+from typing import Dict, Optional, Tuple
+
+import metrics
+from outbound import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class Limits:
+    """One user's quota: 0 means unlimited"""
+
+    __slots__ = ("prompts_per_minute", "max_concurrent", "weight")
+
+    def __init__(
+        self,
+        prompts_per_minute: float = 0,
+        max_concurrent: int = 0,
+        weight: float = 1.0,
+    ):
+        self.prompts_per_minute = prompts_per_minute
+        self.max_concurrent = max_concurrent
+        self.weight = weight
+
+
+def load_user_limits(path: Optional[str], default: Limits) -> Dict[int, Limits]:
+    """Per-user overrides from a JSON file, falling back to default per field"""
+    if not path:
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    overrides = {}
+    for user_id, fields in data.items():
+        overrides[int(user_id)] = Limits(
+            prompts_per_minute=float(
+                fields.get("prompts_per_minute", default.prompts_per_minute)
+            ),
+            max_concurrent=int(fields.get("max_concurrent", default.max_concurrent)),
+            weight=float(fields.get("weight", default.weight)),
+        )
+    logger.info("Loaded limits for %s users from %s", len(overrides), path)
+    return overrides
+
+
+class Quotas:
+    """Token-bucket prompt quotas per user and per group chat"""
+
+    def __init__(
+        self,
+        default: Limits,
+        chat_prompts_per_minute: float = 0,
+        burst: int = 5,
+        overrides: Optional[Dict[int, Limits]] = None,
+    ):
+        self.default = default
+        self.chat_prompts_per_minute = chat_prompts_per_minute
+        self.burst = burst
+        self.overrides = overrides or {}
+        self._users: Dict[int, TokenBucket] = {}
+        self._chats: Dict[int, TokenBucket] = {}
+
+    def limits(self, user_id: int) -> Limits:
+        return self.overrides.get(user_id, self.default)
+
+    def admit(self, user_id: int, chat_id: int) -> Tuple[Optional[str], float]:
+        """Take a prompt from the user's and chat's buckets
+
+        Returns (None, 0) if admitted, else the scope that refused it
+        ("user" or "chat") and the seconds until it would be admitted.
+        """
+        now = time.monotonic()
+        buckets = []
+        rate = self.limits(user_id).prompts_per_minute
+        if rate > 0:
+            buckets.append(("user", self._bucket(self._users, user_id, rate)))
+        # In a private chat the chat is the user, so only groups get their own
+        if chat_id != user_id and self.chat_prompts_per_minute > 0:
+            buckets.append(
+                (
+                    "chat",
+                    self._bucket(self._chats, chat_id, self.chat_prompts_per_minute),
+                )
+            )
+        for scope, bucket in buckets:
+            delay = bucket.delay(now)
+            if delay > 0:
+                metrics.QUOTA_REJECTIONS.inc(scope=scope)
+                return scope, delay
+        for _, bucket in buckets:
+            bucket.take(now)
+        self._prune(now)
+        return None, 0.0
+
+    def _bucket(
+        self, buckets: Dict[int, TokenBucket], key: int, per_minute: float
+    ) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(per_minute / 60, max(1, self.burst))
+        return bucket
+
+    def _prune(self, now: float) -> None:
+        """Forget full buckets so idle users do not accumulate"""
+        for buckets in (self._users, self._chats):
+            if len(buckets) > 10000:
+                for key in [k for k, b in buckets.items() if b.full(now)]:
+                    del buckets[key]
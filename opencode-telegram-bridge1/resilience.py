@@ -0,0 +1,254 @@
+"""
+Load shedding in front of OpenCode
+
+AdaptiveLimiter caps in-flight OpenCode requests with an AIMD limit: the
+cap creeps up while requests complete at their usual speed and is cut back
+when they fail or take much longer than the long-run average. Requests over
+the cap wait in a bounded, weighted fair queue and are shed when it is full
+or too slow.
+
+CircuitBreaker stops sending to a backend after repeated failures, failing
+fast instead, and lets a single probe request through every reset_timeout
+seconds until one succeeds.
+"""
+
+import time
+import asyncio
+import itertools
+import logging
+from collections import Counter
+from typing import Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Too many requests queued for OpenCode; shed instead of waiting"""
+
+
+class CircuitOpen(Exception):
+    """OpenCode has been failing; fail fast until a probe succeeds"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"circuit open, next probe in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class _Waiter:
+    __slots__ = ("flow", "tag", "seq", "max_inflight", "future")
+
+    def __init__(self, flow, tag, seq, max_inflight, future):
+        self.flow = flow
+        self.tag = tag
+        self.seq = seq
+        self.max_inflight = max_inflight
+        self.future = future
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with a weighted fair queue for waiting requests
+
+    Requests belong to flows (users). Waiting requests are served in order
+    of virtual finish time, which for each flow advances by 1/weight per
+    request, so a flow with many requests queued does not hold up the rest.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        backoff: float = 0.75,
+        tolerance: float = 2.0,
+        max_queue: int = 100,
+        queue_timeout: float = 60.0,
+    ):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.limit = float(max_limit)
+        self.inflight = 0
+        # Long-run average latency that "much slower" is measured against
+        self.baseline = 0.0
+        self._last_decrease = 0.0
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        # Fair queuing state: slots held and last finish tag per flow
+        self._flow_inflight: Dict[Hashable, int] = {}
+        self._flow_finish: Dict[Hashable, float] = {}
+        self._virtual = 0.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(
+        self, flow: Hashable = None, weight: float = 1.0, max_inflight: int = 0
+    ) -> None:
+        """Take a slot for flow, waiting in the queue; raise Overloaded if shed
+
+        max_inflight caps the slots flow may hold at once (0 = no cap).
+        """
+        if (
+            self.inflight < int(self.limit)
+            and not self._waiters
+            and self._under_cap(flow, max_inflight)
+        ):
+            self._grant(flow)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._shed_for(flow)
+
+        tag = max(self._virtual, self._flow_finish.get(flow, 0.0)) + 1 / weight
+        self._flow_finish[flow] = tag
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(flow, tag, next(self._seq), max_inflight, future)
+        self._waiters.append(waiter)
+        # Other waiters may be held back only by their own flow's cap
+        self._wake()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled() and not future.exception():
+                # Granted a slot just as we gave up; hand it on
+                self._free(flow)
+                self._wake()
+            if isinstance(e, asyncio.TimeoutError):
+                raise Overloaded(f"queued for over {self.queue_timeout}s") from e
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(
+        self,
+        latency: Optional[float] = None,
+        failed: bool = False,
+        flow: Hashable = None,
+    ) -> None:
+        """Return flow's slot, feeding the outcome back into the limit"""
+        at_limit = self.inflight >= int(self.limit)
+        self._free(flow)
+        if failed or (
+            latency is not None
+            and self.baseline
+            and latency > self.baseline * self.tolerance
+        ):
+            self._decrease()
+        elif latency is not None:
+            # Only grow while the limit is actually what holds requests back
+            if at_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.baseline = (
+                latency if not self.baseline else self.baseline * 0.95 + latency * 0.05
+            )
+        self._wake()
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        # Requests in flight together report one congestion event, not many
+        if now - self._last_decrease < max(self.baseline, 1.0):
+            return
+        self._last_decrease = now
+        limit = max(self.min_limit, self.limit * self.backoff)
+        if int(limit) < int(self.limit):
+            logger.warning("OpenCode concurrency limit lowered to %s", int(limit))
+        self.limit = limit
+
+    def _under_cap(self, flow: Hashable, max_inflight: int) -> bool:
+        return max_inflight <= 0 or self._flow_inflight.get(flow, 0) < max_inflight
+
+    def _grant(self, flow: Hashable) -> None:
+        self.inflight += 1
+        self._flow_inflight[flow] = self._flow_inflight.get(flow, 0) + 1
+
+    def _free(self, flow: Hashable) -> None:
+        self.inflight -= 1
+        held = self._flow_inflight.get(flow, 0) - 1
+        if held > 0:
+            self._flow_inflight[flow] = held
+            return
+        self._flow_inflight.pop(flow, None)
+        if not any(w.flow == flow for w in self._waiters):
+            self._flow_finish.pop(flow, None)
+
+    def _shed_for(self, flow: Hashable) -> None:
+        """Make room in a full queue by dropping the busiest flow's newest request
+
+        Raises Overloaded instead if flow itself would be the busiest.
+        """
+        counts = Counter(w.flow for w in self._waiters)
+        busiest, count = counts.most_common(1)[0]
+        if counts.get(flow, 0) + 1 >= count:
+            raise Overloaded(f"{len(self._waiters)} requests already queued")
+        victim = max(
+            (w for w in self._waiters if w.flow == busiest), key=lambda w: w.tag
+        )
+        self._waiters.remove(victim)
+        if not victim.future.done():
+            victim.future.set_exception(
+                Overloaded("dropped from a full queue for a less busy user")
+            )
+
+    def _wake(self) -> None:
+        while self._waiters and self.inflight < int(self.limit):
+            eligible = [
+                w for w in self._waiters if self._under_cap(w.flow, w.max_inflight)
+            ]
+            if not eligible:
+                return
+            waiter = min(eligible, key=lambda w: (w.tag, w.seq))
+            self._waiters.remove(waiter)
+            if waiter.future.done():
+                continue
+            self._virtual = waiter.tag
+            self._grant(waiter.flow)
+            waiter.future.set_result(None)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with half-open probing"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._retry_at = 0.0
+
+    def check(self) -> None:
+        """Raise CircuitOpen unless a request may go through now"""
+        if self.state == self.CLOSED:
+            return
+        now = time.monotonic()
+        if now < self._retry_at:
+            raise CircuitOpen(self._retry_at - now)
+        # Let one request through to probe; the rest keep failing fast
+        self.state = self.HALF_OPEN
+        self._retry_at = now + self.reset_timeout
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info("Circuit for %s closed", self.name)
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (
+            self.state == self.CLOSED and self.failures >= self.failure_threshold
+        ):
+            logger.warning(
+                "Circuit for %s opened after %s failures", self.name, self.failures
+            )
+            self.state = self.OPEN
+            self._retry_at = time.monotonic() + self.reset_timeout
@@ -0,0 +1,91 @@
+"""
+Cache of OpenCode answers to stock prompts
+
+Only prompts matching an opt-in pattern are cached. Keys combine the
+normalized prompt with the model and, when answers depend on the
+conversation so far, the session. Entries expire after a TTL and the least
+recently used are evicted to keep the total answer size under a byte bound.
+"""
+
+import re
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    return _WHITESPACE.sub(" ", text).strip().rstrip(".!? ").lower()
+
+
+class ResponseCache:
+    """Byte-bounded LRU of answers with a TTL
+
+    pattern is a regex that the whole normalized prompt must match for its
+    answer to be cached. scope is "global" to share answers between users or
+    "session" to reuse them only within the session that produced them.
+    """
+
+    def __init__(
+        self,
+        pattern: str,
+        max_bytes: int = 8 * 1024 * 1024,
+        ttl: float = 3600,
+        scope: str = "global",
+    ):
+        self.pattern = re.compile(pattern)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.scope = scope
+        self.size = 0
+        # key -> (answer, bytes, expires_at, seconds it took), LRU first
+        self._entries: "OrderedDict[str, Tuple[str, int, float, float]]" = OrderedDict()
+
+    def key(self, prompt: str, model: str, session_id: str) -> Optional[str]:
+        """Cache key for a prompt, or None if it is not cacheable"""
+        normalized = normalize_prompt(prompt)
+        if not self.pattern.fullmatch(normalized):
+            return None
+        scope = session_id if self.scope == "session" else ""
+        raw = "\0".join((model, scope, normalized)).encode()
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] < time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            metrics.RESPONSE_CACHE_REQUESTS.inc(result="miss")
+            return None
+        self._entries.move_to_end(key)
+        metrics.RESPONSE_CACHE_REQUESTS.inc(result="hit")
+        metrics.RESPONSE_CACHE_SAVED_SECONDS.inc(entry[3])
+        return entry[0]
+
+    def put(self, key: str, answer: str, elapsed: float) -> None:
+        """Store answer, which took elapsed seconds to produce"""
+        size = len(answer.encode())
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (answer, size, time.monotonic() + self.ttl, elapsed)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        _, size, _, _ = self._entries.pop(key)
+        self.size -= size
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -16,9 +16,15 @@ fi
 echo "2. Waiting for cleanup..."
 sleep 5
 
-echo "3. Cleaning local processes..."
+echo "3. Stopping local processes..."
+# SIGTERM lets the bot finish in-flight messages and save its update offset
+pkill -TERM -f "python3.*bot.py" 2>/dev/null
+for i in $(seq 1 ${DRAIN_TIMEOUT:-30}); do
+    pgrep -f "python3.*bot.py" > /dev/null || break
+    sleep 1
+done
 pkill -9 -f "python3.*bot.py" 2>/dev/null
-sleep 2
+sleep 1
 
 echo "✅ Cleanup complete!"
 echo ""
@@ -0,0 +1,77 @@
+"""
+Session creation helpers
+
+SingleFlight collapses concurrent calls for the same key into one in-progress
+call. SessionPool keeps a few idle OpenCode sessions pre-created so that new
+users and /reset do not wait on a POST /session round-trip.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share its result"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # Shield so one cancelled caller does not cancel the shared call
+        return await asyncio.shield(task)
+
+
+class SessionPool:
+    """Pool of pre-created idle OpenCode sessions, refilled in the background"""
+
+    def __init__(self, create: Callable[[], Awaitable[str]], size: int):
+        self._create = create
+        self.size = size
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._wanted = asyncio.Event()
+        self._refill_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.size > 0 and self._refill_task is None:
+            self._refill_task = asyncio.create_task(self._refill())
+            self._wanted.set()
+
+    async def stop(self) -> None:
+        if self._refill_task:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
+
+    async def acquire(self) -> str:
+        """Take an idle session, or create one directly if the pool is empty"""
+        try:
+            session_id = self._idle.get_nowait()
+        except asyncio.QueueEmpty:
+            session_id = None
+        if self._refill_task is not None:
+            self._wanted.set()
+        if session_id is not None:
+            return session_id
+        return await self._create()
+
+    async def _refill(self) -> None:
+        while True:
+            await self._wanted.wait()
+            self._wanted.clear()
+            while self._idle.qsize() < self.size:
+                try:
+                    self._idle.put_nowait(await self._create())
+                except Exception as e:
+                    logger.warning("Failed to pre-create session: %s", e)
+                    await asyncio.sleep(5)
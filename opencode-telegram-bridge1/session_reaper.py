@@ -0,0 +1,136 @@
+"""
+Deletion of OpenCode sessions the bridge has let go of
+
+A session leaves the session store when its user sends /reset, when it has
+been idle for SESSION_TTL, when the store is full or when its user moves to
+another backend. OpenCode would otherwise keep every such session forever,
+so they are queued here and deleted with DELETE /session/{id} in small,
+paced batches. At startup a reconcile pass lists each backend's sessions
+and queues the bridge's own ones that no user is mapped to and that have
+not been used for a while, such as those released just before a restart.
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Iterable, Optional, Set
+
+import httpx
+
+import metrics
+from backends import BackendPool
+
+logger = logging.getLogger(__name__)
+
+
+class SessionReaper:
+    """Paced background deletion of released OpenCode sessions
+
+    Every interval seconds at most batch_size queued sessions are deleted,
+    concurrently, so a large backlog never floods a backend.
+    """
+
+    def __init__(
+        self,
+        backends: BackendPool,
+        batch_size: int = 20,
+        interval: float = 5.0,
+        timeout: float = 10.0,
+    ):
+        self.backends = backends
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        # Session store values (session IDs, pinned to a backend if several)
+        self._released: Deque[str] = deque()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._released)
+
+    def release(self, value: str) -> None:
+        """Queue the session behind a session store value for deletion"""
+        self._released.append(value)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._released:
+            # Picked up by the reconcile pass of a later start
+            logger.info("%s released sessions left for later", len(self._released))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            batch = [
+                self._released.popleft()
+                for _ in range(min(self.batch_size, len(self._released)))
+            ]
+            if batch:
+                results = await asyncio.gather(
+                    *(self._delete(value) for value in batch)
+                )
+                logger.info(
+                    "Deleted %s of %s released sessions, %s still queued",
+                    sum(results),
+                    len(batch),
+                    len(self._released),
+                )
+
+    async def _delete(self, value: str) -> bool:
+        backend, session_id = self.backends.resolve(value)
+        if backend is None:
+            return False
+        try:
+            response = await backend.client.delete(
+                f"/session/{session_id}", timeout=self.timeout
+            )
+            # Already gone is as good as deleted
+            if response.status_code != 404:
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            metrics.ERRORS.inc(kind="session_delete")
+            logger.warning("Failed to delete session %s: %s", session_id, e)
+            return False
+        metrics.SESSIONS_REAPED.inc()
+        return True
+
+    async def reconcile(
+        self, referenced: Iterable[str], title: str, min_idle: float
+    ) -> int:
+        """Queue unreferenced sessions titled title idle for min_idle seconds
+
+        referenced are the session IDs still in use. The idle time guards
+        sessions created or used since the caller took that snapshot, and
+        those of other processes sharing the backend. Returns the number
+        queued.
+        """
+        keep: Set[str] = set(referenced)
+        cutoff = (time.time() - min_idle) * 1000
+        found = 0
+        for backend in self.backends:
+            try:
+                response = await backend.client.get("/session", timeout=self.timeout)
+                response.raise_for_status()
+                sessions = response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning("Could not list sessions on %s: %s", backend.url, e)
+                continue
+            for session in sessions:
+                updated = (session.get("time") or {}).get("updated") or 0
+                if (
+                    session.get("title") == title
+                    and session.get("id") not in keep
+                    and updated < cutoff
+                ):
+                    self.release(self.backends.pin(session["id"], backend))
+                    found += 1
+        if found:
+            logger.info("Found %s orphaned sessions to delete", found)
+        return found
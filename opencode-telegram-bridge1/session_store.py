@@ -0,0 +1,276 @@
+"""
+Session stores mapping Telegram user IDs to OpenCode session IDs
+
+MemorySessionStore is a bounded LRU with idle-time expiry. SqliteSessionStore
+keeps the same in-memory index for lookups but persists it to a local SQLite
+database so sessions survive restarts. Both report every session they let
+go of, whether deleted, expired or evicted, to an optional on_remove
+callback.
+"""
+
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """Interface for user_id -> session_id storage"""
+
+    def get(self, user_id: int) -> Optional[str]:
+        """Return the user's session and mark it as used, or None"""
+        raise NotImplementedError
+
+    def set(self, user_id: int, session_id: str) -> None:
+        raise NotImplementedError
+
+    def delete(self, user_id: int) -> Optional[str]:
+        """Remove the user's session and return it, if any"""
+        raise NotImplementedError
+
+    def items(self) -> Iterator[Tuple[int, str, float]]:
+        """Iterate over (user_id, session_id, last_used)"""
+        raise NotImplementedError
+
+    def evict_idle(self) -> List[Tuple[int, str]]:
+        """Drop expired sessions and return the (user_id, session_id) pairs removed"""
+        return []
+
+    def values(self) -> List[str]:
+        """Every stored session, including other processes' in a shared store"""
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Persist buffered changes, if the backend buffers any"""
+
+    def close(self) -> None:
+        self.flush()
+
+    def __contains__(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """In-memory LRU store with optional idle TTL
+
+    max_entries bounds the number of users kept (0 = unbounded); ttl is the
+    idle time in seconds after which a session is dropped (0 = never).
+    on_remove(user_id, session_id) is called for every session removed.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        ttl: float = 0,
+        on_remove: Optional[Callable[[int, str], None]] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_remove = on_remove
+        # user_id -> (session_id, last_used), least recently used first
+        self._entries: "OrderedDict[int, Tuple[str, float]]" = OrderedDict()
+
+    def _expired(self, last_used: float, now: float) -> bool:
+        return self.ttl > 0 and now - last_used > self.ttl
+
+    def get(self, user_id: int) -> Optional[str]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        now = time.time()
+        if self._expired(entry[1], now):
+            self._remove(user_id)
+            return None
+        self._entries[user_id] = (entry[0], now)
+        self._entries.move_to_end(user_id)
+        self._touched(user_id, now)
+        return entry[0]
+
+    def set(self, user_id: int, session_id: str) -> None:
+        now = time.time()
+        previous = self._entries.get(user_id)
+        if previous is not None and previous[0] != session_id and self.on_remove:
+            self.on_remove(user_id, previous[0])
+        self._entries[user_id] = (session_id, now)
+        self._entries.move_to_end(user_id)
+        self._stored(user_id, session_id, now)
+        if self.max_entries and len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            logger.info("Session store full, evicting user %s", oldest)
+            self._remove(oldest)
+
+    def delete(self, user_id: int) -> Optional[str]:
+        if user_id not in self._entries:
+            return None
+        return self._remove(user_id)
+
+    def items(self) -> Iterator[Tuple[int, str, float]]:
+        for user_id, (session_id, last_used) in list(self._entries.items()):
+            yield user_id, session_id, last_used
+
+    def values(self) -> List[str]:
+        return [session_id for session_id, _ in self._entries.values()]
+
+    def evict_idle(self) -> List[Tuple[int, str]]:
+        if self.ttl <= 0:
+            return []
+        now = time.time()
+        evicted = []
+        # Entries are in LRU order, so stop at the first one still fresh
+        for user_id, (session_id, last_used) in list(self._entries.items()):
+            if not self._expired(last_used, now):
+                break
+            self._remove(user_id)
+            evicted.append((user_id, session_id))
+        return evicted
+
+    def _remove(self, user_id: int) -> str:
+        session_id, _ = self._entries.pop(user_id)
+        self._removed(user_id)
+        if self.on_remove:
+            self.on_remove(user_id, session_id)
+        return session_id
+
+    # Persistence hooks for subclasses
+    def _touched(self, user_id: int, last_used: float) -> None:
+        pass
+
+    def _stored(self, user_id: int, session_id: str, last_used: float) -> None:
+        pass
+
+    def _removed(self, user_id: int) -> None:
+        pass
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SqliteSessionStore(MemorySessionStore):
+    """MemorySessionStore backed by a SQLite file, loaded at startup
+
+    Inserts and deletes are written through immediately. Last-used updates
+    only mark the entry dirty and are written in one batch by flush(), so
+    lookups never touch the disk.
+
+    Several processes can share one database when each is given an owns
+    predicate selecting a disjoint set of users; only those rows are loaded,
+    evicted or deleted by that process.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 10000,
+        ttl: float = 0,
+        owns: Optional[Callable[[int], bool]] = None,
+        on_remove: Optional[Callable[[int, str], None]] = None,
+    ):
+        super().__init__(max_entries=max_entries, ttl=ttl, on_remove=on_remove)
+        self.path = path
+        self.owns = owns
+        self._dirty: Dict[int, float] = {}
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "user_id INTEGER PRIMARY KEY, session_id TEXT NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        self._load()
+
+    def _load(self) -> None:
+        rows = self._db.execute(
+            "SELECT user_id, session_id, last_used FROM sessions ORDER BY last_used"
+        ).fetchall()
+        for user_id, session_id, last_used in rows:
+            if self.owns is None or self.owns(user_id):
+                self._entries[user_id] = (session_id, last_used)
+        logger.info("Loaded %s sessions from %s", len(self._entries), self.path)
+        expired = self.evict_idle()
+        if expired:
+            logger.info("Dropped %s idle sessions at startup", len(expired))
+        while self.max_entries and len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _touched(self, user_id: int, last_used: float) -> None:
+        self._dirty[user_id] = last_used
+
+    def _stored(self, user_id: int, session_id: str, last_used: float) -> None:
+        self._dirty.pop(user_id, None)
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (user_id, session_id, last_used),
+            )
+
+    def _removed(self, user_id: int) -> None:
+        self._dirty.pop(user_id, None)
+        with self._db:
+            self._db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def values(self) -> List[str]:
+        # Rows are written through, so the table has every process's sessions
+        return [row[0] for row in self._db.execute("SELECT session_id FROM sessions")]
+
+    def flush(self) -> None:
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        with self._db:
+            self._db.executemany(
+                "UPDATE sessions SET last_used = ? WHERE user_id = ?",
+                [(last_used, user_id) for user_id, last_used in dirty.items()],
+            )
+
+    def close(self) -> None:
+        self.flush()
+        self._db.close()
+
+
+def create_session_store(
+    owns: Optional[Callable[[int], bool]] = None,
+    on_remove: Optional[Callable[[int, str], None]] = None,
+) -> SessionStore:
+    """Build the session store selected by the SESSION_STORE environment variable
+
+    owns restricts a shared SQLite store to the users this process serves;
+    on_remove is called with each session the store lets go of.
+    """
+    backend = os.getenv("SESSION_STORE", "sqlite").lower()
+    max_entries = int(os.getenv("SESSION_MAX_ENTRIES", 10000))
+    # Idle seconds before a session is forgotten (0 = keep forever)
+    ttl = float(os.getenv("SESSION_TTL", 7 * 24 * 3600))
+
+    if backend == "memory":
+        return MemorySessionStore(max_entries=max_entries, ttl=ttl, on_remove=on_remove)
+    if backend == "sqlite":
+        path = os.getenv("SESSION_DB_PATH", "sessions.db")
+        return SqliteSessionStore(
+            path, max_entries=max_entries, ttl=ttl, owns=owns, on_remove=on_remove
+        )
+    raise ValueError(f"Unknown SESSION_STORE backend: {backend}")
+
+
+async def maintain_sessions(store: SessionStore, interval: float = 60.0) -> None:
+    """Periodically evict idle sessions and persist buffered last-used times"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            evicted = store.evict_idle()
+            if evicted:
+                logger.info("Evicted %s idle sessions", len(evicted))
+            store.flush()
+        except Exception as e:
+            logger.error("Session store maintenance failed: %s", e)
@@ -0,0 +1,245 @@
+"""
+Multi-process sharding
+
+With WORKERS > 1 the front process (polling or webhook) only receives
+updates and forwards each one, by consistent hash of its user ID, to one of
+N worker processes that each run their own BridgeEngine. Front and worker
+talk over a Unix socket: one update JSON per line in, {"done": update_id}
+lines back, so the front still tracks offsets and can drain on shutdown.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+import metrics
+from engine import (
+    DRAIN_TIMEOUT,
+    FILE_CACHE_DIR,
+    METRICS_PORT,
+    TELEGRAM_GLOBAL_RATE,
+    BridgeEngine,
+    build_telegram_bot,
+)
+from hash_ring import HashRing
+from updates import MessageUpdate, dumps
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes (1 = handle everything in this process)
+WORKERS = int(os.getenv("WORKERS", 1))
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+WORKER_START_TIMEOUT = 30
+# Longest line accepted on the worker socket
+FRAME_LIMIT = 16 * 1024 * 1024
+
+
+def shard_key(update: MessageUpdate) -> int:
+    """Sharding key for an update: its user"""
+    return update.user_id
+
+
+class WorkerProcess:
+    """One worker subprocess and the socket connection to it"""
+
+    def __init__(
+        self,
+        index: int,
+        count: int,
+        socket_path: str,
+        on_done: Callable[[MessageUpdate], None],
+    ):
+        self.index = index
+        self.count = count
+        self.socket_path = socket_path
+        self.on_done = on_done
+        # Updates sent to the worker and not yet reported done
+        self.pending: Dict[int, MessageUpdate] = {}
+        # Frames queued while the worker is (re)starting
+        self._backlog: List[bytes] = []
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def _env(self) -> dict:
+        env = dict(os.environ)
+        env.update(
+            WORKERS=str(self.count),
+            WORKER_INDEX=str(self.index),
+            WORKER_SOCKET=self.socket_path,
+            # The global Telegram limit is per bot token, so workers split it
+            TELEGRAM_GLOBAL_RATE=str(TELEGRAM_GLOBAL_RATE / self.count),
+            # Each worker indexes and evicts its own file cache
+            FILE_CACHE_DIR=os.path.join(FILE_CACHE_DIR, f"worker-{self.index}"),
+        )
+        if METRICS_PORT:
+            env["METRICS_PORT"] = str(METRICS_PORT + 1 + self.index)
+        return env
+
+    async def start(self) -> None:
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        # Own session, so a terminal Ctrl-C only reaches the front process
+        self._process = await asyncio.create_subprocess_exec(
+            sys.executable, WORKER_SCRIPT, env=self._env(), start_new_session=True
+        )
+        reader, self._writer = await self._connect()
+        self._reader_task = asyncio.create_task(self._read(reader))
+        for frame in self._backlog:
+            self._writer.write(frame)
+        self._backlog.clear()
+        self._watch_task = asyncio.create_task(self._watch())
+        logger.info("Worker %s started (pid %s)", self.index, self._process.pid)
+
+    async def _connect(self):
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while True:
+            try:
+                return await asyncio.open_unix_connection(
+                    self.socket_path, limit=FRAME_LIMIT
+                )
+            except OSError:
+                if self._process.returncode is not None:
+                    raise RuntimeError(
+                        f"Worker {self.index} exited with code "
+                        f"{self._process.returncode}"
+                    )
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Worker {self.index} did not start")
+                await asyncio.sleep(0.1)
+
+    def send(self, update: MessageUpdate) -> None:
+        frame = dumps(update.to_dict()) + b"\n"
+        self.pending[update.update_id] = update
+        if self._writer is None:
+            self._backlog.append(frame)
+        else:
+            self._writer.write(frame)
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        async for line in reader:
+            update = self.pending.pop(json.loads(line)["done"], None)
+            if update is not None:
+                self.on_done(update)
+
+    async def _watch(self) -> None:
+        """Restart the worker if it exits while the bridge is running"""
+        returncode = await self._process.wait()
+        if self._stopping:
+            return
+        metrics.ERRORS.inc(kind="worker_exit")
+        self._writer = None
+        # What the worker had in hand may have been partly handled; drop it
+        lost = list(self.pending.values())
+        self.pending.clear()
+        for update in lost:
+            self.on_done(update)
+        logger.error(
+            "Worker %s exited with code %s, dropped %s updates, restarting",
+            self.index,
+            returncode,
+            len(lost),
+        )
+        while not self._stopping:
+            await asyncio.sleep(1)
+            try:
+                await self.start()
+                return
+            except Exception as e:
+                logger.error("Failed to restart worker %s: %s", self.index, e)
+
+    async def drain(self) -> None:
+        """Close our side of the socket and wait for the worker to finish"""
+        self._stopping = True
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write_eof()
+        if self._process is not None:
+            await self._process.wait()
+        if self._reader_task is not None:
+            await self._reader_task
+
+    async def kill(self) -> None:
+        self._stopping = True
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+        if self._process is not None and self._process.returncode is None:
+            logger.warning("Killing worker %s", self.index)
+            self._process.kill()
+            await self._process.wait()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class ShardedBridge:
+    """Front for worker processes; same interface as BridgeEngine"""
+
+    def __init__(
+        self, workers: int, on_done: Optional[Callable[[MessageUpdate], None]] = None
+    ):
+        self.on_done = on_done
+        # Receives updates only; each worker has its own Bot for replies
+        self.bot = build_telegram_bot()
+        self.ring = HashRing(range(workers))
+        self._socket_dir = tempfile.mkdtemp(prefix="opencode-bridge-")
+        self.workers = [
+            WorkerProcess(
+                index,
+                workers,
+                os.path.join(self._socket_dir, f"worker-{index}.sock"),
+                self._done,
+            )
+            for index in range(workers)
+        ]
+        self._metrics_server = None
+
+    def _done(self, update: MessageUpdate) -> None:
+        if self.on_done:
+            self.on_done(update)
+
+    async def start(self) -> None:
+        await self.bot.initialize()
+        await asyncio.gather(*(worker.start() for worker in self.workers))
+        metrics.WORKER_PENDING.set_function(
+            lambda: {(str(w.index),): len(w.pending) for w in self.workers}
+        )
+        if METRICS_PORT:
+            self._metrics_server = await metrics.start_metrics_server(METRICS_PORT)
+
+    def dispatch(self, update: MessageUpdate) -> None:
+        """Forward an update to the worker that owns its user"""
+        self.workers[self.ring.node_for(shard_key(update))].send(update)
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT) -> None:
+        """Let workers finish what they were sent; they drain with the same timeout"""
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(worker.drain() for worker in self.workers)),
+                timeout=timeout + 5,
+            )
+        except asyncio.TimeoutError:
+            pending = sum(len(worker.pending) for worker in self.workers)
+            logger.warning("Workers did not drain in time, abandoning %s", pending)
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            await worker.kill()
+        await self.bot.shutdown()
+        if self._metrics_server:
+            self._metrics_server.close()
+        shutil.rmtree(self._socket_dir, ignore_errors=True)
+
+
+def create_bridge(on_done: Optional[Callable[[MessageUpdate], None]] = None):
+    """BridgeEngine in this process, or a ShardedBridge when WORKERS > 1"""
+    if WORKERS > 1:
+        logger.info("Sharding users over %s worker processes", WORKERS)
+        return ShardedBridge(WORKERS, on_done)
+    return BridgeEngine(on_done)
@@ -0,0 +1,264 @@
+"""
+Streaming OpenCode responses into Telegram
+
+Keeps one subscription to each OpenCode server's server-sent event stream,
+assembles the assistant's text parts for one session from it and mirrors
+them into a Telegram message through throttled editMessageText calls.
+"""
+
+import json
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional, Set
+
+import httpx
+from telegram.error import BadRequest, RetryAfter
+
+import metrics
+from outbound import FINAL, NORMAL, PROGRESS, OutboundScheduler
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects message text above 4096 characters
+MAX_EDIT_LENGTH = 4000
+PLACEHOLDER_TEXT = "⏳ Working on it..."
+
+
+def _event_session_id(event: dict) -> Optional[str]:
+    """Return the session an OpenCode event belongs to, if any"""
+    props = event.get("properties") or {}
+    if "sessionID" in props:
+        return props["sessionID"]
+    for key in ("part", "info"):
+        inner = props.get(key)
+        if isinstance(inner, dict) and "sessionID" in inner:
+            return inner["sessionID"]
+    return None
+
+
+class SessionEventStream:
+    """One /event subscription to a backend, shared by every streamed reply
+
+    Each event is parsed once and handed to the replies subscribed to its
+    session, so the cost stays flat as replies are added and a reply waiting
+    for an OpenCode slot holds no connection. The stream reconnects if it
+    drops; replies meanwhile miss partial output but still get the final
+    answer from the message request.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        reconnect_delay: float = 1.0,
+        max_reconnect_delay: float = 30.0,
+    ):
+        self.client = client
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connected = False
+        # session_id -> queues of the replies streaming it
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    @contextmanager
+    def subscribe(self, session_id: str) -> Iterator[AsyncIterator[dict]]:
+        """Yield an iterator of session_id's events until the block exits
+
+        Events are queued from the moment of the call, so a prompt sent
+        inside the block cannot outrun its own events.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(session_id, set()).add(queue)
+
+        async def events():
+            while True:
+                yield await queue.get()
+
+        try:
+            yield events()
+        finally:
+            queues = self._subscribers.get(session_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[session_id]
+
+    async def _run(self) -> None:
+        delay = self.reconnect_delay
+        while True:
+            try:
+                async with self.client.stream(
+                    "GET", "/event", timeout=httpx.Timeout(10.0, read=None)
+                ) as response:
+                    response.raise_for_status()
+                    self.connected = True
+                    delay = self.reconnect_delay
+                    logger.info(
+                        "Subscribed to OpenCode events on %s", self.client.base_url
+                    )
+                    async for line in response.aiter_lines():
+                        # Nobody is streaming: skip parsing
+                        if not self._subscribers or not line.startswith("data:"):
+                            continue
+                        try:
+                            event = json.loads(line[5:])
+                        except ValueError:
+                            continue
+                        for queue in self._subscribers.get(
+                            _event_session_id(event), ()
+                        ):
+                            queue.put_nowait(event)
+            except httpx.HTTPError as e:
+                metrics.ERRORS.inc(kind="event_stream")
+                logger.warning("OpenCode event stream failed: %s", e)
+            finally:
+                self.connected = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+
+class StreamAccumulator:
+    """Assemble assistant text from message.updated / message.part.updated events"""
+
+    def __init__(self):
+        self._roles: Dict[str, str] = {}
+        # part_id -> (message_id, text), in arrival order
+        self._parts: Dict[str, tuple] = {}
+
+    def feed(self, event: dict) -> bool:
+        """Apply one event; return True if the assembled text changed"""
+        event_type = event.get("type")
+        props = event.get("properties") or {}
+
+        if event_type == "message.updated":
+            info = props.get("info") or {}
+            if info.get("id"):
+                self._roles[info["id"]] = info.get("role", "")
+            return False
+
+        if event_type != "message.part.updated":
+            return False
+
+        part = props.get("part") or {}
+        if part.get("type") != "text" or part.get("synthetic"):
+            return False
+
+        message_id = part.get("messageID")
+        # The user's own prompt is echoed back as a text part too
+        if self._roles.get(message_id) == "user":
+            return False
+
+        previous = self._parts.get(part.get("id"), (None, ""))[1]
+        if "text" in part:
+            text = part["text"]
+        else:
+            text = previous + (props.get("delta") or "")
+        if text == previous:
+            return False
+        self._parts[part.get("id")] = (message_id, text)
+        return True
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(
+            text
+            for message_id, text in self._parts.values()
+            if self._roles.get(message_id) != "user" and text
+        )
+
+
+class ThrottledMessageEditor:
+    """Keep one Telegram message in sync with a growing text, rate limited"""
+
+    def __init__(
+        self, outbound: OutboundScheduler, chat_id: int, min_interval: float = 1.5
+    ):
+        self._outbound = outbound
+        self._chat_id = chat_id
+        self._min_interval = min_interval
+        self._message_id: Optional[int] = None
+        self._shown = ""
+        self._pending: Optional[str] = None
+        self._next_edit = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def start(self, text: str = PLACEHOLDER_TEXT) -> None:
+        """Send the placeholder message that later edits will replace"""
+        message = await self._outbound.send_message(
+            self._chat_id, text, priority=NORMAL
+        )
+        self._message_id = message.message_id
+        self._shown = text
+        self._next_edit = time.monotonic() + self._min_interval
+
+    async def update(self, text: str) -> None:
+        """Show text soon, coalescing updates that arrive faster than the limit"""
+        self._pending = text
+        delay = self._next_edit - time.monotonic()
+        if delay <= 0:
+            await self._flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later(delay))
+
+    async def finish(self, text: str) -> None:
+        """Replace the message with the final text"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._pending = text
+        retry_after = await self._flush(final=True)
+        if retry_after:
+            # The final answer must land, so wait out the rate limit once
+            await asyncio.sleep(retry_after)
+            self._pending = text
+            await self._flush(final=True)
+
+    async def _flush_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        await self._flush()
+
+    async def _flush(self, final: bool = False) -> float:
+        """Edit the message to the pending text; return retry_after if limited"""
+        async with self._lock:
+            text = self._pending
+            self._pending = None
+            if not text or self._message_id is None:
+                return 0.0
+            if len(text) > MAX_EDIT_LENGTH:
+                if final:
+                    metrics.TRUNCATIONS.inc()
+                text = text[:MAX_EDIT_LENGTH] + (
+                    "\n\n... (response truncated)" if final else " …"
+                )
+            if text == self._shown:
+                return 0.0
+            try:
+                await self._outbound.edit_message_text(
+                    self._chat_id,
+                    self._message_id,
+                    text,
+                    priority=FINAL if final else PROGRESS,
+                )
+                self._shown = text
+            except RetryAfter as e:
+                metrics.RETRIES.inc(kind="telegram_retry_after")
+                logger.warning("Edit rate limited for chat %s: %s", self._chat_id, e)
+                self._next_edit = time.monotonic() + float(e.retry_after)
+                return float(e.retry_after)
+            except BadRequest as e:
+                # "Message is not modified" and similar are harmless here
+                logger.debug("Edit rejected for chat %s: %s", self._chat_id, e)
+            self._next_edit = time.monotonic() + self._min_interval
+            return 0.0
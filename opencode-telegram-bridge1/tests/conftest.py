@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# The bridge modules live flat in the directory above
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# engine reads its settings at import; keep its state out of the working tree
+_state = tempfile.mkdtemp(prefix="bridge-tests-")
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ.setdefault("SESSION_STORE", "memory")
+os.environ.setdefault("FILE_CACHE_DIR", os.path.join(_state, "file_cache"))
+os.environ.setdefault("JOB_DB_PATH", os.path.join(_state, "jobs.db"))
@@ -0,0 +1,63 @@
+import os
+import asyncio
+
+import pytest
+
+from attachments import Attachment, FileCache, FileTooLarge
+
+
+def attachment(key: str, size: int = 10) -> Attachment:
+    return Attachment(f"id_{key}", key, f"{key}.txt", "text/plain", size)
+
+
+def cache_with(directory, keys, **options) -> FileCache:
+    """A cache indexing files already on disk, oldest first"""
+    for age, key in enumerate(reversed(keys)):
+        path = directory / key
+        path.write_bytes(b"x" * 10)
+        os.utime(path, (1000 - age, 1000 - age))
+    return FileCache(None, str(directory), **options)
+
+
+def run(cache: FileCache, coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await cache.close()
+
+    return asyncio.run(main())
+
+
+def test_pinned_files_are_not_evicted(tmp_path):
+    cache = cache_with(tmp_path, ["a", "b"])
+    run(cache, cache.fetch_all([attachment("a")]))
+    cache.max_bytes = 10
+    cache._evict()
+    assert os.path.exists(tmp_path / "a")
+    assert not os.path.exists(tmp_path / "b")
+    cache.max_bytes = 0
+    cache._evict()
+    assert os.path.exists(tmp_path / "a")
+
+
+def test_release_evicts_files_kept_while_pinned(tmp_path):
+    cache = cache_with(tmp_path, ["a"])
+    run(cache, cache.fetch(attachment("a")))
+    run(cache, cache.fetch(attachment("a")))
+    cache.max_bytes = 0
+    cache._evict()
+    cache.release([attachment("a")])
+    assert os.path.exists(tmp_path / "a")
+    cache.release([attachment("a")])
+    assert not os.path.exists(tmp_path / "a")
+    assert cache.size == 0
+
+
+def test_failed_fetch_all_pins_nothing(tmp_path):
+    cache = cache_with(tmp_path, ["a"], max_file_bytes=100)
+    with pytest.raises(FileTooLarge):
+        run(cache, cache.fetch_all([attachment("a"), attachment("big", 1000)]))
+    cache.max_bytes = 0
+    cache._evict()
+    assert not os.path.exists(tmp_path / "a")
@@ -0,0 +1,53 @@
+import pytest
+
+from delivery import MAX_MESSAGE_LENGTH, split_message
+
+TEXTS = [
+    "short answer",
+    "word " * 3000,
+    "x" * 9000,
+    "\n\n".join(["paragraph " * 50] * 40),
+    "```python\n" + "print(1)\n" * 2000 + "```\nafter",
+    "```" + "a" * 5000,
+    "```" + "a" * 5000 + "\n" + "b " * 5000,
+    "``````````````` " + "lang" * 50 + "\n" + "code\n" * 3000,
+]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_chunks_fit_the_limit(text):
+    chunks = split_message(text)
+    assert all(0 < len(chunk) <= MAX_MESSAGE_LENGTH for chunk in chunks)
+
+
+@pytest.mark.parametrize("limit", [100, 500, 4000])
+def test_chunks_fit_smaller_limits(limit):
+    for text in TEXTS:
+        assert all(len(chunk) <= limit for chunk in split_message(text, limit))
+
+
+def test_short_text_is_one_chunk():
+    assert split_message("hello") == ["hello"]
+
+
+def test_plain_text_is_kept_whole():
+    text = "\n\n".join(f"paragraph {i} " + "words " * 100 for i in range(60))
+    chunks = split_message(text)
+    assert len(chunks) > 1
+    assert "".join(chunks) == text
+
+
+def test_cut_code_block_is_closed_and_reopened():
+    chunks = split_message("```python\n" + "x = 1\n" * 2000 + "```")
+    assert len(chunks) > 1
+    for chunk in chunks[:-1]:
+        assert chunk.endswith("\n```")
+    for chunk in chunks[1:]:
+        assert chunk.startswith("```python\n")
+
+
+def test_long_fence_line_is_reopened_short():
+    chunks = split_message("```" + "a" * 5000)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= MAX_MESSAGE_LENGTH for chunk in chunks)
+    assert len(chunks[1].split("\n", 1)[0]) < 40
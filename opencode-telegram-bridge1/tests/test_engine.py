@@ -0,0 +1,141 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+import engine
+from backends import BackendUnavailable
+from engine import BridgeEngine
+from mini_http import server_port
+from mock_opencode import start_mock_opencode
+from mock_telegram import start_fake_telegram
+from updates import parse_update
+
+GROUP = -100
+
+
+@asynccontextmanager
+async def running_bridge(monkeypatch, latency=0.05, **settings):
+    """A started BridgeEngine against a mock OpenCode and fake Telegram"""
+    mock, opencode = await start_mock_opencode(latency=latency, tokens=1)
+    fake, telegram = await start_fake_telegram()
+    monkeypatch.setattr(
+        engine, "OPENCODE_URLS", [f"http://127.0.0.1:{server_port(opencode)}"]
+    )
+    monkeypatch.setattr(
+        engine, "TELEGRAM_API_URL", f"http://127.0.0.1:{server_port(telegram)}/bot"
+    )
+    for name, value in settings.items():
+        monkeypatch.setattr(engine, name, value)
+    bridge = BridgeEngine()
+    fake.sent = []
+    fake.on_outbound = lambda method, params, _: fake.sent.append(
+        (method, params.get("chat_id"), params.get("text") or "")
+    )
+    await bridge.start()
+    try:
+        yield bridge, mock, fake
+    finally:
+        await bridge.stop()
+        opencode.close()
+        telegram.close()
+
+
+def test_single_backend_outage_keeps_the_session(monkeypatch):
+    async def scenario():
+        async with running_bridge(monkeypatch) as (bridge, mock, fake):
+            backend = bridge.backends.backends[0]
+            bridge.user_sessions.set(1, "ses_old")
+
+            async def unreachable(backend, session_id):
+                backend.mark_down("connection refused")
+                raise BackendUnavailable(backend, ConnectionError("refused"))
+
+            with pytest.raises(BackendUnavailable):
+                await bridge.run_in_session(1, unreachable)
+            # Nowhere to fail over to, so the session is neither dropped nor reaped
+            assert bridge.user_sessions.get(1) == "ses_old"
+            assert bridge.reaper.pending == 0
+
+            # The next answered request brings the backend back
+            session_id = await bridge.create_opencode_session(backend)
+            backend.mark_down("connection refused")
+            await bridge.send_to_opencode(backend, session_id, "hi", user_id=1)
+            assert backend.healthy
+
+    asyncio.run(scenario())
+
+
+def send(bridge, fake, chat_id, user_id, text):
+    bridge.dispatch(parse_update(fake.build_update(chat_id, user_id, text)))
+
+
+async def replies(fake, count, timeout=5.0):
+    """Texts of the first count messages the bot sent, once they are all in"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        texts = [text for method, _, text in fake.sent if method == "sendMessage"]
+        if len(texts) >= count or loop.time() > deadline:
+            return texts
+        await asyncio.sleep(0.05)
+
+
+def test_group_members_are_coalesced_separately(monkeypatch):
+    async def scenario():
+        async with running_bridge(monkeypatch, COALESCE_WINDOW=0.2) as (
+            bridge,
+            mock,
+            fake,
+        ):
+            send(bridge, fake, GROUP, 1, "alpha")
+            send(bridge, fake, GROUP, 2, "beta")
+            send(bridge, fake, GROUP, 1, "gamma")
+            texts = await replies(fake, 2)
+            assert len(texts) == 2
+            assert any("alpha" in t and "gamma" in t and "beta" not in t for t in texts)
+            assert any("beta" in t and "alpha" not in t for t in texts)
+            assert bridge.user_sessions.get(1) != bridge.user_sessions.get(2)
+
+    asyncio.run(scenario())
+
+
+def test_cancel_in_a_group_only_stops_the_senders_reply(monkeypatch):
+    async def scenario():
+        async with running_bridge(monkeypatch, latency=0.5) as (bridge, mock, fake):
+            send(bridge, fake, GROUP, 1, "alpha")
+            send(bridge, fake, GROUP, 2, "beta")
+            send(bridge, fake, GROUP, 2, "queued")
+            await asyncio.sleep(0.2)
+            send(bridge, fake, GROUP, 2, "/cancel")
+            # Long enough for the cancelled replies to have come in too
+            await asyncio.sleep(1.0)
+            texts = await replies(fake, 2)
+            assert any("alpha" in t for t in texts)
+            assert not any("beta" in t or "queued" in t for t in texts)
+            assert "🛑 Cancelled." in texts
+
+    asyncio.run(scenario())
+
+
+def test_cancel_in_a_group_only_stops_the_senders_job(monkeypatch, tmp_path):
+    async def scenario():
+        async with running_bridge(
+            monkeypatch,
+            latency=0.5,
+            JOB_MODE=True,
+            JOB_WORKERS=2,
+            JOB_DB_PATH=str(tmp_path / "jobs.db"),
+            TELEGRAM_GROUP_RATE=100.0,
+        ) as (bridge, mock, fake):
+            send(bridge, fake, GROUP, 1, "alpha")
+            send(bridge, fake, GROUP, 2, "beta")
+            # Both jobs are running, one per worker, when user 1 cancels
+            await asyncio.sleep(0.3)
+            send(bridge, fake, GROUP, 1, "/cancel")
+            await asyncio.sleep(1.0)
+            texts = await replies(fake, 4)
+            assert any("done" in t and "beta" in t for t in texts)
+            assert not any("done" in t and "alpha" in t for t in texts)
+
+    asyncio.run(scenario())
@@ -0,0 +1,13 @@
+import pytest
+
+from job_queue import JobQueue
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+@pytest.mark.parametrize("job_id", [0, 2**63, 10**20])
+def test_get_out_of_range_id_finds_nothing(jobs, job_id):
+    assert jobs.get(job_id, user_id=1) is None
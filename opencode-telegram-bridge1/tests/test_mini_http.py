@@ -0,0 +1,88 @@
+import asyncio
+
+import mini_http
+from mini_http import Response, server_port
+
+REQUEST = b"POST /x HTTP/1.1\r\nContent-Length: 2\r\n\r\nhi"
+
+
+async def echo(request):
+    return Response(request.body)
+
+
+def run(scenario, **options):
+    async def main():
+        server = await mini_http.serve(echo, **options)
+        try:
+            await scenario(server_port(server))
+        finally:
+            server.close()
+
+    asyncio.run(main())
+
+
+async def status(reader) -> int:
+    line = await asyncio.wait_for(reader.readline(), 2)
+    return int(line.split()[1])
+
+
+def test_keep_alive_serves_several_requests():
+    async def scenario(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for _ in range(3):
+            writer.write(REQUEST)
+            assert await status(reader) == 200
+            await reader.readuntil(b"\r\n\r\n")
+            assert await reader.readexactly(2) == b"hi"
+        writer.close()
+
+    run(scenario)
+
+
+def test_slow_headers_get_408():
+    async def scenario(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"POST /x HTTP/1.1\r\n")
+        assert await status(reader) == 408
+        writer.close()
+
+    run(scenario, header_timeout=0.1)
+
+
+def test_slow_body_gets_408():
+    async def scenario(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"POST /x HTTP/1.1\r\nContent-Length: 10\r\n\r\nhi")
+        assert await status(reader) == 408
+        writer.close()
+
+    run(scenario, body_timeout=0.1)
+
+
+def test_idle_connection_is_closed():
+    async def scenario(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(REQUEST)
+        assert await status(reader) == 200
+        await reader.readuntil(b"\r\n\r\n")
+        await reader.readexactly(2)
+        assert await asyncio.wait_for(reader.read(), 2) == b""
+        writer.close()
+
+    run(scenario, idle_timeout=0.1)
+
+
+def test_connections_over_the_limit_get_503():
+    async def scenario(port):
+        first = await asyncio.open_connection("127.0.0.1", port)
+        second = await asyncio.open_connection("127.0.0.1", port)
+        reader, writer = second
+        assert await status(reader) == 503
+        writer.close()
+        # The first connection is still served
+        reader, writer = first
+        writer.write(REQUEST)
+        assert await status(reader) == 200
+        writer.close()
+
+    run(scenario, max_connections=1)
@@ -0,0 +1,64 @@
+import json
+import asyncio
+
+from offset_store import OffsetStore
+
+
+def test_missing_file_starts_from_zero(tmp_path):
+    store = OffsetStore(str(tmp_path / "offset.json"))
+    assert store.offset == 0
+    assert store.begin(1)
+
+
+def test_corrupt_file_is_ignored(tmp_path):
+    path = tmp_path / "offset.json"
+    path.write_text("{not json")
+    store = OffsetStore(str(path))
+    assert store.offset == 0
+    assert store.begin(1)
+
+
+def test_restart_resumes_after_the_last_fetched_update(tmp_path):
+    path = str(tmp_path / "offset.json")
+    store = OffsetStore(path)
+    for update_id in (10, 11, 12):
+        assert store.begin(update_id)
+    store.done(10)
+    store.done(11)
+    store.close()
+    assert json.loads(open(path).read())["offset"] == 13
+
+    restarted = OffsetStore(path)
+    assert restarted.offset == 13
+    assert restarted.begin(13)
+
+
+def test_updates_below_the_stored_offset_are_replays(tmp_path):
+    path = str(tmp_path / "offset.json")
+    store = OffsetStore(path)
+    store.begin(20)
+    store.done(20)
+    store.close()
+
+    restarted = OffsetStore(path)
+    assert not restarted.begin(20)
+    assert not restarted.begin(5)
+    assert restarted.begin(21)
+    assert restarted.inflight == 1
+
+
+def test_update_in_flight_is_not_started_twice(tmp_path):
+    store = OffsetStore(str(tmp_path / "offset.json"))
+    assert store.begin(7)
+    assert not store.begin(7)
+    assert store.inflight == 1
+
+
+def test_flush_writes_only_when_changed(tmp_path):
+    path = tmp_path / "offset.json"
+    store = OffsetStore(str(path))
+    asyncio.run(store.flush())
+    assert not path.exists()
+    store.begin(3)
+    asyncio.run(store.flush())
+    assert json.loads(path.read_text())["offset"] == 4
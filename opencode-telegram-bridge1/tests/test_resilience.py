@@ -0,0 +1,233 @@
+import asyncio
+
+import pytest
+
+import resilience
+from resilience import AdaptiveLimiter, CircuitBreaker, CircuitOpen, Overloaded
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_acquire_within_limit_does_not_wait():
+    async def scenario():
+        limiter = AdaptiveLimiter(max_limit=2)
+        await limiter.acquire("a")
+        await limiter.acquire("b")
+        assert limiter.inflight == 2
+        assert limiter.queued == 0
+        limiter.release(flow="a")
+        assert limiter.inflight == 1
+
+    run(scenario())
+
+
+def test_release_hands_the_slot_to_a_waiter():
+    async def scenario():
+        limiter = AdaptiveLimiter(max_limit=1)
+        await limiter.acquire("a")
+        waiting = asyncio.create_task(limiter.acquire("b"))
+        await settle()
+        assert not waiting.done()
+        assert limiter.queued == 1
+        limiter.release(flow="a")
+        await asyncio.wait_for(waiting, 1)
+        assert limiter.inflight == 1
+        assert limiter.queued == 0
+
+    run(scenario())
+
+
+def test_failure_cuts_the_limit_once_per_congestion_event(clock):
+    limiter = AdaptiveLimiter(max_limit=8, backoff=0.5)
+    for _ in range(2):
+        limiter._grant(None)
+    limiter.release(failed=True)
+    limiter.release(failed=True)
+    assert limiter.limit == 4
+
+
+def test_limit_never_drops_below_the_floor(clock):
+    limiter = AdaptiveLimiter(max_limit=8, min_limit=3, backoff=0.5)
+    for _ in range(5):
+        limiter._grant(None)
+        limiter.release(failed=True)
+        clock[0] += 10
+    assert limiter.limit == 3
+
+
+def test_slow_request_cuts_the_limit():
+    limiter = AdaptiveLimiter(max_limit=8, backoff=0.5, tolerance=2.0)
+    limiter.baseline = 1.0
+    limiter._grant(None)
+    limiter.release(latency=5.0)
+    assert limiter.limit == 4
+
+
+def test_limit_grows_only_while_it_holds_requests_back():
+    limiter = AdaptiveLimiter(max_limit=8)
+    limiter.limit = 2.0
+    limiter._grant(None)
+    limiter.release(latency=1.0)
+    assert limiter.limit == 2.0
+    limiter._grant(None)
+    limiter._grant(None)
+    limiter.release(latency=1.0)
+    assert limiter.limit == 2.5
+    assert limiter.baseline == pytest.approx(1.0)
+
+
+def test_waiters_are_served_fairly_across_flows():
+    async def scenario():
+        limiter = AdaptiveLimiter(max_limit=1)
+        await limiter.acquire("x")
+        order = []
+
+        async def request(flow):
+            await limiter.acquire(flow)
+            order.append(flow)
+
+        tasks = [asyncio.create_task(request(flow)) for flow in "aaab"]
+        await settle()
+        holder = "x"
+        for _ in tasks:
+            limiter.release(flow=holder)
+            await settle()
+            holder = order[-1]
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b", "a", "a"]
+
+    run(scenario())
+
+
+def test_per_flow_cap_lets_other_flows_through():
+    async def scenario():
+        limiter = AdaptiveLimiter(max_limit=4)
+        await limiter.acquire("a", max_inflight=1)
+        capped = asyncio.create_task(limiter.acquire("a", max_inflight=1))
+        await settle()
+        assert not capped.done()
+        await asyncio.wait_for(limiter.acquire("b"), 1)
+        limiter.release(flow="a")
+        await asyncio.wait_for(capped, 1)
+
+    run(scenario())
+
+
+def test_full_queue_sheds_the_newcomer():
+    async def scenario():
+        limiter = AdaptiveLimiter(max_limit=1, max_queue=1)
+        await limiter.acquire("a")
+        waiting = asyncio.create_task(limiter.acquire("b"))
+        await settle()
+        with pytest.raises(Overloaded):
+            await limiter.acquire("c")
+        waiting.cancel()
+
+    run(scenario())
+
+
+def test_full_queue_drops_the_busiest_flow_for_a_quieter_one():
+    async def scenario():
+        limiter = AdaptiveLimiter(max_limit=1, max_queue=2)
+        await limiter.acquire("a")
+        first = asyncio.create_task(limiter.acquire("a"))
+        second = asyncio.create_task(limiter.acquire("a"))
+        await settle()
+        newcomer = asyncio.create_task(limiter.acquire("b"))
+        await settle()
+        with pytest.raises(Overloaded):
+            await second
+        assert not first.done()
+        assert not newcomer.done()
+        limiter.release(flow="a")
+        await asyncio.wait_for(first, 1)
+        limiter.release(flow="a")
+        await asyncio.wait_for(newcomer, 1)
+
+    run(scenario())
+
+
+def test_queue_timeout_raises_overloaded():
+    async def scenario():
+        limiter = AdaptiveLimiter(max_limit=1, queue_timeout=0.01)
+        await limiter.acquire("a")
+        with pytest.raises(Overloaded):
+            await limiter.acquire("b")
+        assert limiter.queued == 0
+        assert limiter.inflight == 1
+
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        limiter = AdaptiveLimiter(max_limit=1)
+        await limiter.acquire("a")
+        waiting = asyncio.create_task(limiter.acquire("b"))
+        await settle()
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert limiter.queued == 0
+        limiter.release(flow="a")
+        assert limiter.inflight == 0
+
+    run(scenario())
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+        breaker.check()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpen) as error:
+        breaker.check()
+    assert error.value.retry_in == pytest.approx(30)
+
+
+def test_breaker_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_lets_one_probe_through_after_the_timeout(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock[0] += 31
+    breaker.check()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.check()
+
+
+def test_breaker_reopens_when_the_probe_fails(clock):
+    breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        breaker.record_failure()
+    clock[0] += 31
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.check()
@@ -0,0 +1,139 @@
+import pytest
+
+import session_store
+from session_store import MemorySessionStore, SqliteSessionStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_store.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    """Build a store of either kind, recording what on_remove reports"""
+    stores = []
+
+    def make(**options):
+        removed = []
+
+        def on_remove(user_id, session_id):
+            removed.append((user_id, session_id))
+
+        if request.param == "memory":
+            store = MemorySessionStore(on_remove=on_remove, **options)
+        else:
+            path = str(tmp_path / "sessions.db")
+            store = SqliteSessionStore(path, on_remove=on_remove, **options)
+        stores.append(store)
+        return store, removed
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+def test_set_and_get(make_store, clock):
+    store, removed = make_store()
+    store.set(1, "ses_a")
+    assert store.get(1) == "ses_a"
+    assert store.get(2) is None
+    assert 1 in store and len(store) == 1
+    assert removed == []
+
+
+def test_delete_reports_the_session(make_store, clock):
+    store, removed = make_store()
+    store.set(1, "ses_a")
+    assert store.delete(1) == "ses_a"
+    assert store.delete(1) is None
+    assert store.get(1) is None
+    assert removed == [(1, "ses_a")]
+
+
+def test_replacing_a_session_reports_the_old_one(make_store, clock):
+    store, removed = make_store()
+    store.set(1, "ses_a")
+    store.set(1, "ses_a")
+    store.set(1, "ses_b")
+    assert store.get(1) == "ses_b"
+    assert removed == [(1, "ses_a")]
+
+
+def test_full_store_evicts_the_least_recently_used(make_store, clock):
+    store, removed = make_store(max_entries=2)
+    store.set(1, "ses_a")
+    store.set(2, "ses_b")
+    clock[0] += 1
+    store.get(1)
+    store.set(3, "ses_c")
+    assert store.get(2) is None
+    assert store.get(1) == "ses_a" and store.get(3) == "ses_c"
+    assert removed == [(2, "ses_b")]
+
+
+def test_idle_sessions_expire(make_store, clock):
+    store, removed = make_store(ttl=60)
+    store.set(1, "ses_a")
+    store.set(2, "ses_b")
+    clock[0] += 30
+    store.get(2)
+    clock[0] += 40
+    assert store.evict_idle() == [(1, "ses_a")]
+    assert store.get(1) is None
+    assert store.get(2) == "ses_b"
+    assert removed == [(1, "ses_a")]
+
+
+def test_expired_session_is_dropped_on_lookup(make_store, clock):
+    store, removed = make_store(ttl=60)
+    store.set(1, "ses_a")
+    clock[0] += 61
+    assert store.get(1) is None
+    assert removed == [(1, "ses_a")]
+
+
+def test_sqlite_store_survives_a_restart(tmp_path, clock):
+    path = str(tmp_path / "sessions.db")
+    store = SqliteSessionStore(path)
+    store.set(1, "ses_a")
+    store.set(2, "ses_b")
+    store.delete(2)
+    clock[0] += 10
+    store.get(1)
+    store.close()
+
+    reopened = SqliteSessionStore(path)
+    assert list(reopened.items()) == [(1, "ses_a", 1010.0)]
+    reopened.close()
+
+
+def test_sqlite_store_expires_idle_sessions_at_startup(tmp_path, clock):
+    path = str(tmp_path / "sessions.db")
+    store = SqliteSessionStore(path)
+    store.set(1, "ses_a")
+    store.close()
+    clock[0] += 120
+    removed = []
+    reopened = SqliteSessionStore(
+        path, ttl=60, on_remove=lambda user_id, session_id: removed.append(session_id)
+    )
+    assert len(reopened) == 0
+    assert removed == ["ses_a"]
+    reopened.close()
+
+
+def test_sqlite_store_only_loads_owned_users(tmp_path, clock):
+    path = str(tmp_path / "sessions.db")
+    store = SqliteSessionStore(path)
+    store.set(1, "ses_a")
+    store.set(2, "ses_b")
+    store.close()
+
+    odd = SqliteSessionStore(path, owns=lambda user_id: user_id % 2 == 1)
+    assert odd.get(1) == "ses_a" and odd.get(2) is None
+    # values() still sees every process's sessions, for orphan reconciliation
+    assert sorted(odd.values()) == ["ses_a", "ses_b"]
+    odd.close()
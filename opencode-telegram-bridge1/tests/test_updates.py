@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from mock_telegram import FakeTelegram
+from updates import decode_update, parse_update
+
+
+def media_update(kind: str, media) -> dict:
+    update = FakeTelegram().build_update(1, 1, "")
+    message = update["message"]
+    del message["text"]
+    message[kind] = media
+    message["caption"] = "what is this?"
+    return update
+
+
+DOCUMENT = {"file_id": "BQAC", "file_unique_id": "AgAD", "file_name": "a.txt"}
+PHOTO = [{"file_id": "AgAC", "file_unique_id": "AQAD", "width": 90, "height": 90}]
+VIDEO = {"file_id": "BAAC", "file_unique_id": "AgAE", "duration": 3}
+VOICE = {"file_id": "AwAC", "file_unique_id": "AgAF", "duration": 2}
+
+
+def test_text_message():
+    update = parse_update(FakeTelegram().build_update(5, 7, "hello"))
+    assert (update.chat_id, update.user_id, update.text) == (5, 7, "hello")
+    assert update.file is None
+
+
+@pytest.mark.parametrize("kind, media", [("document", DOCUMENT), ("photo", PHOTO)])
+def test_caption_of_a_forwarded_file_is_the_prompt(kind, media):
+    update = parse_update(media_update(kind, media))
+    assert update.text == "what is this?"
+    assert update.file is not None
+
+
+@pytest.mark.parametrize("kind, media", [("video", VIDEO), ("voice", VOICE)])
+def test_captioned_media_without_a_file_is_ignored(kind, media):
+    data = media_update(kind, media)
+    assert parse_update(data) is None
+    # The webhook prefilter agrees
+    assert decode_update(json.dumps(data).encode()) is None
@@ -0,0 +1,44 @@
+import json
+import asyncio
+
+from mini_http import Request
+from mock_telegram import FakeTelegram
+from webhook_ingress import WebhookIngress
+
+
+class FailingBridge:
+    def __init__(self):
+        self.dispatched = []
+
+    def dispatch(self, update):
+        self.dispatched.append(update)
+        if len(self.dispatched) == 1:
+            raise RuntimeError("dispatch failed")
+
+
+def delivery(telegram: FakeTelegram, text: str) -> Request:
+    body = json.dumps(telegram.build_update(1, 1, text)).encode()
+    return Request("POST", "/webhook", {}, body)
+
+
+def test_failed_dispatch_does_not_stop_the_consumer():
+    async def scenario():
+        bridge = FailingBridge()
+        ingress = WebhookIngress(bridge, max_pending=1)
+        ingress.start()
+        telegram = FakeTelegram()
+
+        response = await ingress.handle(delivery(telegram, "first"))
+        assert response.status == 200
+        await asyncio.wait_for(ingress._bodies.join(), 1)
+        # The failed update no longer counts against max_pending
+        assert ingress.pending == 0
+
+        response = await ingress.handle(delivery(telegram, "second"))
+        assert response.status == 200
+        await asyncio.wait_for(ingress._bodies.join(), 1)
+        assert [update.text for update in bridge.dispatched] == ["first", "second"]
+        assert ingress.pending == 1
+        await ingress.stop()
+
+    asyncio.run(scenario())
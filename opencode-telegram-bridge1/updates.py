@@ -0,0 +1,155 @@
+"""
+Lightweight Telegram update decoding
+
+The bridge only reads a few fields of the messages it answers. They are
+taken straight from the decoded JSON into a small slotted object instead of
+python-telegram-bot's full Update object graph, and updates the bridge
+ignores (edits, channel posts, stickers, service messages, ...) are dropped
+before anything is built. JSON is decoded with orjson when it is installed.
+getUpdates is called directly so its response is decoded the same way.
+"""
+
+import json
+from typing import List, Optional
+from urllib.parse import urlencode
+
+from telegram.error import RetryAfter, TelegramError
+from telegram.request import BaseRequest
+
+from attachments import Attachment, message_attachment
+
+try:
+    import orjson
+
+    loads = orjson.loads
+    dumps = orjson.dumps
+except ImportError:
+    loads = json.loads
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+
+# Update types the bridge handles; Telegram is asked not to send the others
+ALLOWED_UPDATES = ["message"]
+
+
+class MessageUpdate:
+    """The fields of a message update the bridge uses
+
+    text is the message text, or the caption of a document or photo, which
+    is then described by file.
+    """
+
+    __slots__ = (
+        "update_id",
+        "chat_id",
+        "user_id",
+        "first_name",
+        "username",
+        "text",
+        "file",
+    )
+
+    def __init__(
+        self,
+        update_id: int,
+        chat_id: int,
+        user_id: int,
+        first_name: str,
+        username: Optional[str],
+        text: str,
+        file: Optional[Attachment] = None,
+    ):
+        self.update_id = update_id
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.first_name = first_name
+        self.username = username
+        self.text = text
+        self.file = file
+
+    def to_dict(self) -> dict:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        if self.file is not None:
+            data["file"] = self.file.to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MessageUpdate":
+        file = data.pop("file", None)
+        return cls(**data, file=Attachment.from_dict(file) if file else None)
+
+
+def parse_update(data: dict) -> Optional[MessageUpdate]:
+    """MessageUpdate for a decoded update, or None if the bridge ignores it"""
+    message = data.get("message")
+    if message is None:
+        return None
+    file = message_attachment(message)
+    # A caption only counts with a file the bridge forwards, not on a video
+    # or voice message it would otherwise pass off as plain text
+    text = message.get("text") or (file and message.get("caption")) or ""
+    sender = message.get("from")
+    if not (text or file) or sender is None:
+        return None
+    return MessageUpdate(
+        data["update_id"],
+        message["chat"]["id"],
+        sender["id"],
+        sender.get("first_name", ""),
+        sender.get("username"),
+        text,
+        file,
+    )
+
+
+def may_be_message(body: bytes) -> bool:
+    """Cheap check on a raw update; False means it certainly has nothing to answer
+
+    Only a substring test, so True still needs parse_update to confirm.
+    """
+    return b'"message"' in body and (
+        b'"text"' in body or b'"document"' in body or b'"photo"' in body
+    )
+
+
+def decode_update(body: bytes) -> Optional[MessageUpdate]:
+    """MessageUpdate for a raw update body, or None if the bridge ignores it"""
+    if not may_be_message(body):
+        return None
+    return parse_update(loads(body))
+
+
+class UpdatePoller:
+    """Long-polls getUpdates and returns the raw update dicts"""
+
+    def __init__(self, base_url: str, request: BaseRequest, timeout: int = 30):
+        self.url = f"{base_url}/getUpdates"
+        self.request = request
+        self.timeout = timeout
+
+    async def initialize(self) -> None:
+        await self.request.initialize()
+
+    async def shutdown(self) -> None:
+        await self.request.shutdown()
+
+    async def fetch(self, offset: int) -> List[dict]:
+        query = urlencode(
+            {
+                "offset": offset,
+                "timeout": self.timeout,
+                "allowed_updates": json.dumps(ALLOWED_UPDATES),
+            }
+        )
+        _, payload = await self.request.do_request(
+            f"{self.url}?{query}", "GET", read_timeout=self.timeout + 10
+        )
+        data = loads(payload)
+        if not data.get("ok"):
+            retry_after = data.get("parameters", {}).get("retry_after")
+            if retry_after:
+                raise RetryAfter(retry_after)
+            raise TelegramError(data.get("description", "getUpdates failed"))
+        return data["result"]
@@ -0,0 +1,114 @@
+"""
+Webhook receiver
+
+Answers each Telegram webhook delivery as soon as its secret is checked and
+its body is queued, and decodes and dispatches the updates from the queue
+afterwards, so a burst is acknowledged well within Telegram's timeout. The
+number of updates accepted but not yet handled is bounded: past the bound
+deliveries are refused with 429 and Telegram retries them later, instead of
+the backlog growing without limit.
+"""
+
+import hmac
+import asyncio
+import logging
+from typing import Optional
+
+import metrics
+from mini_http import Request, Response
+from updates import MessageUpdate, decode_update, may_be_message
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+_OK = Response(b"")
+
+
+class WebhookIngress:
+    """mini_http handler that acknowledges updates and feeds them to a bridge
+
+    max_pending bounds updates accepted and not yet reported done through
+    done(), which must be the bridge's on_done callback.
+    """
+
+    def __init__(
+        self,
+        bridge,
+        secret: Optional[str] = None,
+        max_pending: int = 1000,
+        path: str = "/webhook",
+    ):
+        self.bridge = bridge
+        self._secret = secret.encode() if secret else None
+        self.max_pending = max_pending
+        self.path = path
+        self.pending = 0
+        self.accepting = True
+        self._bodies: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._task: Optional[asyncio.Task] = None
+
+    def _refuse(self, status: int, reason: str, **headers) -> Response:
+        metrics.WEBHOOK_REQUESTS.inc(result=reason)
+        return Response(reason, status=status, headers=headers)
+
+    async def handle(self, request: Request) -> Response:
+        if request.path != self.path:
+            return self._refuse(404, "not_found")
+        if request.method != "POST":
+            return self._refuse(405, "bad_method")
+        if self._secret is not None and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, "").encode(), self._secret
+        ):
+            return self._refuse(403, "bad_secret")
+        if not self.accepting:
+            return self._refuse(503, "stopping", **{"Retry-After": "5"})
+        if not may_be_message(request.body):
+            # Acknowledged so Telegram does not retry it, and not queued
+            metrics.IGNORED_UPDATES.inc()
+            metrics.WEBHOOK_REQUESTS.inc(result="ignored")
+            return _OK
+        if self.pending >= self.max_pending:
+            return self._refuse(429, "full", **{"Retry-After": "1"})
+        self.pending += 1
+        self._bodies.put_nowait(request.body)
+        metrics.WEBHOOK_REQUESTS.inc(result="accepted")
+        return _OK
+
+    def done(self, update: MessageUpdate) -> None:
+        self.pending -= 1
+
+    def start(self) -> None:
+        metrics.WEBHOOK_PENDING.set_function(lambda: self.pending)
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            body = await self._bodies.get()
+            try:
+                update = decode_update(body)
+                if update is None:
+                    metrics.IGNORED_UPDATES.inc()
+            except Exception as e:
+                update = None
+                metrics.ERRORS.inc(kind="webhook_decode")
+                logger.warning("Dropping undecodable webhook update: %s", e)
+            try:
+                if update is None:
+                    self.pending -= 1
+                else:
+                    self.bridge.dispatch(update)
+            except Exception as e:
+                # Never reached the bridge, so done() will not be called for it
+                self.pending -= 1
+                metrics.ERRORS.inc(kind="webhook_dispatch")
+                logger.error("Failed to dispatch webhook update: %s", e, exc_info=True)
+            finally:
+                self._bodies.task_done()
+
+    async def stop(self) -> None:
+        """Refuse new deliveries and hand every queued one to the bridge"""
+        self.accepting = False
+        if self._task is not None:
+            await self._bodies.join()
+            self._task.cancel()
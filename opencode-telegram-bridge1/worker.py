@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Bridge worker process, started by the front process when WORKERS > 1
+
+Serves the users that hash to WORKER_INDEX: reads updates from the front
+over WORKER_SOCKET, handles them with a BridgeEngine and reports each one
+done. When the front closes its side of the socket the worker drains and
+exits.
+"""
+
+import os
+import json
+import asyncio
+import logging
+
+from engine import DRAIN_TIMEOUT, BridgeEngine
+from hash_ring import HashRing
+from log_setup import setup_logging
+from sharding import FRAME_LIMIT
+from updates import MessageUpdate, loads
+
+WORKERS = int(os.environ["WORKERS"])
+WORKER_INDEX = int(os.environ["WORKER_INDEX"])
+WORKER_SOCKET = os.environ["WORKER_SOCKET"]
+
+# Configure logging
+setup_logging(f"worker-{WORKER_INDEX}")
+logger = logging.getLogger(__name__)
+
+
+async def run():
+    """Serve the front's connection until it closes, then drain and stop"""
+    ring = HashRing(range(WORKERS))
+    engine = BridgeEngine(
+        owns=lambda user_id: ring.node_for(user_id) == WORKER_INDEX,
+        # One worker is enough to look for orphaned sessions
+        reconcile=WORKER_INDEX == 0,
+    )
+    finished = asyncio.Event()
+
+    async def serve_front(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        def report_done(update: MessageUpdate) -> None:
+            if not writer.is_closing():
+                writer.write(json.dumps({"done": update.update_id}).encode() + b"\n")
+
+        engine.on_done = report_done
+        try:
+            async for line in reader:
+                engine.dispatch(MessageUpdate.from_dict(loads(line)))
+            await engine.drain(DRAIN_TIMEOUT)
+            await writer.drain()
+        finally:
+            writer.close()
+            finished.set()
+
+    await engine.start()
+    server = await asyncio.start_unix_server(
+        serve_front, WORKER_SOCKET, limit=FRAME_LIMIT
+    )
+    try:
+        await finished.wait()
+    finally:
+        server.close()
+        await engine.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())